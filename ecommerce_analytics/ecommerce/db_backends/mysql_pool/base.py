@@ -0,0 +1,55 @@
+import functools
+
+from django.db.backends.mysql import base as mysql
+
+from ..pool import get_pool
+
+# MySQL backend whose connections come from a bounded process-wide pool, configured by the POOL settings key:
+# SIZE (connections), TIMEOUT (seconds to wait for one) and MAX_LIFETIME (seconds before one is reopened).
+# Django's close() at the end of a request (CONN_MAX_AGE = 0) hands the connection back instead of closing it.
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    @property
+    def pool(self):
+        # One pool per alias and database name, the test runner switches NAME to the test database
+        options = self.settings_dict.get('POOL', {})
+        return get_pool(
+            f"{self.alias}/{self.settings_dict['NAME']}",
+            functools.partial(mysql.DatabaseWrapper.get_new_connection, self, self.get_connection_params()),
+            size=options.get('SIZE', 10),
+            timeout=options.get('TIMEOUT', 30),
+            max_lifetime=options.get('MAX_LIFETIME'),
+            is_usable=self._ping if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+        )
+
+    @staticmethod
+    def _ping(connection):
+        try:
+            connection.ping(False) # no reconnect, a dead connection is dropped from the pool instead
+        except mysql.Database.Error:
+            return False
+        return True
+
+    def get_new_connection(self, conn_params):
+        connection, self._reused = self.pool.acquire()
+        return connection
+
+    def init_connection_state(self):
+        # Session settings survive in the pooled connection, only new connections need them
+        if not getattr(self, '_reused', False):
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # A connection closed mid-transaction is discarded, any other is rolled back to autocommit and reused
+        discard = self.in_atomic_block or (self.errors_occurred and not self.is_usable())
+        if not discard and not self.autocommit:
+            try:
+                self.connection.rollback()
+                self.connection.autocommit(True)
+            except mysql.Database.Error:
+                discard = True
+        self.pool.release(self.connection, discard=discard)
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Bounded set of open DB-API connections shared by every thread of the process. Django's per-thread
+    # connection wrappers borrow one on connect() and hand it back on close(), so WSGI threads and the
+    # worker threads of async views together never hold more than `size` connections.
+
+    def __init__(self, connect, size=10, timeout=30, max_lifetime=None, is_usable=None):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout # seconds to wait for a free connection before PoolTimeout
+        self.max_lifetime = max_lifetime # seconds before a connection is closed instead of reused
+        self._is_usable = is_usable # checked when an idle connection is handed out, None skips the check
+        self._cond = threading.Condition()
+        self._idle = deque() # (connection, opened_at), most recently returned last
+        self._opened_at = {} # id(connection) -> opened_at of every open connection
+        self._connecting = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.opened = 0
+        self.discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def acquire(self):
+        # A connection, reusing an idle one when possible. Returns (connection, reused).
+        started = time.monotonic()
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and len(self._opened_at) + self._connecting >= self.size:
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No database connection became free within {self.timeout}s ({self.size} in use).")
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    connection, opened_at = self._idle.pop() # the most recently used one is the least likely to have timed out
+                    self.in_use += 1
+                else:
+                    connection = None
+                    self._connecting += 1 # reserve the slot while connecting outside the lock
+
+            if connection is None:
+                break
+            # Checked outside the lock, a health check is a round trip to the server
+            if self._expired(opened_at) or (self._is_usable is not None and not self._is_usable(connection)):
+                self.release(connection, discard=True)
+                continue
+            with self._cond:
+                self._checked_out(started, waited)
+            return connection, True
+
+        try:
+            connection = self._connect()
+        except BaseException:
+            with self._cond:
+                self._connecting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._connecting -= 1
+            self._opened_at[id(connection)] = time.monotonic()
+            self.opened += 1
+            self.in_use += 1
+            self._checked_out(started, waited)
+        return connection, False
+
+    def release(self, connection, discard=False):
+        # Hand a connection back, discard=True closes it (broken, or in an unknown transaction state)
+        with self._cond:
+            self.in_use -= 1
+            opened_at = self._opened_at.get(id(connection))
+            if discard or opened_at is None or self._expired(opened_at):
+                self._discard(connection)
+            else:
+                self._idle.append((connection, opened_at))
+            self._cond.notify()
+
+    def close_idle(self):
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': len(self._opened_at),
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'opened': self.opened,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'wait_ms': self.wait_time * 1000,
+                'mean_wait_ms': self.wait_time / self.waits * 1000 if self.waits else 0,
+                'timeouts': self.timeouts,
+            }
+
+    def _checked_out(self, started, waited):
+        self.checkouts += 1
+        if waited:
+            self.wait_time += time.monotonic() - started
+
+    def _expired(self, opened_at):
+        return self.max_lifetime is not None and time.monotonic() - opened_at >= self.max_lifetime
+
+    def _discard(self, connection):
+        # Called with the lock held
+        self._opened_at.pop(id(connection), None)
+        self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass # already broken
+
+
+pools = {} # name -> ConnectionPool
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, connect, **options):
+    # The process-wide pool of a database, created by the first connection that needs it
+    with _pools_lock:
+        if name not in pools:
+            pools[name] = ConnectionPool(connect, **options)
+        return pools[name]
+
+
+def pool_stats():
+    return {name: pool.stats() for name, pool in sorted(pools.items())}
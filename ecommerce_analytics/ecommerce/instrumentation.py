@@ -0,0 +1,212 @@
+import functools
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .db_backends.pool import pool_stats
+from .routers import replica_status
+from .services.low_stock import low_stock_alerts
+
+logger = logging.getLogger(__name__)
+
+_current_request = ContextVar('instrumented_request', default=None)
+_current_spans = ContextVar('instrumented_spans', default=()) # QuerySpans of the service calls running in this context
+
+
+class RollingStats:
+    # Keeps the last `window` samples per key and reports latency percentiles on demand,
+    # so recording a sample is just a deque append under a lock
+
+    def __init__(self, window=None):
+        self.window = window or getattr(settings, 'INSTRUMENTATION_WINDOW', 1000)
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._totals = defaultdict(int)
+
+    def record(self, key, duration, queries=0, db_time=0.0):
+        with self._lock:
+            self._samples[key].append((duration, queries, db_time))
+            self._totals[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+            totals = dict(self._totals)
+        return {key: self._summarise(values, totals[key]) for key, values in sorted(samples.items())}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+    @staticmethod
+    def _summarise(values, total):
+        durations = sorted(duration for duration, _, _ in values)
+        percentile = lambda p: durations[min(len(durations) - 1, int(p * len(durations)))] * 1000
+        return {
+            'count': total,
+            'window': len(values),
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'mean_ms': sum(durations) / len(durations) * 1000,
+            'mean_queries': sum(queries for _, queries, _ in values) / len(values),
+            'mean_db_ms': sum(db_time for _, _, db_time in values) / len(values) * 1000,
+        }
+
+
+request_stats = RollingStats()
+service_stats = RollingStats()
+
+
+class QueryRecorder:
+    # Database execute wrapper counting queries, summing their time and keeping the slowest few
+
+    def __init__(self, keep_slowest=5):
+        self.keep_slowest = keep_slowest
+        self._lock = threading.Lock() # async views run queries of one request on several threads
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = [] # min-heap of (duration, sql)
+        self.spans = [] # (name, duration) of instrumented service calls
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.count += 1
+                self.total_time += duration
+                if len(self.slowest) < self.keep_slowest:
+                    heapq.heappush(self.slowest, (duration, sql))
+                elif duration > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, (duration, sql))
+
+    def slowest_queries(self):
+        return [{'ms': duration * 1000, 'sql': sql} for duration, sql in sorted(self.slowest, reverse=True)]
+
+
+class QuerySpan:
+    # Queries run while one instrumented service call was executing
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+
+
+def _record_query(execute, sql, params, many, context):
+    # Execute wrapper on every connection, queries are recorded while the calling context belongs to a request
+    # or an instrumented service call. The context follows into sync_to_async threads, so queries of async views
+    # are counted too.
+    recorder, spans = _current_request.get(), _current_spans.get()
+    if recorder is None and not spans:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return recorder(execute, sql, params, many, context) if recorder is not None else execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for span in spans:
+            span.count += 1
+            span.total_time += duration
+
+
+def install_query_recorder(connection, **kwargs):
+    # Inserted first so execute_wrapper() blocks opened around it still pop their own wrapper
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class RequestInstrumentationMiddleware:
+    # Records wall time, query count, DB time and the slowest queries of every request.
+    # Adds a Server-Timing header and feeds the per-route rolling stats. Works under WSGI and ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.keep_slowest = getattr(settings, 'INSTRUMENTATION_SLOW_QUERIES', 5)
+        self.slow_request_ms = getattr(settings, 'INSTRUMENTATION_SLOW_REQUEST_MS', 1000)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all(): # connections opened before the receiver was connected
+            install_query_recorder(connection)
+        recorder = QueryRecorder(self.keep_slowest)
+        token = _current_request.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self._finish(request, response, recorder, started)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(self.keep_slowest)
+        token = _current_request.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_request.reset(token)
+        return self._finish(request, response, recorder, started)
+
+    def _finish(self, request, response, recorder, started):
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        route = f"{request.method} /{match.route}" if match else f"{request.method} <unresolved>"
+        request_stats.record(route, duration, recorder.count, recorder.total_time)
+
+        timings = [f'total;dur={duration * 1000:.1f}', f'db;dur={recorder.total_time * 1000:.1f};desc="{recorder.count} queries"']
+        timings += [f'{name};dur={span * 1000:.1f}' for name, span in recorder.spans]
+        response['Server-Timing'] = ', '.join(timings)
+
+        if duration * 1000 >= self.slow_request_ms:
+            logger.warning("Slow request %s took %.0fms with %d queries (%.0fms in DB), slowest: %s",
+                           route, duration * 1000, recorder.count, recorder.total_time * 1000, recorder.slowest_queries())
+        return response
+
+
+def instrumented(func):
+    # Time a service method and the queries it runs into the service stats and the current request's
+    # Server-Timing spans. Returned querysets stay lazy, their SQL is counted by the request when the
+    # caller evaluates them.
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        span = QuerySpan()
+        token = _current_spans.set(_current_spans.get() + (span,))
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - started
+            _current_spans.reset(token)
+            service_stats.record(name, duration, span.count, span.total_time)
+            recorder = _current_request.get()
+            if recorder is not None:
+                recorder.spans.append((name.replace('.', '-'), duration))
+    return wrapper
+
+
+def stats():
+    # Current per-route and per-service rolling statistics, the database connection pools' counters, the read replica's
+    # health and the low-stock alert counters
+    return {'routes': request_stats.snapshot(), 'services': service_stats.snapshot(), 'connection_pools': pool_stats(),
+            'read_replica': replica_status.stats(), 'low_stock_alerts': low_stock_alerts.stats()}
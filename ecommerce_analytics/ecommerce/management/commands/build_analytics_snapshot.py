@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.services.columnar_engine import ColumnarEngine
+from ecommerce.services.columnar_snapshot import SnapshotError
+
+
+class Command(BaseCommand):
+    help = "Write a memory-mapped snapshot of every order line for the columnar engine, or append new lines to its delta file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help="Snapshot directory, defaults to ANALYTICS_SNAPSHOT_DIR")
+        parser.add_argument('--delta', action='store_true', help="Append the lines added since the current snapshot and delta instead of writing a new snapshot")
+        parser.add_argument('--keep', type=int, default=2, help="Snapshots kept in the directory, including the new one")
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or settings.ANALYTICS_SNAPSHOT_DIR
+        if not directory:
+            raise CommandError("Set ANALYTICS_SNAPSHOT_DIR or pass --directory.")
+        engine = ColumnarEngine(snapshot_dir=directory)
+        started = time.perf_counter()
+        if options['delta']:
+            try:
+                lines = engine.append_delta()
+            except SnapshotError as error:
+                raise CommandError(str(error))
+            self.stdout.write(self.style.SUCCESS(f"Appended {lines} order lines to the delta in {time.perf_counter() - started:.2f}s."))
+        else:
+            path = engine.write_snapshot(keep=max(options['keep'], 1))
+            self.stdout.write(self.style.SUCCESS(f"Wrote {path} in {time.perf_counter() - started:.2f}s."))
@@ -0,0 +1,134 @@
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ecommerce.models import Category, Customer, Inventory, Order, OrderItem, Product
+
+COUNTRIES = ['US', 'UK', 'IN', 'DE', 'FR', 'CA', 'AU', 'BR', 'JP', 'ES']
+STATUSES = ['PENDING', 'SHIPPED', 'DELIVERED', 'CANCELLED']
+
+
+def next_id(model):
+    # Explicit primary keys let every backend (including MySQL) bulk insert rows that reference each other
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic catalog, customers, orders and order items with bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order-lines', type=int, default=10000, help="Order items to generate (10k to 10M)")
+        parser.add_argument('--customers', type=int, help="Customers to generate, defaults to one per 20 order lines")
+        parser.add_argument('--products', type=int, help="Products to generate, defaults to one per 500 order lines (at least 50)")
+        parser.add_argument('--categories', type=int, default=20, help="Categories to generate")
+        parser.add_argument('--days', type=int, default=365, help="Spread order dates over this many past days")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed for reproducible data sets")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows per bulk_create")
+        parser.add_argument('--skip-derived', action='store_true', help="Do not rebuild the rollup, co-purchase index and customer statistics")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rng = np.random.default_rng(options['seed'])
+        run = uuid.uuid4().hex[:8] # Keeps SKUs and emails unique across runs
+        n_lines = options['order_lines']
+        n_customers = options['customers'] or max(10, n_lines // 20)
+        n_products = options['products'] or max(50, n_lines // 500)
+        batch_size = options['batch_size']
+        now = timezone.now()
+
+        category_ids = self._create_categories(options['categories'], run)
+        product_ids, price_cents = self._create_products(rng, n_products, category_ids, run, batch_size, now)
+        customer_ids = self._create_customers(rng, n_customers, options['days'], run, batch_size, now)
+        orders = self._create_orders(rng, n_lines, customer_ids, product_ids, price_cents, options['days'], batch_size, now)
+        self.stdout.write(f"Inserted {n_products} products, {n_customers} customers, {orders} orders and {n_lines} order lines.")
+
+        if not options['skip_derived']:
+            call_command('rebuild_sales_rollup', stdout=self.stdout)
+            call_command('rebuild_copurchase_index', stdout=self.stdout)
+            call_command('rebuild_sales_sketches', stdout=self.stdout)
+            Customer.objects.refresh_order_stats()
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s."))
+
+    def _create_categories(self, count, run):
+        first = next_id(Category)
+        Category.objects.bulk_create([Category(id=first + i, name=f"Category {run}-{i}") for i in range(count)])
+        return np.arange(first, first + count)
+
+    def _create_products(self, rng, count, category_ids, run, batch_size, now):
+        first = next_id(Product)
+        price_cents = np.round(rng.lognormal(mean=8, sigma=1, size=count)).astype(np.int64) + 100 # Roughly $1 to $100k, median ~$30
+        categories = rng.choice(category_ids, size=count)
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            with transaction.atomic():
+                Product.objects.bulk_create([
+                    Product(id=first + i, name=f"Product {i}", description="Synthetic product", SKU=f"SYN-{run}-{i}",
+                            price=Decimal(int(price_cents[i])).scaleb(-2), category_id=int(categories[i]))
+                    for i in range(start, stop)
+                ])
+                Inventory.objects.bulk_create([
+                    Inventory(product_id=first + i, quantity=1_000_000, last_restocked_date=now) for i in range(start, stop)
+                ])
+        return np.arange(first, first + count), price_cents
+
+    def _create_customers(self, rng, count, days, run, batch_size, now):
+        first = next_id(Customer)
+        countries = rng.choice(COUNTRIES, size=count, p=self._skewed_weights(len(COUNTRIES)))
+        registered_days_ago = rng.integers(0, days + 365, size=count)
+        for start in range(0, count, batch_size):
+            stop = min(start + batch_size, count)
+            Customer.objects.bulk_create([
+                Customer(id=first + i, name=f"Customer {i}", email=f"customer{i}-{run}@example.com", country=countries[i],
+                         registration_date=now - timedelta(days=int(registered_days_ago[i])))
+                for i in range(start, stop)
+            ])
+        return np.arange(first, first + count)
+
+    def _create_orders(self, rng, n_lines, customer_ids, product_ids, price_cents, days, batch_size, now):
+        # Orders have 1-5 lines; products follow a Zipf-like popularity curve so some are hot sellers
+        sizes = rng.integers(1, 6, size=n_lines)
+        sizes = sizes[:np.searchsorted(np.cumsum(sizes), n_lines) + 1]
+        sizes[-1] -= sizes.sum() - n_lines
+        sizes = sizes[sizes > 0]
+
+        first_order, first_item = next_id(Order), next_id(OrderItem)
+        item_id = first_item
+        orders_per_batch = max(1, batch_size // 3)
+        for start in range(0, len(sizes), orders_per_batch):
+            batch_sizes = sizes[start:start + orders_per_batch]
+            lines = int(batch_sizes.sum())
+            products = (rng.zipf(1.3, size=lines) - 1) % len(product_ids)
+            quantities = rng.integers(1, 4, size=lines)
+            line_cents = quantities * price_cents[products]
+            totals = np.add.reduceat(line_cents, np.concatenate(([0], np.cumsum(batch_sizes)[:-1])))
+            customers = rng.choice(customer_ids, size=len(batch_sizes))
+            seconds_ago = rng.integers(0, days * 86400, size=len(batch_sizes))
+            statuses = rng.choice(STATUSES, size=len(batch_sizes), p=[0.1, 0.2, 0.65, 0.05])
+
+            order_rows, item_rows, line = [], [], 0
+            for i, size in enumerate(batch_sizes):
+                order_id = first_order + start + i
+                order_rows.append(Order(id=order_id, customer_id=int(customers[i]), order_date=now - timedelta(seconds=int(seconds_ago[i])),
+                                        status=statuses[i], total_amount=Decimal(int(totals[i])).scaleb(-2)))
+                for _ in range(size):
+                    item_rows.append(OrderItem(id=item_id, order_id=order_id, product_id=int(product_ids[products[line]]), quantity=int(quantities[line]),
+                                               price_at_time_of_order=Decimal(int(price_cents[products[line]])).scaleb(-2)))
+                    item_id += 1
+                    line += 1
+            with transaction.atomic():
+                Order.objects.bulk_create(order_rows)
+                OrderItem.objects.bulk_create(item_rows)
+        return len(sizes)
+
+    @staticmethod
+    def _skewed_weights(count):
+        weights = 1 / np.arange(1, count + 1)
+        return weights / weights.sum()
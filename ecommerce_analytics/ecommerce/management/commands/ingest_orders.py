@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.serializers import BulkOrderSerializer
+from ecommerce.services.order_ingestion import ingest_orders
+
+
+class Command(BaseCommand):
+    help = "Ingest orders from a JSON file (a list of orders or one order per line) in set-based batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON or JSON lines file with orders in the /api/orders/bulk/ format")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Orders ingested per transaction")
+
+    def handle(self, *args, **options):
+        with open(options['path']) as source:
+            text = source.read()
+        try:
+            orders = json.loads(text) if text.lstrip().startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+        except ValueError as exc:
+            raise CommandError(f"Could not parse {options['path']}: {exc}")
+
+        created = rejected = 0
+        for start in range(0, len(orders), options['batch_size']):
+            serializer = BulkOrderSerializer(data=orders[start:start + options['batch_size']], many=True)
+            if not serializer.is_valid():
+                raise CommandError(f"Invalid orders in batch starting at {start}: {serializer.errors}")
+            for result in ingest_orders(serializer.validated_data):
+                if result['status'] == 'created':
+                    created += 1
+                else:
+                    rejected += 1
+                    self.stderr.write(f"Order {start + result['index']} rejected: {result.get('error') or [line for line in result['lines'] if line['status'] != 'ok']}")
+        self.stdout.write(self.style.SUCCESS(f"Created {created} orders, rejected {rejected}."))
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ("Send concurrent GET requests to running servers and compare throughput and latency percentiles, "
+            "e.g. sync=http://127.0.0.1:8000/api/sales-analytics/ under gunicorn against "
+            "async=http://127.0.0.1:8001/api/async/sales-analytics/ under uvicorn")
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help="name=url pairs, loaded one after the other")
+        parser.add_argument('--concurrency', type=int, default=32, help="Requests in flight per target")
+        parser.add_argument('--requests', type=int, default=500, help="Timed requests per target")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests sent first to each target")
+        parser.add_argument('--header', action='append', default=[], help="Extra request header, e.g. 'Authorization: Bearer <token>'")
+        parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request counts as failed")
+        parser.add_argument('--output', help="Result file, defaults to benchmarks/load-<timestamp>.json")
+
+    def handle(self, *args, **options):
+        targets = {}
+        for target in options['targets']:
+            name, _, url = target.partition('=')
+            if not url or urlsplit(url).scheme != 'http':
+                raise CommandError(f"Targets must be name=http://host:port/path pairs, got {target!r}.")
+            targets[name] = url
+        headers = dict(header.split(':', 1) for header in options['header'])
+
+        results = {}
+        for name, url in targets.items():
+            asyncio.run(self._load(url, headers, options['warmup'], options['concurrency'], options['timeout']))
+            results[name] = asyncio.run(self._load(url, headers, options['requests'], options['concurrency'], options['timeout']))
+            result = results[name]
+            self.stdout.write(f"{name:<20} {result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:>8.1f} ms  p95 {result['p95_ms']:>8.1f} ms  "
+                              f"p99 {result['p99_ms']:>8.1f} ms  errors {result['errors']}")
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'parameters': {'concurrency': options['concurrency'], 'requests': options['requests'], 'warmup': options['warmup']},
+            'targets': targets,
+            'results': results,
+        }
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output}"))
+
+    async def _load(self, url, headers, count, concurrency, timeout):
+        # count requests from concurrency workers, each request on a fresh connection so every target pays the same setup
+        latencies, statuses = [], Counter()
+        remaining = iter(range(count))
+
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(self._get(url, headers), timeout)
+                except (OSError, asyncio.TimeoutError, ValueError, IndexError) as error:
+                    status = type(error).__name__
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, count) or 1)))
+        elapsed = time.perf_counter() - started
+        return self._summarise(latencies, statuses, elapsed)
+
+    @staticmethod
+    async def _get(url, headers):
+        # Minimal HTTP/1.1 GET returning the status code once the whole response has been read
+        parts = urlsplit(url)
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            path = parts.path + (f'?{parts.query}' if parts.query else '')
+            lines = [f'GET {path or "/"} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: close']
+            lines += [f'{name.strip()}: {value.strip()}' for name, value in headers.items()]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read() # body, until the server closes the connection
+            return int(status_line.split()[1])
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _summarise(latencies, statuses, elapsed):
+        durations = sorted(latencies)
+        percentile = lambda p: durations[min(len(durations) - 1, int(p * len(durations)))] * 1000 if durations else 0
+        errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and 200 <= status < 300))
+        return {
+            'requests': len(durations),
+            'errors': errors,
+            'statuses': {str(status): count for status, count in statuses.items()},
+            'seconds': elapsed,
+            'throughput_rps': len(durations) / elapsed if elapsed else 0,
+            'mean_ms': sum(durations) / len(durations) * 1000 if durations else 0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': durations[-1] * 1000 if durations else 0,
+        }
@@ -0,0 +1,43 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ecommerce.models import OrderItem, ProductCoPurchase
+
+
+class Command(BaseCommand):
+    help = "Rebuild the item-to-item co-purchase index from order history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Index rows inserted per bulk_create")
+
+    def handle(self, *args, **options):
+        # Walk the distinct (customer, product) purchases one customer at a time and count product pairs
+        purchases = (OrderItem.objects.values_list('order__customer_id', 'product_id')
+                     .distinct().order_by('order__customer_id'))
+        pair_counts = Counter()
+        current_customer, products = None, []
+        for customer_id, product_id in purchases.iterator(chunk_size=options['batch_size']):
+            if customer_id != current_customer:
+                self._count_pairs(products, pair_counts)
+                current_customer, products = customer_id, []
+            products.append(product_id)
+        self._count_pairs(products, pair_counts)
+
+        # Every pair keeps its full count, incremental updates need it and readers apply their own limit
+        rows = [ProductCoPurchase(product_id=product_id, related_product_id=related_id, score=score)
+                for (product_id, related_id), score in sorted(pair_counts.items())]
+
+        with transaction.atomic():
+            ProductCoPurchase.objects.all().delete()
+            ProductCoPurchase.objects.bulk_create(rows, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt co-purchase index with {len(rows)} rows."))
+
+    @staticmethod
+    def _count_pairs(products, pair_counts):
+        for product_id in products:
+            for other_id in products:
+                if other_id != product_id:
+                    pair_counts[(product_id, other_id)] += 1
@@ -0,0 +1,55 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ecommerce.models import DailySalesRollup, OrderItem
+
+
+class Command(BaseCommand):
+    help = "Rebuild or backfill the daily sales rollup from order items for a date range"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help="First day to rebuild (YYYY-MM-DD), defaults to the earliest order")
+        parser.add_argument('--end-date', help="Last day to rebuild (YYYY-MM-DD), defaults to the latest order")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rollup rows inserted per bulk_create")
+
+    def handle(self, *args, **options):
+        try:
+            start_day = datetime.strptime(options['start_date'], '%Y-%m-%d').date() if options['start_date'] else None
+            end_day = datetime.strptime(options['end_date'], '%Y-%m-%d').date() if options['end_date'] else None
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+
+        items = OrderItem.objects.all()
+        rollup = DailySalesRollup.objects.all()
+        # Filter on the raw order_date so the range can use the order date index
+        if start_day:
+            items = items.filter(order__order_date__gte=timezone.make_aware(datetime.combine(start_day, time.min)))
+            rollup = rollup.filter(day__gte=start_day)
+        if end_day:
+            items = items.filter(order__order_date__lt=timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min)))
+            rollup = rollup.filter(day__lte=end_day)
+
+        rows = (items.annotate(day=TruncDate('order__order_date'))
+                .values('day', 'product_id', country=F('order__customer__country'), category_id=F('product__category_id'))
+                .annotate(revenue=Sum(F('quantity') * F('price_at_time_of_order')), units=Sum('quantity'))
+                .order_by())
+
+        created = 0
+        with transaction.atomic():
+            rollup.delete() # Drop the stale rows for the range before re-aggregating
+            batch = []
+            for row in rows.iterator():
+                batch.append(DailySalesRollup(**row))
+                if len(batch) >= options['batch_size']:
+                    DailySalesRollup.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            DailySalesRollup.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} daily sales rollup rows."))
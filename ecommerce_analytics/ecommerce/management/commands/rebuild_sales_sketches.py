@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ecommerce.models import Order, OrderItem, SalesSketch
+from ecommerce.services.sketches import HeavyHitters, HyperLogLog
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily top products and active customers sketches from every order and order item"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=20000, help="Rows read per keyset page")
+
+    def handle(self, *args, **options):
+        top_products = defaultdict(HeavyHitters)
+        active_customers = defaultdict(HyperLogLog)
+
+        for order_date, country, product_id, quantity in self._pages(
+                OrderItem.objects.values_list('pk', 'order__order_date', 'order__customer__country', 'product_id', 'quantity'), options['chunk_size']):
+            top_products[(timezone.localdate(order_date), country)].add(product_id, quantity)
+        for order_date, customer_id in self._pages(Order.objects.values_list('pk', 'order_date', 'customer_id'), options['chunk_size']):
+            active_customers[timezone.localdate(order_date)].add(customer_id)
+
+        rows = []
+        for (day, country), sketch in top_products.items():
+            row = SalesSketch(kind=SalesSketch.TOP_PRODUCTS, day=day, country=country)
+            row.store(sketch)
+            rows.append(row)
+        for day, sketch in active_customers.items():
+            row = SalesSketch(kind=SalesSketch.ACTIVE_CUSTOMERS, day=day, country='')
+            row.store(sketch)
+            rows.append(row)
+        with transaction.atomic():
+            SalesSketch.objects.all().delete()
+            SalesSketch.objects.bulk_create(rows, batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(top_products)} top products and {len(active_customers)} active customers sketches."))
+
+    @staticmethod
+    def _pages(rows, chunk_size):
+        # Rows without their leading primary key, read in primary key order with keyset pagination
+        rows = rows.order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return
+            for row in chunk:
+                yield row[1:]
+            last_pk = chunk[-1][0]
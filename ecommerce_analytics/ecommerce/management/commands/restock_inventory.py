@@ -0,0 +1,34 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.services.inventory_restock import read_restock_csv, restock_inventory
+
+
+class Command(BaseCommand):
+    help = "Restock or adjust inventory from a CSV file or a JSON file (a list of rows or one row per line) in set-based batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (sku or product_id, delta or quantity, restocked_at columns) or JSON file in the /api/inventory/restock/ row format")
+        parser.add_argument('--batch-size', type=int, default=50000, help="Rows applied per transaction")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Inventory rows locked and updated per UPDATE")
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8-sig') as source:
+            text = source.read()
+        try:
+            if options['path'].endswith('.csv'):
+                rows = read_restock_csv(text)
+            else:
+                rows = json.loads(text) if text.lstrip().startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+        except (ValueError, csv.Error) as exc:
+            raise CommandError(f"Could not parse {options['path']}: {exc}")
+
+        counts = {'updated': 0, 'created': 0, 'rejected': 0}
+        for start in range(0, len(rows), options['batch_size']):
+            for result in restock_inventory(rows[start:start + options['batch_size']], chunk_size=options['chunk_size']):
+                counts[result['status']] += 1
+                if result['status'] == 'rejected':
+                    self.stderr.write(f"Row {start + result['index']} rejected: {result['error']}")
+        self.stdout.write(self.style.SUCCESS(f"Updated {counts['updated']} inventory rows, created {counts['created']}, rejected {counts['rejected']}."))
@@ -0,0 +1,137 @@
+import json
+import platform
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, Max, Min, Sum
+from django.db.models.functions import TruncMonth
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ecommerce.models import Customer, Inventory, Order, OrderItem, Product
+from ecommerce.renderers import FastJSONRenderer
+from ecommerce.serializers import ProductReadSerializer, ProductSerializer
+from ecommerce.services.analytics_cache import analytics_cache
+from ecommerce.services.columnar_engine import ColumnarEngine
+from ecommerce.services.benchmarking import consume, measure
+from ecommerce.services.recommendation_engine import RecommendationEngine
+from ecommerce.services.sales_analytics import SalesAnalytics, order_date_bounds
+from ecommerce.views import ExportSalesReportView, InventoryRestockView, InventoryUpdateView, sales_analytics_view
+
+
+class Command(BaseCommand):
+    help = "Time the analytics services and endpoints, count their SQL queries and peak memory, and write JSON results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help="Analytics range start (YYYY-MM-DD), defaults to the first order")
+        parser.add_argument('--end-date', help="Analytics range end (YYYY-MM-DD), defaults to the last order")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark")
+        parser.add_argument('--sample', type=int, default=20, help="Customers sampled for per-customer benchmarks")
+        parser.add_argument('--serialize', type=int, default=1000, help="Products and analytics rows rendered by the serialization benchmarks")
+        parser.add_argument('--restock', type=int, default=500, help="Inventory rows written by the restock benchmarks")
+        parser.add_argument('--only', nargs='*', help="Run only benchmarks whose name starts with one of these prefixes")
+        parser.add_argument('--output', help="Result file, defaults to benchmarks/<timestamp>.json")
+        parser.add_argument('--compare', help="Earlier result file to compare median timings against")
+
+    def handle(self, *args, **options):
+        start_date, end_date = self._date_range(options)
+        customers = list(Customer.objects.filter(order_count__gt=0).order_by('?')[:options['sample']])
+        factory = RequestFactory()
+        dates = {'start_date': start_date.strftime('%Y-%m-%d'), 'end_date': end_date.strftime('%Y-%m-%d')}
+        analytics = SalesAnalytics(start_date, end_date)
+        export_view = ExportSalesReportView.as_view()
+        # Serialization benchmarks render already loaded objects and rows, so only encoding is timed
+        products = list(Product.objects.select_related('category').prefetch_related('tags').order_by('id')[:options['serialize']])
+        rows = list(analytics.top_selling_products_by_country()[:options['serialize']])
+
+        engine = ColumnarEngine(max_age=3600)
+        slice_by = ['category', 'country', 'status', 'month']
+        order_dates = order_date_bounds(start_date, end_date)
+        sql_slice = (OrderItem.objects.filter(order__order_date__gte=order_dates[0], order__order_date__lt=order_dates[1])
+                     .values('product__category__name', 'order__customer__country', 'order__status', month=TruncMonth('order__order_date'))
+                     .annotate(revenue=Sum(F('quantity') * F('price_at_time_of_order')), units=Sum('quantity')).order_by('-revenue'))
+
+        # Restock benchmarks write every sampled row back with its current stock, one request per row against one batch
+        inventories = list(Inventory.objects.order_by('?').values('pk', 'product_id', 'quantity', 'last_restocked_date')[:options['restock']])
+        restock_rows = [{'product_id': row['product_id'], 'quantity': row['quantity'], 'restocked_at': row['last_restocked_date'].isoformat()} for row in inventories]
+        restock_user = get_user_model()(username='benchmark')
+        update_view, restock_view = InventoryUpdateView.as_view(), InventoryRestockView.as_view()
+
+        def post(view, path, data, **kwargs):
+            request = APIRequestFactory().post(path, data, format='json')
+            force_authenticate(request, restock_user)
+            return consume(view(request, **kwargs).render())
+
+        benchmarks = {
+            'sales_analytics.revenue_by_category': (lambda: list(analytics.calculate_revenue_by_category()), None),
+            'sales_analytics.top_selling_products_by_country': (lambda: list(analytics.top_selling_products_by_country()), None),
+            'sales_analytics.customer_churn_rate': (analytics.calculate_customer_churn_rate, None),
+            'sales_analytics.tax_by_country': (lambda: list(analytics.tax_by_country()), None),
+            'recommendation_engine.suggest_from_similar_customers': (lambda: [RecommendationEngine(c).suggest_from_similar_customers() for c in customers], None),
+            'recommendation_engine.suggest_from_order_history': (lambda: [list(RecommendationEngine(c).suggest_from_order_history()[:20]) for c in customers], None),
+            'customer.lifetime_value': (lambda: [c.lifetime_value() for c in customers], None),
+            'columnar.load': (engine.reload, None),
+            'columnar.category_country_status_month': (lambda: engine.query(slice_by, start_date=start_date.date(), end_date=end_date.date()), None),
+            'sql.category_country_status_month': (lambda: list(sql_slice.all()), None),
+            'serialization.products.model_serializer': (lambda: JSONRenderer().render(ProductSerializer(products, many=True).data), None),
+            'serialization.products.fast': (lambda: FastJSONRenderer().render(ProductReadSerializer(products, many=True).data), None),
+            'serialization.analytics_rows.json': (lambda: JSONRenderer().render(rows), None),
+            'serialization.analytics_rows.fast': (lambda: FastJSONRenderer().render(rows), None),
+            'endpoint.sales_analytics': (lambda: consume(sales_analytics_view(factory.get('/api/sales-analytics/', dates))), analytics_cache.bump_data_version),
+            'endpoint.export_sales.categories_xlsx': (lambda: consume(export_view(factory.get('/api/export-sales/', dates))), None),
+            'endpoint.inventory_update.per_row': (lambda: [post(update_view, f"/api/inventory/{row['pk']}/", {'product': row['product_id'], 'quantity': row['quantity'], 'last_restocked_date': row['last_restocked_date']}, pk=row['pk']) for row in inventories], None),
+            'endpoint.inventory_restock.batch': (lambda: post(restock_view, '/api/inventory/restock/', {'items': restock_rows}), None),
+            'endpoint.export_sales.lines_csv': (lambda: consume(export_view(factory.get('/api/export-sales/', {**dates, 'detail': 'lines', 'file_type': 'csv'}))), None),
+        }
+
+        results = {}
+        for name, (func, setup) in benchmarks.items():
+            if options['only'] and not any(name.startswith(prefix) for prefix in options['only']):
+                continue
+            results[name] = measure(func, repeat=options['repeat'], setup=setup)
+            result = results[name]
+            self.stdout.write(f"{name:<55} {result['median_seconds'] * 1000:>10.1f} ms {result['queries']:>6} queries {result['peak_memory_bytes'] / 1e6:>8.1f} MB")
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'parameters': {'start_date': dates['start_date'], 'end_date': dates['end_date'], 'repeat': options['repeat'], 'sample': len(customers), 'serialize': len(products), 'restock': len(inventories)},
+            'row_counts': {model.__name__: model.objects.count() for model in (Product, Customer, Order, OrderItem)},
+            'results': results,
+        }
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {output}"))
+
+        if options['compare']:
+            self._compare(json.loads(Path(options['compare']).read_text()), report)
+
+    def _date_range(self, options):
+        try:
+            start_date = datetime.strptime(options['start_date'], '%Y-%m-%d') if options['start_date'] else None
+            end_date = datetime.strptime(options['end_date'], '%Y-%m-%d') if options['end_date'] else None
+        except ValueError:
+            raise CommandError("Dates must be in YYYY-MM-DD format.")
+        if start_date is None or end_date is None:
+            bounds = Order.objects.aggregate(first=Min('order_date'), last=Max('order_date'))
+            if bounds['first'] is None:
+                raise CommandError("No orders found, run generate_synthetic_data first.")
+            start_date = start_date or timezone.localtime(bounds['first']).replace(tzinfo=None)
+            end_date = end_date or timezone.localtime(bounds['last']).replace(tzinfo=None) + timedelta(days=1)
+        return start_date, end_date
+
+    def _compare(self, baseline, report):
+        self.stdout.write(f"Compared with run from {baseline['created_at']}:")
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if before:
+                speedup = before['median_seconds'] / result['median_seconds'] if result['median_seconds'] else float('inf')
+                self.stdout.write(f"{name:<55} {speedup:>6.2f}x  queries {before['queries']} -> {result['queries']}")
@@ -0,0 +1,92 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.utils import timezone
+
+from ecommerce.models import Inventory, Product
+from ecommerce.services.inventory_reservation import InsufficientStock, reserve_stock
+
+
+class Command(BaseCommand):
+    help = "Hammer one hot SKU with concurrent reservations and verify that stock is never oversold"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help="Concurrent reserving threads")
+        parser.add_argument('--attempts', type=int, default=200, help="Reservations attempted per thread")
+        parser.add_argument('--stock', type=int, default=1000, help="Starting stock of the test product")
+        parser.add_argument('--quantity', type=int, default=1, help="Units per reservation")
+        parser.add_argument('--product', type=int, help="Reserve the existing stock of this product id instead of creating a test product, "
+                                                            "the reserved units are put back afterwards. Other writers moving the same stock during "
+                                                            "the run make the oversell check report a mismatch.")
+        parser.add_argument('--yes', action='store_true', help="Run even when DEBUG is off")
+
+    def handle(self, *args, **options):
+        for name in ('threads', 'attempts', 'quantity'):
+            if options[name] < 1:
+                raise CommandError(f"--{name} must be at least 1.")
+        if not settings.DEBUG and not options['yes']:
+            raise CommandError(f"This writes stock to the {connection.alias} database, pass --yes or run with DEBUG on.")
+        if options['product'] is not None:
+            # Reservations really take the product's stock, nothing is created or deleted
+            inventory = Inventory.objects.filter(product_id=options['product']).select_related('product').first()
+            if inventory is None:
+                raise CommandError(f"Product {options['product']} has no inventory row.")
+            product, options['stock'] = inventory.product, inventory.quantity
+        else:
+            if options['stock'] < 0:
+                raise CommandError("--stock must not be negative.")
+            product = Product.objects.create(name="Reservation stress test", description="", SKU=f"STRESS-{uuid.uuid4().hex[:12]}", price=1)
+            Inventory.objects.create(product=product, quantity=options['stock'], last_restocked_date=timezone.now())
+        counts = {'reserved': 0, 'rejected': 0, 'errors': 0}
+        latencies = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(options['attempts']):
+                    started = time.perf_counter()
+                    try:
+                        reserve_stock([(product.pk, options['quantity'])])
+                        outcome = 'reserved'
+                    except InsufficientStock:
+                        outcome = 'rejected'
+                    except OperationalError:
+                        outcome = 'errors' # e.g. SQLite "database is locked" under write contention
+                    with lock:
+                        counts[outcome] += 1
+                        latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            remaining = Inventory.objects.get(product=product).quantity
+        finally:
+            if options['product'] is None:
+                product.delete()
+            else:
+                Inventory.objects.increment(product.pk, counts['reserved'] * options['quantity'])
+
+        latencies.sort()
+        attempts = len(latencies)
+        self.stdout.write(
+            f"{attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s), "
+            f"p50 {latencies[attempts // 2] * 1000:.1f}ms, p99 {latencies[int(attempts * 0.99) - 1] * 1000:.1f}ms"
+        )
+        self.stdout.write(f"reserved {counts['reserved']}, rejected {counts['rejected']}, errors {counts['errors']}, remaining stock {remaining}")
+
+        sold = counts['reserved'] * options['quantity']
+        if sold > options['stock'] or remaining != options['stock'] - sold:
+            concurrent = " (or other writers moved this product's stock during the run)" if options['product'] is not None else ""
+            raise CommandError(f"Oversold{concurrent}: started with {options['stock']}, reserved {sold}, {remaining} left.")
+        self.stdout.write(self.style.SUCCESS("No overselling detected."))
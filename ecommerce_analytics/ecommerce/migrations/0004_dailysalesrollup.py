@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0003_alter_product_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('country', models.CharField(max_length=100)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('units', models.BigIntegerField(default=0)),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ecommerce.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ecommerce.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'category'], name='rollup_day_category_idx'), models.Index(fields=['day', 'country', 'product'], name='rollup_day_country_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'country'), name='unique_daily_sales_rollup')],
+            },
+        ),
+    ]
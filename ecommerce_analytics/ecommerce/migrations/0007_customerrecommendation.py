@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0006_productcopurchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('generated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='ecommerce.customer')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ecommerce.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer', 'rank'), name='unique_customer_recommendation_rank')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:10
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_order_stats(apps, schema_editor):
+    Customer = apps.get_model('ecommerce', 'Customer')
+    Order = apps.get_model('ecommerce', 'Order')
+    orders = Order.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    Customer.objects.update(
+        total_spent=Coalesce(Subquery(orders.annotate(total=Sum('total_amount')).values('total')), Value(Decimal('0.00'))),
+        order_count=Coalesce(Subquery(orders.annotate(count=Count('pk')).values('count')), Value(0)),
+        first_order_date=Subquery(orders.annotate(first=Min('order_date')).values('first')),
+        last_order_date=Subquery(orders.annotate(last=Max('order_date')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0007_customerrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='first_order_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_order_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='total_spent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['-total_spent', 'id'], name='customer_ltv_idx'),
+        ),
+        migrations.RunPython(backfill_order_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0008_customer_order_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['last_order_date'], name='customer_last_order_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0010_analytics_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('TOP_PRODUCTS', 'Top products'), ('ACTIVE_CUSTOMERS', 'Active customers')], max_length=20)),
+                ('day', models.DateField()),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('payload', models.BinaryField()),
+                ('candidates', models.JSONField(default=list)),
+                ('total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'day', 'country'), name='unique_sales_sketch')],
+            },
+        ),
+    ]
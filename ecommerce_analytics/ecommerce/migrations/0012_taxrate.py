@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:34
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def seed_tax_rates(apps, schema_editor):
+    # Rates previously hardcoded in Order.calculate_tax
+    TaxRate = apps.get_model('ecommerce', 'TaxRate')
+    TaxRate.objects.bulk_create([TaxRate(country=country, rate=rate) for country, rate in (('US', Decimal('0.07')), ('UK', Decimal('0.20')), ('IN', Decimal('0.18')))])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0011_salessketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100, unique=True)),
+                ('rate', models.DecimalField(decimal_places=4, max_digits=6)),
+            ],
+        ),
+        migrations.RunPython(seed_tax_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0012_taxrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(default=5),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('quantity__lt', models.F('low_stock_threshold'))), fields=['quantity'], name='inventory_low_stock'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+def key_in_flight_jobs(apps, schema_editor):
+    # The oldest pending or running job of each fingerprint keeps deduplicating new requests
+    ReportJob = apps.get_model('ecommerce', 'ReportJob')
+    keyed = set()
+    for job in ReportJob.objects.filter(status__in=('PENDING', 'RUNNING')).order_by('created_at'):
+        if job.fingerprint not in keyed:
+            keyed.add(job.fingerprint)
+            ReportJob.objects.filter(pk=job.pk).update(in_flight_key=job.fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0013_inventory_low_stock_threshold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='in_flight_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(key_in_flight_jobs, migrations.RunPython.noop),
+    ]
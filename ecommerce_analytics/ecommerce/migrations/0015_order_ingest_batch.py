@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0014_reportjob_in_flight_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='ingest_batch',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
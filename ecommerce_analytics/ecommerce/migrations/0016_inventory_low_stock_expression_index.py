@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0015_order_ingest_batch'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='inventory',
+            name='inventory_low_stock',
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(models.ExpressionWrapper(models.Q(('quantity__lt', models.F('low_stock_threshold'))), output_field=models.BooleanField()), models.F('quantity'), name='inventory_low_stock'),
+        ),
+    ]
@@ -1,7 +1,19 @@
 
-from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+import uuid
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from collections import Counter, defaultdict
+from decimal import Decimal
+from django.db.models import F, Q, Sum, Count, Min, Max, Value, OuterRef, Subquery, ExpressionWrapper
+from django.db.models.functions import Coalesce, Round
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+from .services.analytics_cache import invalidate_analytics_cache
+from .services.columnar_store import mark_orders_changed
+from .services.sketches import HeavyHitters, HyperLogLog
+from .services.tax_rates import tax_rates, round_tax
+from .services.low_stock import low_stock_alerts
+from .services.commit_batches import CommitBatch
 
 #product category model
 class Category(models.Model):
@@ -39,20 +51,95 @@ class Product(models.Model):
     
 from django.utils import timezone
 
+#custom manager for customer order statistics
+class customer_order_stats_manager(models.Manager):
+    def with_order_stats(self, start_date=None, end_date=None):
+        # Annotate order statistics for an ad-hoc date range in the same query as the customers
+        orders_in_range = Q()
+        if start_date:
+            orders_in_range &= Q(orders__order_date__gte=start_date)
+        if end_date:
+            orders_in_range &= Q(orders__order_date__lte=end_date)
+        return self.annotate(
+            period_total_spent=Coalesce(Sum('orders__total_amount', filter=orders_in_range), Value(Decimal('0.00')), output_field=models.DecimalField(max_digits=20, decimal_places=2)),
+            period_order_count=Count('orders', filter=orders_in_range),
+            period_first_order_date=Min('orders__order_date', filter=orders_in_range),
+            period_last_order_date=Max('orders__order_date', filter=orders_in_range),
+        )
+
+    def refresh_order_stats(self, customer_ids=None):
+        # Recompute the denormalized order statistics of the given customers (all when None) in a single UPDATE
+        orders = Order.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+        customers = self.all() if customer_ids is None else self.filter(pk__in=customer_ids)
+        return customers.update(
+            total_spent=Coalesce(Subquery(orders.annotate(total=Sum('total_amount')).values('total')), Value(Decimal('0.00'))),
+            order_count=Coalesce(Subquery(orders.annotate(count=Count('pk')).values('count')), Value(0)),
+            first_order_date=Subquery(orders.annotate(first=Min('order_date')).values('first')),
+            last_order_date=Subquery(orders.annotate(last=Max('order_date')).values('last')),
+        )
+
 #customer model
 class Customer(models.Model):
     name = models.CharField(max_length=100) #customer name
     email = models.EmailField(unique=True) #customer email
     country = models.CharField(max_length=100) #customer country
     registration_date = models.DateTimeField(default=timezone.now) #customer registration data
+    total_spent = models.DecimalField(max_digits=20, decimal_places=2, default=0) #denormalized lifetime value, sum of order totals
+    order_count = models.PositiveIntegerField(default=0) #denormalized number of orders
+    first_order_date = models.DateTimeField(null=True, blank=True) #date of the customer's first order
+    last_order_date = models.DateTimeField(null=True, blank=True) #date of the customer's latest order
+
+    objects = customer_order_stats_manager() #Default manager with order statistics helpers
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-total_spent', 'id'], name='customer_ltv_idx'),
+            models.Index(fields=['last_order_date'], name='customer_last_order_idx'), # churn counts
+            models.Index(fields=['country'], name='customer_country_idx'), # per-country breakdowns
+        ]
+
+    ORDER_STATS_FIELDS = ('total_spent', 'order_count', 'first_order_date', 'last_order_date') # written by refresh_order_stats only
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, force_insert=False, update_fields=None, **kwargs):
+        # Updates leave the order statistics out, an instance loaded before a later order would write back stale values
+        if not self._state.adding and not force_insert:
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [field.attname for field in self._meta.concrete_fields if not field.primary_key and field.attname not in deferred]
+            update_fields = [name for name in update_fields if name not in self.ORDER_STATS_FIELDS]
+        super().save(*args, force_insert=force_insert, update_fields=update_fields, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the loaded country, saving a new one moves the customer's sales in the daily rollup
+        instance = super().from_db(db, field_names, values)
+        instance._rollup_country = instance.country if 'country' in field_names else None
+        return instance
+
     #calculate customer life time value based on all their orders
     def lifetime_value(self):
-        return sum(order.total_amount for order in self.orders.all())
+        return self.orders.aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
     
+#tax rate applied to the orders of customers from a country
+class TaxRate(models.Model):
+    country = models.CharField(max_length=100, unique=True) #customer country
+    rate = models.DecimalField(max_digits=6, decimal_places=4) #tax rate, 0.07 for 7%
+
+    def __str__(self):
+        return f"{self.country} {self.rate}"
+
+#custom manager for order tax
+class order_tax_manager(models.Manager):
+    def with_tax(self):
+        # Annotate the rate of the customer's country and the tax on the order total, computed by the database
+        return self.annotate(
+            tax_rate=tax_rates.rate_expression('customer__country'),
+            tax=Round(F('total_amount') * F('tax_rate'), 2, output_field=models.DecimalField(max_digits=20, decimal_places=2)),
+        )
+
 #Order model
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
@@ -66,16 +153,33 @@ class Order(models.Model):
     order_date = models.DateTimeField(default=timezone.now) #order date 
     status = models.CharField(max_length=20, choices=ORDER_STATUS_CHOICES, default='PENDING') #Status of order
     total_amount = models.DecimalField(max_digits=10, decimal_places=2) #total amount of order
+    ingest_batch = models.UUIDField(null=True, blank=True, editable=False, db_index=True) #bulk ingestion batch that inserted the order, empty otherwise
+
+    objects = order_tax_manager() #Default manager with bulk tax annotation
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date', 'customer'], name='order_date_customer_idx'), # date range scans joined to customers
+            models.Index(fields=['customer', 'order_date'], name='order_customer_date_idx'), # per-customer order windows and stats
+            models.Index(fields=['status', 'order_date'], name='order_status_date_idx'), # status filters within a date range
+        ]
 
     def __str__(self):
         return f"Order {self.id} for {self.customer.name}" # String representation of the order 
 
-    def calculate_tax(self):
-        country_tax_rates = {'US': 0.07,'UK': 0.20,'IN': 0.18} #Tax rates for US,UK,India
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the loaded date and customer, saving new ones moves the order's lines in the daily rollup
+        instance = super().from_db(db, field_names, values)
+        instance._rollup_state = (instance.order_date, instance.customer_id) if {'order_date', 'customer_id'} <= set(field_names) else None
+        return instance
 
-        default_tax_rate = 0.05
-        tax_rate = country_tax_rates.get(self.customer.country, default_tax_rate) #calculate country specific tax rates
-        return self.total_amount * tax_rate
+    def calculate_tax(self):
+        # Tax of a single order at its country's rate, use Order.objects.with_tax() for many orders
+        tax_rate = getattr(self, 'tax_rate', None) # annotated by with_tax()
+        if tax_rate is None:
+            tax_rate = tax_rates.rate_for(self.customer.country)
+        return round_tax(self.total_amount * tax_rate)
 
 #Model representing the item ordered
 class OrderItem(models.Model):
@@ -84,32 +188,520 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField() #quantity of product ordered
     price_at_time_of_order = models.DecimalField(max_digits=10, decimal_places=2) #price at the time of order
 
+    class Meta:
+        indexes = [
+            # covering index: revenue and unit sums per order/product are read from the index alone
+            models.Index(fields=['order', 'product', 'quantity', 'price_at_time_of_order'], name='orderitem_covering_idx'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} of {self.product.name}" # String representation of the order item
 
-# Signal receiver to update inventory when an order item is saved
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember what the loaded line contributed to the daily rollup, saving an edit moves the difference
+        instance = super().from_db(db, field_names, values)
+        instance._rollup_state = instance.rollup_state() if {'order_id', 'product_id', 'quantity', 'price_at_time_of_order'} <= set(field_names) else None
+        return instance
+
+    def rollup_state(self):
+        return (self.order_id, self.product_id, self.quantity, self.price_at_time_of_order)
+
+#Daily sales rollup (day x category x country x product) maintained incrementally from order items
+class DailySalesRollup(models.Model):
+    day = models.DateField() #day the orders were placed
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True) #product category at time of order
+    country = models.CharField(max_length=100) #country of the ordering customer
+    product = models.ForeignKey(Product, on_delete=models.CASCADE) #product sold
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0) #sum of quantity * price_at_time_of_order
+    units = models.BigIntegerField(default=0) #sum of quantity ordered
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'country'], name='unique_daily_sales_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'category'], name='rollup_day_category_idx'),
+            models.Index(fields=['day', 'country', 'product'], name='rollup_day_country_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.country} {self.product_id}: {self.revenue}"
+
+    @staticmethod
+    def rows_for_items(items, day=None, country=None):
+        # Build the rollup rows contributed by order items, looking up countries and categories in one query each.
+        # day and country replace the ones of the items' orders, for the rows an order or customer edit moves away from.
+        countries = {} if country is not None else dict(Customer.objects.filter(pk__in={item.order.customer_id for item in items}).values_list('pk', 'country'))
+        categories = dict(Product.objects.filter(pk__in={item.product_id for item in items}).values_list('pk', 'category_id'))
+        return [{
+            'day': day or timezone.localdate(item.order.order_date),
+            'country': country if country is not None else countries.get(item.order.customer_id, ''),
+            'product_id': item.product_id,
+            'category_id': categories.get(item.product_id),
+            'quantity': item.quantity,
+            'price_at_time_of_order': item.price_at_time_of_order,
+        } for item in items]
+
+    @classmethod
+    def apply_rows(cls, rows, sign=1):
+        # Add (sign=1) or remove (sign=-1) order item rows from the rollup, one UPDATE per touched key
+        totals = {}
+        for row in rows:
+            key = (row['day'], row['country'], row['product_id'])
+            category_id, revenue, units = totals.get(key, (row['category_id'], 0, 0))
+            totals[key] = (category_id, revenue + row['quantity'] * row['price_at_time_of_order'], units + row['quantity'])
+
+        for (day, country, product_id), (category_id, revenue, units) in totals.items():
+            lookup = {'day': day, 'country': country, 'product_id': product_id}
+            changes = {'revenue': F('revenue') + sign * revenue, 'units': F('units') + sign * units}
+            if cls.objects.filter(**lookup).update(**changes) or sign < 0:
+                continue # Nothing to create when removing rows that were never rolled up
+            try:
+                with transaction.atomic():
+                    cls.objects.create(category_id=category_id, revenue=sign * revenue, units=sign * units, **lookup)
+            except IntegrityError:
+                cls.objects.filter(**lookup).update(**changes) # Row was created concurrently, fall back to the update
+
+#Probabilistic sketches per day: top products per country (Count-Min + Space-Saving) and distinct ordering customers (HyperLogLog).
+#Insert-only, deleted order items are removed by rebuild_sales_sketches. New rows are added once per transaction, after it commits.
+class SalesSketch(models.Model):
+    TOP_PRODUCTS = 'TOP_PRODUCTS'
+    ACTIVE_CUSTOMERS = 'ACTIVE_CUSTOMERS'
+    KIND_CHOICES = [
+        (TOP_PRODUCTS, 'Top products'),
+        (ACTIVE_CUSTOMERS, 'Active customers'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES) #sketch type
+    day = models.DateField() #day the orders were placed
+    country = models.CharField(max_length=100, blank=True, default='') #country of the ordering customers, empty for customer sketches
+    payload = models.BinaryField() #Count-Min table or HyperLogLog registers
+    candidates = models.JSONField(default=list) #Space-Saving [product_id, count] pairs
+    total = models.BigIntegerField(default=0) #units counted by a top products sketch
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'day', 'country'], name='unique_sales_sketch'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.day} {self.country}"
+
+    def sketch(self):
+        if self.kind == self.TOP_PRODUCTS:
+            return HeavyHitters.from_bytes(self.payload, self.candidates, self.total) if self.payload else HeavyHitters()
+        return HyperLogLog.from_bytes(self.payload) if self.payload else HyperLogLog()
+
+    def store(self, sketch):
+        self.payload = sketch.to_bytes()
+        if self.kind == self.TOP_PRODUCTS:
+            self.candidates = [[key, count] for key, count in sketch.candidates.items()]
+            self.total = sketch.total
+
+    @classmethod
+    def update(cls, kind, day, country, additions):
+        # Add (key, count) pairs to one sketch row, read-modify-write under a row lock, creating the row on first use
+        lookup = {'kind': kind, 'day': day, 'country': country}
+        with transaction.atomic():
+            row = cls.objects.select_for_update().filter(**lookup).first()
+            if row is None:
+                try:
+                    with transaction.atomic():
+                        row = cls.objects.create(payload=b'', **lookup)
+                except IntegrityError:
+                    row = cls.objects.select_for_update().get(**lookup) # Row was created concurrently
+            sketch = row.sketch()
+            for key, count in additions:
+                sketch.add(key, count)
+            row.store(sketch)
+            row.save(update_fields=['payload', 'candidates', 'total'])
+
+    @classmethod
+    def record_items(cls, rows):
+        # Add DailySalesRollup.rows_for_items rows to the top products sketches, one update per (day, country)
+        grouped = defaultdict(Counter)
+        for row in rows:
+            grouped[(row['day'], row['country'])][row['product_id']] += row['quantity']
+        for (day, country), quantities in sorted(grouped.items()): # rows locked in key order
+            cls.update(cls.TOP_PRODUCTS, day, country, quantities.items())
+
+    @classmethod
+    def record_orders(cls, orders):
+        # Add the customers of new orders to the active customers sketch of their order day
+        grouped = defaultdict(set)
+        for order in orders:
+            grouped[timezone.localdate(order.order_date)].add(order.customer_id)
+        for day, customer_ids in sorted(grouped.items()):
+            cls.update(cls.ACTIVE_CUSTOMERS, day, '', [(customer_id, 1) for customer_id in customer_ids])
+
+    @classmethod
+    def record_committed(cls, changes):
+        # CommitBatch handler for ('item', pk) and ('order', pk) rows created in a committed transaction: one
+        # read-modify-write per sketch row the transaction touched, rows rolled back since are skipped
+        item_ids = [pk for kind, pk in changes if kind == 'item']
+        order_ids = [pk for kind, pk in changes if kind == 'order']
+        with transaction.atomic():
+            if item_ids:
+                cls.record_items(DailySalesRollup.rows_for_items(list(OrderItem.objects.filter(pk__in=item_ids).select_related('order'))))
+            if order_ids:
+                cls.record_orders(Order.objects.filter(pk__in=order_ids).only('order_date', 'customer_id'))
+
+    @classmethod
+    def top_products(cls, start_day, end_day):
+        # Merged top products sketch per country over the days of the range
+        merged = {}
+        for row in cls.objects.filter(kind=cls.TOP_PRODUCTS, day__range=[start_day, end_day]):
+            if row.country in merged:
+                merged[row.country].merge(row.sketch())
+            else:
+                merged[row.country] = row.sketch()
+        return merged
+
+    @classmethod
+    def active_customers(cls, start_day, end_day):
+        # Union of the active customers sketches of the days in the range
+        merged = HyperLogLog()
+        for row in cls.objects.filter(kind=cls.ACTIVE_CUSTOMERS, day__range=[start_day, end_day]):
+            merged.merge(row.sketch())
+        return merged
+
+# Sent after orders and their items are inserted in bulk, bypassing the per-row post_save receivers.
+# Arguments: orders (saved Order instances) and items (OrderItem instances with their order attached).
+orders_ingested = Signal()
+
+sales_sketch_additions = CommitBatch(SalesSketch.record_committed)
+
+# Signal receiver to keep the daily sales rollup and top products sketches in step with new order items.
+# Edits of a line loaded from the database move its old contribution to the new one, the sketches stay insert-only.
+# Changes made with QuerySet.update() bypass the receivers and need rebuild_sales_rollup.
+@receiver(post_save, sender=OrderItem)
+def add_to_sales_rollup(sender, instance, created, **kwargs):
+    if created:
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items([instance]))
+        sales_sketch_additions.add([('item', instance.pk)])
+    elif getattr(instance, '_rollup_state', None) not in (None, instance.rollup_state()):
+        order_id, product_id, quantity, price = instance._rollup_state
+        previous = OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price_at_time_of_order=price)
+        if order_id == instance.order_id:
+            previous.order = instance.order
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items([previous]), sign=-1)
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items([instance]))
+    instance._rollup_state = instance.rollup_state()
+
+# Signal receiver moving an order's lines in the daily rollup when its date changes day or its customer changes
+@receiver(post_save, sender=Order)
+def move_order_in_sales_rollup(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rollup_state', None)
+    instance._rollup_state = (instance.order_date, instance.customer_id)
+    if created or previous is None:
+        return
+    order_date, customer_id = previous
+    if timezone.localdate(order_date) == timezone.localdate(instance.order_date) and customer_id == instance.customer_id:
+        return
+    items = list(instance.items.all())
+    if items:
+        country = Customer.objects.filter(pk=customer_id).values_list('country', flat=True).first() or ''
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items(items, day=timezone.localdate(order_date), country=country), sign=-1)
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items(items))
+
+# Signal receiver moving a customer's sales to their new country in the daily rollup
+@receiver(post_save, sender=Customer)
+def move_customer_in_sales_rollup(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_rollup_country', None)
+    instance._rollup_country = instance.country
+    if created or previous is None or previous == instance.country:
+        return
+    items = list(OrderItem.objects.filter(order__customer=instance).select_related('order'))
+    if items:
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items(items, country=previous), sign=-1)
+        DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items(items, country=instance.country))
+
+# Signal receiver adding the customer of a new order to the active customers sketch
+@receiver(post_save, sender=Order)
+def add_to_active_customers_sketch(sender, instance, created, **kwargs):
+    if created:
+        sales_sketch_additions.add([('order', instance.pk)])
+
+# Signal receiver to remove deleted order items from the daily sales rollup
+@receiver(post_delete, sender=OrderItem)
+def remove_from_sales_rollup(sender, instance, **kwargs):
+    DailySalesRollup.apply_rows(DailySalesRollup.rows_for_items([instance]), sign=-1)
+
+#Item-to-item co-purchase index: number of customers who bought both products
+class ProductCoPurchase(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='co_purchases') #product that was bought
+    related_product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+') #product also bought by the same customers
+    score = models.PositiveIntegerField(default=0) #number of customers who bought both products
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related_product'], name='unique_product_co_purchase'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='co_purchase_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_product_id}: {self.score}"
+
+    @classmethod
+    def record_purchases(cls, purchases, new_items):
+        # Update the index from new (customer_id, product_id) purchases, new_items is a Q matching the new order items.
+        # A customer contributes once to a pair, when they first buy the second product of it.
+        pair_counts = Counter()
+        for customer_id, product_ids in cls._group_by_customer(purchases).items():
+            previous = set(OrderItem.objects.filter(order__customer_id=customer_id).exclude(new_items).values_list('product_id', flat=True).distinct())
+            cls._count_pairs(pair_counts, product_ids - previous, previous)
+        if pair_counts:
+            cls.apply_pair_counts(pair_counts)
+
+    @classmethod
+    def remove_purchases(cls, purchases):
+        # Update the index after the order items of (customer_id, product_id) purchases were deleted. A customer
+        # stops contributing to the pairs of a product once none of their remaining order items is for it.
+        pair_counts = Counter()
+        for customer_id, product_ids in cls._group_by_customer(purchases).items():
+            remaining = set(OrderItem.objects.filter(order__customer_id=customer_id).values_list('product_id', flat=True).distinct())
+            cls._count_pairs(pair_counts, product_ids - remaining, remaining)
+        if pair_counts:
+            cls.apply_pair_counts(pair_counts, sign=-1)
+
+    @classmethod
+    def record_items(cls, item_ids):
+        # CommitBatch handler for order items created in a committed transaction, items rolled back since are skipped
+        with transaction.atomic():
+            purchases = list(OrderItem.objects.filter(pk__in=item_ids).values_list('order__customer_id', 'product_id'))
+            cls.record_purchases(purchases, Q(pk__in=item_ids))
+
+    @classmethod
+    def remove_items(cls, purchases):
+        # CommitBatch handler for (customer_id, product_id) of order items deleted in a committed transaction
+        with transaction.atomic():
+            cls.remove_purchases(purchases)
+
+    @staticmethod
+    def _group_by_customer(purchases):
+        bought = defaultdict(set)
+        for customer_id, product_id in purchases:
+            bought[customer_id].add(product_id)
+        return bought
+
+    @staticmethod
+    def _count_pairs(pair_counts, changed, unchanged):
+        # Each changed product of a customer pairs with every other product of theirs, both ways round for unchanged ones
+        for product_id in changed:
+            for other_id in changed | unchanged:
+                if other_id != product_id:
+                    pair_counts[(product_id, other_id)] += 1
+                    if other_id in unchanged:
+                        pair_counts[(other_id, product_id)] += 1
+
+    @classmethod
+    def apply_pair_counts(cls, pair_counts, sign=1):
+        # Add (sign=1) or subtract (sign=-1) pair counts with F-expression updates so concurrent writers never lose
+        # increments, making sure every pair has a row first when adding. Pairs are grouped into UPDATEs sharing a
+        # count and a product or a related product, largest groups first: one new product of a customer who owns
+        # P others takes 2 UPDATEs instead of P + 1. Pairs dropping to 0 keep their row, readers skip them and
+        # rebuild_copurchase_index removes them.
+        if sign > 0:
+            cls.objects.bulk_create([cls(product_id=p, related_product_id=q, score=0) for p, q in pair_counts], ignore_conflicts=True, batch_size=1000)
+        groups = defaultdict(set)
+        for (product_id, related_id), count in pair_counts.items():
+            groups[('product_id', count, product_id)].add(related_id)
+            groups[('related_product_id', count, related_id)].add(product_id)
+        applied = set()
+        for (field, count, key), others in sorted(groups.items(), key=lambda group: -len(group[1])):
+            pairs = {(key, other) if field == 'product_id' else (other, key) for other in others} - applied
+            if not pairs:
+                continue
+            applied |= pairs
+            if field == 'product_id':
+                rows = cls.objects.filter(product_id=key, related_product_id__in=sorted(q for _, q in pairs))
+            else:
+                rows = cls.objects.filter(related_product_id=key, product_id__in=sorted(p for p, _ in pairs))
+            if sign < 0:
+                rows = rows.filter(score__gte=count) # never below 0, an index that is already off waits for the rebuild
+            rows.update(score=F('score') + sign * count)
+
+co_purchase_additions = CommitBatch(ProductCoPurchase.record_items)
+co_purchase_removals = CommitBatch(ProductCoPurchase.remove_items)
+
+# Signal receivers to keep the co-purchase index in step with order items, applied once per transaction after it commits
 @receiver(post_save, sender=OrderItem)
-def update_inventory(sender, instance, **kwargs):
-    inventory = instance.product.inventory # Get the product's inventory
-    print("hi8")
-    if inventory.quantity >= instance.quantity:
-        print("hi1")
-        inventory.quantity -= instance.quantity # Deduct ordered quantity from inventory
-        inventory.save() # Save the updated inventory
-    else:
+def add_to_co_purchase_index(sender, instance, created, **kwargs):
+    if created:
+        co_purchase_additions.add([instance.pk])
+
+@receiver(post_delete, sender=OrderItem)
+def remove_from_co_purchase_index(sender, instance, **kwargs):
+    customer_id = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True).first()
+    if customer_id is not None:
+        co_purchase_removals.add([(customer_id, instance.product_id)])
+
+#Precomputed top-K product recommendations per customer written by the batch generator
+class CustomerRecommendation(models.Model):
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='recommendations') #customer receiving the recommendation
+    product = models.ForeignKey(Product, on_delete=models.CASCADE) #recommended product
+    score = models.FloatField() #summed co-purchase score of the product for the customer
+    rank = models.PositiveSmallIntegerField() #position in the customer's list, starting at 1
+    generated_at = models.DateTimeField(default=timezone.now) #time of the batch run that produced the row
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'rank'], name='unique_customer_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"#{self.rank} {self.product_id} for customer {self.customer_id}"
+
+# Signal receiver to keep the denormalized customer order statistics up to date
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def refresh_customer_order_stats(sender, instance, **kwargs):
+    Customer.objects.refresh_order_stats([instance.customer_id]) # Runs in the same transaction as the order write
+
+# Signal receivers to invalidate cached analytics results whenever orders change
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_save, sender=TaxRate)
+@receiver(post_delete, sender=TaxRate)
+def bump_analytics_data_version(sender, **kwargs):
+    invalidate_analytics_cache()
+
+# Signal receiver dropping this process's cached tax rates, again on commit so a rate read mid-transaction is not kept
+@receiver(post_save, sender=TaxRate)
+@receiver(post_delete, sender=TaxRate)
+def invalidate_tax_rates(sender, **kwargs):
+    tax_rates.invalidate()
+    transaction.on_commit(tax_rates.invalidate)
+
+# Signal receivers flagging updated or deleted orders for the in-process columnar engine's next refresh
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def mark_columnar_order_changed(sender, instance, **kwargs):
+    mark_orders_changed([instance.pk])
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def mark_columnar_order_item_changed(sender, instance, **kwargs):
+    mark_orders_changed([instance.order_id])
+
+# Signal receiver applying bulk ingested orders to the rollup, sketches, co-purchase index, customer statistics and analytics cache
+@receiver(orders_ingested)
+def apply_ingested_orders(sender, orders, items, **kwargs):
+    if not orders:
+        return
+    rows = DailySalesRollup.rows_for_items(items)
+    DailySalesRollup.apply_rows(rows)
+    SalesSketch.record_items(rows)
+    SalesSketch.record_orders(orders)
+    ProductCoPurchase.record_purchases([(item.order.customer_id, item.product_id) for item in items], Q(order_id__in=[order.pk for order in orders]))
+    Customer.objects.refresh_order_stats({order.customer_id for order in orders})
+    invalidate_analytics_cache()
+
+# Signal receiver to update inventory when an order item is created
+@receiver(post_save, sender=OrderItem)
+def update_inventory(sender, instance, created, **kwargs):
+    if not created:
+        return # Stock was already taken when the item was created
+    # Deduct the ordered quantity with a conditional UPDATE so concurrent orders cannot oversell
+    if not Inventory.objects.decrement(instance.product_id, instance.quantity):
         raise ValueError("Not enough stock to fulfill the order.") # Raise error if stock is insufficient
 
+# Whether an inventory row is below its restock threshold, indexed as an expression so every backend can seek to the
+# low-stock rows (MySQL has no partial indexes) and filtered on with the same expression compared to True
+LOW_STOCK = ExpressionWrapper(Q(quantity__lt=F('low_stock_threshold')), output_field=models.BooleanField())
+
+#custom manager for set-based stock changes
+class inventory_manager(models.Manager):
+    def decrement(self, product_id, quantity):
+        # Take stock with a conditional UPDATE, returns False when there is not enough stock. The first UPDATE only
+        # matches when the stock does not cross the product's low-stock threshold, the usual case, so crossing
+        # takes a second UPDATE that raises the alert and the first one stays the only query on the order path.
+        in_stock = self.filter(product_id=product_id, quantity__gte=quantity)
+        while True:
+            if in_stock.filter(Q(quantity__lt=F('low_stock_threshold')) | Q(quantity__gte=F('low_stock_threshold') + quantity)).update(quantity=F('quantity') - quantity):
+                return True
+            if in_stock.filter(quantity__gte=F('low_stock_threshold'), quantity__lt=F('low_stock_threshold') + quantity).update(quantity=F('quantity') - quantity):
+                low_stock_alerts.crossed([product_id])
+                return True
+            if not in_stock.exists():
+                return False # otherwise a concurrent write moved the stock between the two UPDATEs, try again
+
+    def increment(self, product_id, quantity):
+        # Put stock back with a single UPDATE
+        return self.filter(product_id=product_id).update(quantity=F('quantity') + quantity) == 1
+
+    def low_stock(self):
+        # Inventory below its threshold, served by the inventory_low_stock expression index
+        return self.alias(low=LOW_STOCK).filter(low=Value(True)) # Value keeps "= true" in the SQL, a bare condition skips the index
+
 #Inventory model
 class Inventory(models.Model):
     product = models.OneToOneField(Product, on_delete=models.CASCADE) # One-to-one relationship with the product
     quantity = models.PositiveIntegerField() # Quantity available in stock
     last_restocked_date = models.DateTimeField() # Date when product was last restocked
+    low_stock_threshold = models.PositiveIntegerField(default=5) # A restock alert is raised when quantity falls below this
+
+    objects = inventory_manager() # Default manager with set-based stock updates
+
+    class Meta:
+        indexes = [
+            # Low-stock rows sorted by quantity, so listing them never scans the inventory table
+            models.Index(LOW_STOCK, F('quantity'), name='inventory_low_stock'),
+        ]
 
     def __str__(self):
         return f"Inventory for {self.product.name}" # String representation of the inventory
 
-     # Override save method to display a restock alert when quantity is low
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember whether the loaded row was low on stock, save() alerts only when that changes
+        instance = super().from_db(db, field_names, values)
+        instance._was_low_stock = instance.is_low_stock() if {'quantity', 'low_stock_threshold'} <= set(field_names) else None
+        return instance
+
+    def is_low_stock(self):
+        return self.quantity < self.low_stock_threshold
+
+    # Override save method to raise a restock alert when the quantity falls below the threshold
     def save(self, *args, **kwargs):
-        if self.quantity < 5:  
-            print(f"Restock alert: {self.product.name} is low on stock!")
         super().save(*args, **kwargs)
+        is_low_stock = self.is_low_stock()
+        if is_low_stock and not getattr(self, '_was_low_stock', False):
+            low_stock_alerts.crossed([self.product_id])
+        self._was_low_stock = is_low_stock
+
+#Background report job computed by the local report worker pool
+class ReportJob(models.Model):
+    KIND_CHOICES = [
+        ('SALES_EXPORT', 'Sales export'),
+        ('SALES_ANALYTICS', 'Sales analytics'),
+    ]
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+    IN_FLIGHT_STATUSES = ('PENDING', 'RUNNING')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False) #public job identifier
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES) #type of report to compute
+    parameters = models.JSONField(default=dict) #normalised report parameters
+    fingerprint = models.CharField(max_length=64, db_index=True) #hash of kind and parameters used to deduplicate requests
+    in_flight_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False) #fingerprint while pending or running, NULL once finished, so one job per report is in flight across processes
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING') #current job status
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True) #user who first requested the report
+    result_file = models.CharField(max_length=255, blank=True) #file name of the finished report inside REPORT_JOBS_DIR
+    error = models.TextField(blank=True) #error message when the job failed
+    created_at = models.DateTimeField(default=timezone.now) #time the job was requested
+    started_at = models.DateTimeField(null=True, blank=True) #time a worker picked the job up
+    finished_at = models.DateTimeField(null=True, blank=True) #time the job succeeded or failed
+
+    def __str__(self):
+        return f"{self.get_kind_display()} report {self.id} ({self.status})"
+
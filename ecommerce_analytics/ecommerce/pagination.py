@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Cursor pagination on the primary key: each page is an indexed range seek (WHERE id > last seen),
+    # so deep pages cost the same as the first one instead of an OFFSET scan
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,58 @@
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError: # orjson is optional, the renderers fall back to the stdlib based encoders
+    orjson = None
+
+if orjson is not None:
+    OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _decimal_as_float(obj):
+    # Same Decimal handling as DRF's JSONEncoder, serializer DecimalFields are already strings by then
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _decimal_as_str(obj):
+    # Same Decimal handling as DjangoJSONEncoder used by JsonResponse
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONRenderer(BaseRenderer):
+    # orjson backed drop-in for JSONRenderer: Decimals, datetimes, UUIDs and numpy arrays are encoded natively
+    # in C. Select it per view with renderer_classes.
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None:
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=_decimal_as_float, option=OPTIONS)
+
+
+# renderer_classes for views on the fast path, the browsable API stays available
+FAST_RENDERER_CLASSES = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
+class FastJsonResponse(HttpResponse):
+    # JsonResponse equivalent for plain Django views, Decimals are rendered as strings like DjangoJSONEncoder does
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        if orjson is None:
+            content = json.dumps(data, cls=DjangoJSONEncoder)
+        else:
+            content = orjson.dumps(data, default=_decimal_as_str, option=OPTIONS)
+        super().__init__(content=content, **kwargs)
@@ -0,0 +1,181 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.query import QuerySet
+
+logger = logging.getLogger(__name__)
+
+_analytics_reads = ContextVar('analytics_reads', default=False)
+_request_state = ContextVar('replica_request_state', default=None)
+
+PIN_COOKIE = 'pin_primary'
+
+
+def replication_lag(alias):
+    # Seconds the replica is behind its source, None when replication is stopped. Only MySQL reports lag,
+    # other backends (a second SQLite file in local testing) count as caught up once they can be reached.
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        connection.ensure_connection()
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW REPLICA STATUS') # SHOW SLAVE STATUS before MySQL 8.0.22
+        row = cursor.fetchone()
+        if row is None:
+            return 0 # not replicating, e.g. pointed at the primary
+        status = dict(zip([column[0] for column in cursor.description], row))
+    return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+
+class ReplicaStatus:
+    # Whether the replica may serve reads: reachable and at most REPLICA_MAX_LAG seconds behind.
+    # Checked at most once every REPLICA_CHECK_INTERVAL seconds per process.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.alias = None
+        self.available = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+
+    def is_available(self, alias):
+        interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 10)
+        with self._lock:
+            if self.alias == alias and self.checked_at is not None and time.monotonic() - self.checked_at < interval:
+                return self.available
+        available, lag, error = self._check(alias)
+        with self._lock:
+            if available != self.available and self.checked_at is not None:
+                logger.warning("Replica %s is now %s (lag %s, %s)", alias, 'in use' if available else 'bypassed', lag, error)
+            self.alias, self.available, self.lag, self.error, self.checked_at = alias, available, lag, error, time.monotonic()
+        return available
+
+    def _check(self, alias):
+        try:
+            lag = replication_lag(alias)
+        except Exception as exc:
+            if alias in connections:
+                connections[alias].close() # reconnect on the next check
+            return False, None, str(exc)
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG', 30)
+        if lag is None:
+            return False, None, "replication stopped"
+        return lag <= max_lag, lag, None if lag <= max_lag else f"lag above {max_lag}s"
+
+    def reset(self):
+        with self._lock:
+            self.checked_at = None
+
+    def stats(self):
+        with self._lock:
+            return {'alias': self.alias, 'available': self.available, 'lag_seconds': self.lag, 'error': self.error}
+
+
+replica_status = ReplicaStatus()
+
+
+class RequestState:
+    # Read-your-writes state of one request: pinned to the primary by a write in this request or a recent one
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def analytics_db():
+    # Alias analytics and report reads should use right now, the primary unless the replica is configured,
+    # healthy and the request is not pinned
+    alias = getattr(settings, 'ANALYTICS_REPLICA_DATABASE', None)
+    state = _request_state.get()
+    if not alias or (state is not None and state.pinned):
+        return DEFAULT_DB_ALIAS
+    return alias if replica_status.is_available(alias) else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def analytics_reads():
+    token = _analytics_reads.set(True)
+    try:
+        yield
+    finally:
+        _analytics_reads.reset(token)
+
+
+def replica_reads(func):
+    # Run a service method's reads on analytics_db(). Returned querysets are pinned to that database
+    # so they stay there when the caller evaluates them later.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with analytics_reads():
+            result = func(*args, **kwargs)
+            if isinstance(result, QuerySet):
+                result = result.using(result.db)
+            return result
+    return wrapper
+
+
+class AnalyticsReplicaRouter:
+    # Reads inside analytics_reads() go to the replica while it is available, everything else to the primary.
+    # Writes always go to the primary, even for instances loaded from the replica.
+
+    def db_for_read(self, model, **hints):
+        return analytics_db() if _analytics_reads.get() else None # None keeps Django's default, the instance's own database
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True # later reads of this request see the write
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # the replica holds the same rows as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != getattr(settings, 'ANALYTICS_REPLICA_DATABASE', None) # the replica gets its schema through replication
+
+
+class ReplicaPinningMiddleware:
+    # Read-your-writes across requests: a request that wrote sets a short-lived cookie, and requests carrying it
+    # read from the primary until it expires, so e.g. an inventory update is visible on the next page load
+    # even while the replica catches up.
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._pin(state, response)
+
+    async def __acall__(self, request):
+        state = RequestState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._pin(state, response)
+
+    def _pin(self, state, response):
+        if state.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
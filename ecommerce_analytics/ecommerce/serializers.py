@@ -1,5 +1,43 @@
 from rest_framework import serializers
-from .models import OrderItem, Inventory, Customer, Product
+from .models import OrderItem, Order, Inventory, Customer, Product, ReportJob
+
+class SparseFieldsetMixin:
+    # Limits the output to the comma separated `fields` query parameter (or a `fields` argument), unknown names are ignored
+
+    def __init__(self, *args, **kwargs):
+        requested = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if requested is None and request is not None and request.query_params.get('fields'):
+            requested = request.query_params['fields'].split(',')
+        if requested:
+            for name in set(self.fields) - {field.strip() for field in requested}:
+                self.fields.pop(name)
+
+class ReadOnlySerializer(SparseFieldsetMixin):
+    # Read-only fast path: each field is a plain function of the instance, no Field objects are built per row.
+    # Output matches the ModelSerializer counterpart (DecimalFields as strings) and supports ?fields= too.
+    readers = {}
+
+    def __init__(self, instance, many=False, fields=None, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.fields = dict(self.readers)
+        super().__init__(fields=fields)
+
+    @property
+    def data(self):
+        readers = list(self.fields.items())
+        if self.many:
+            return [{name: read(obj) for name, read in readers} for obj in self.instance]
+        return {name: read(self.instance) for name, read in readers}
+
+def _decimal(attribute):
+    return lambda obj: None if getattr(obj, attribute) is None else str(getattr(obj, attribute))
+
+def _attribute(attribute):
+    return lambda obj: getattr(obj, attribute)
 
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,12 +49,92 @@ class InventorySerializer(serializers.ModelSerializer):
         model = Inventory
         fields = '__all__'
 
-class CustomerSerializer(serializers.ModelSerializer):
+class InventoryReservationItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class InventoryReservationSerializer(serializers.Serializer):
+    items = InventoryReservationItemSerializer(many=True, allow_empty=False, max_length=1000)
+
+class CustomerSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = '__all__'
+        read_only_fields = ['total_spent', 'order_count', 'first_order_date', 'last_order_date']
+
+class CustomerLifetimeValueSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Customer
+        fields = ['id', 'name', 'email', 'country', 'total_spent', 'order_count', 'first_order_date', 'last_order_date']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class ProductReadSerializer(ReadOnlySerializer):
+    # Same output as ProductSerializer, tags are read from the prefetch cache
+    readers = {
+        'id': _attribute('id'),
+        'name': _attribute('name'),
+        'description': _attribute('description'),
+        'SKU': _attribute('SKU'),
+        'price': _decimal('price'),
+        'category': _attribute('category_id'),
+        'tags': lambda product: [tag.pk for tag in product.tags.all()],
+    }
+
+class CustomerReadSerializer(ReadOnlySerializer):
+    # Same output as CustomerSerializer, pass fields= for the CustomerLifetimeValueSerializer subset
+    readers = {
+        'id': _attribute('id'),
+        'name': _attribute('name'),
+        'email': _attribute('email'),
+        'country': _attribute('country'),
+        'registration_date': _attribute('registration_date'),
+        'total_spent': _decimal('total_spent'),
+        'order_count': _attribute('order_count'),
+        'first_order_date': _attribute('first_order_date'),
+        'last_order_date': _attribute('last_order_date'),
+    }
+
+class ReportJobRequestSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=['sales_export', 'sales_analytics'])
+    start_date = serializers.DateField(format='%Y-%m-%d')
+    end_date = serializers.DateField(format='%Y-%m-%d')
+    detail = serializers.ChoiceField(choices=['categories', 'lines'], default='categories')
+    file_type = serializers.ChoiceField(choices=['xlsx', 'csv'], default='xlsx')
+
+    def validate(self, data):
+        if data['start_date'] > data['end_date']:
+            raise serializers.ValidationError("start_date must not be after end_date.")
+        return data
+
+    def job_parameters(self):
+        # Normalised parameters stored on the job, identical requests produce identical parameters
+        data = self.validated_data
+        parameters = {'start_date': data['start_date'].isoformat(), 'end_date': data['end_date'].isoformat()}
+        if data['kind'] == 'sales_export':
+            parameters.update(detail=data['detail'], file_type=data['file_type'])
+        return data['kind'].upper(), parameters
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'kind', 'parameters', 'status', 'error', 'created_at', 'started_at', 'finished_at']
+
+class BulkOrderItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    price_at_time_of_order = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+class BulkOrderSerializer(serializers.Serializer):
+    customer_id = serializers.IntegerField()
+    order_date = serializers.DateTimeField(required=False)
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS_CHOICES, required=False)
+    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    items = BulkOrderItemSerializer(many=True, allow_empty=False)
+
+class BulkOrderIngestSerializer(serializers.Serializer):
+    orders = BulkOrderSerializer(many=True, allow_empty=False, max_length=10000)
+
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DATA_VERSION_KEY = 'analytics:data_version'
+
+
+class AnalyticsCache:
+    # Result cache for analytics endpoints keyed by (endpoint, start_date, end_date).
+    # Entries are stored under the current data version so a write to orders makes
+    # every older entry unreachable without flushing the cache backend.
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'analytics')
+        self._lock = threading.Lock()
+        self._keys = OrderedDict() # LRU order of the keys this process has written
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def max_entries(self):
+        options = settings.CACHES.get(self.alias, {}).get('OPTIONS', {})
+        return int(options.get('MAX_ENTRIES', 300))
+
+    def data_version(self):
+        # Current data version, initialised on first use
+        version = self.backend.get(DATA_VERSION_KEY)
+        if version is None:
+            self.backend.add(DATA_VERSION_KEY, 1, timeout=None)
+            version = self.backend.get(DATA_VERSION_KEY, 1)
+        return version
+
+    def bump_data_version(self):
+        # Invalidate every cached result by moving to a new data version
+        try:
+            self.backend.incr(DATA_VERSION_KEY)
+        except ValueError:
+            self.backend.add(DATA_VERSION_KEY, 2, timeout=None) # Version key missing or expired
+
+    def make_key(self, endpoint, start_date, end_date):
+        start = start_date.isoformat() if isinstance(start_date, date) else start_date
+        end = end_date.isoformat() if isinstance(end_date, date) else end_date
+        return f"analytics:{endpoint}:{start}:{end}"
+
+    def get_or_compute(self, endpoint, start_date, end_date, compute):
+        # Return the cached result for the key, computing and storing it on a miss
+        key = self.make_key(endpoint, start_date, end_date)
+        value, version = self._lookup(key)
+        if value is None:
+            value = compute()
+            self._store(key, value, version)
+        return value
+
+    async def aget_or_compute(self, endpoint, start_date, end_date, compute):
+        # get_or_compute() for async views, compute is a coroutine function awaited on a miss.
+        # Cache backend calls run in worker threads so a remote backend does not block the event loop.
+        key = self.make_key(endpoint, start_date, end_date)
+        value, version = await sync_to_async(self._lookup, thread_sensitive=False)(key)
+        if value is None:
+            value = await compute()
+            await sync_to_async(self._store, thread_sensitive=False)(key, value, version)
+        return value
+
+    def _lookup(self, key):
+        # (cached value or None, current data version)
+        version = self.data_version()
+        value = self.backend.get(key, version=version)
+        with self._lock:
+            if value is not None:
+                self.hits += 1
+                if key in self._keys:
+                    self._keys.move_to_end(key)
+            else:
+                self.misses += 1
+        return value, version
+
+    def _store(self, key, value, version):
+        self.backend.set(key, value, version=version)
+        self._remember(key, version)
+
+    def _remember(self, key, version):
+        # Track the key in LRU order and evict the least recently used entries past MAX_ENTRIES
+        evicted = []
+        with self._lock:
+            self._keys[key] = version
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                evicted.append(self._keys.popitem(last=False))
+                self.evictions += 1
+        for old_key, old_version in evicted:
+            self.backend.delete(old_key, version=old_version)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': settings.CACHES.get(self.alias, {}).get('BACKEND'),
+                'data_version': self.data_version(),
+                'entries': len(self._keys),
+                'max_entries': self.max_entries,
+                'timeout': self.backend.default_timeout,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0,
+            }
+
+
+analytics_cache = AnalyticsCache()
+
+
+def invalidate_analytics_cache():
+    # Bump now so readers stop using old entries, and again on commit so nothing
+    # cached from the pre-commit snapshot survives the transaction
+    analytics_cache.bump_data_version()
+    transaction.on_commit(analytics_cache.bump_data_version)
@@ -0,0 +1,131 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import CustomerRecommendation, OrderItem, ProductCoPurchase
+
+
+class SparseMatrix:
+    # Minimal compressed sparse row matrix holding just what the batch scorer needs
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+
+    @classmethod
+    def from_coordinates(cls, rows, cols, data, shape):
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, cols[order], data[order], shape)
+
+    def gather_rows(self, row_ids):
+        # Concatenate the entries of the given rows without a Python loop.
+        # Returns (position in row_ids, column, value) for every entry.
+        starts = self.indptr[row_ids]
+        lengths = self.indptr[row_ids + 1] - starts
+        owners = np.repeat(np.arange(len(row_ids)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        return owners, self.indices[positions], self.data[positions]
+
+
+def _fetch_array(queryset, columns, chunk_size=10000):
+    # Stream a values_list queryset into an (n, columns) int64 array without building Python tuples lists
+    flat = itertools.chain.from_iterable(queryset.iterator(chunk_size=chunk_size))
+    return np.fromiter(flat, dtype=np.int64).reshape(-1, columns)
+
+
+def load_purchase_matrix():
+    # Load the customer x product purchase matrix once. Returns (matrix, customer_ids, product_ids)
+    # where matrix rows/columns index into the sorted customer_ids/product_ids arrays.
+    pairs = _fetch_array(OrderItem.objects.values_list('order__customer_id', 'product_id').distinct().order_by(), 2)
+    customer_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    product_ids, cols = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = SparseMatrix.from_coordinates(rows, cols, np.ones(len(rows), dtype=np.float32), (len(customer_ids), len(product_ids)))
+    return matrix, customer_ids, product_ids
+
+
+def load_similarity_matrix(product_ids):
+    # Item-to-item similarity from the co-purchase index, restricted to purchased products
+    entries = _fetch_array(ProductCoPurchase.objects.filter(score__gt=0).values_list('product_id', 'related_product_id', 'score').order_by(), 3)
+    rows = np.searchsorted(product_ids, entries[:, 0])
+    cols = np.searchsorted(product_ids, entries[:, 1])
+    rows, cols = np.minimum(rows, len(product_ids) - 1), np.minimum(cols, len(product_ids) - 1)
+    known = (product_ids[rows] == entries[:, 0]) & (product_ids[cols] == entries[:, 1])
+    shape = (len(product_ids), len(product_ids))
+    return SparseMatrix.from_coordinates(rows[known], cols[known], entries[known, 2].astype(np.float32), shape)
+
+
+_similarity = None
+
+
+def _init_worker(similarity):
+    # Each worker process receives the similarity matrix once instead of with every chunk
+    global _similarity
+    _similarity = similarity
+
+
+def score_chunk(indptr, indices, top_k, similarity=None):
+    # Score one block of customers: sum the similarity rows of everything each customer bought,
+    # drop products they already own and keep the top_k per customer.
+    # Returns (local customer row, product column, score, rank) arrays.
+    similarity = similarity or _similarity
+    n_products = similarity.shape[1]
+    purchase_owners = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    positions, neighbours, weights = similarity.gather_rows(indices)
+    keys = purchase_owners[positions] * n_products + neighbours
+
+    keep = ~np.isin(keys, purchase_owners * n_products + indices)
+    unique_keys, inverse = np.unique(keys[keep], return_inverse=True)
+    scores = np.bincount(inverse, weights=weights[keep])
+    owners, products = unique_keys // n_products, unique_keys % n_products
+
+    order = np.lexsort((products, -scores, owners))
+    owners, products, scores = owners[order], products[order], scores[order]
+    ranks = np.arange(len(owners)) - np.searchsorted(owners, owners)
+    top = ranks < top_k
+    return owners[top], products[top], scores[top], ranks[top] + 1
+
+
+def generate_recommendations(top_k=10, workers=1, chunk_size=5000, batch_size=5000):
+    # Compute and store the top_k recommendations of every customer with purchases.
+    # Returns the number of recommendation rows written.
+    started_at = timezone.now()
+    purchases, customer_ids, product_ids = load_purchase_matrix()
+    if not len(customer_ids):
+        return 0
+    similarity = load_similarity_matrix(product_ids)
+
+    bounds = [(lo, min(lo + chunk_size, len(customer_ids))) for lo in range(0, len(customer_ids), chunk_size)]
+    tasks = [(purchases.indptr[lo:hi + 1] - purchases.indptr[lo], purchases.indices[purchases.indptr[lo]:purchases.indptr[hi]], top_k) for lo, hi in bounds]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(similarity,))
+        results = executor.map(score_chunk, *zip(*tasks))
+    else:
+        executor = None
+        results = (score_chunk(*task, similarity=similarity) for task in tasks)
+
+    written = 0
+    try:
+        for (lo, hi), (owners, products, scores, ranks) in zip(bounds, results):
+            rows = [
+                CustomerRecommendation(customer_id=int(customer_ids[lo + owner]), product_id=int(product_ids[product]), score=float(score), rank=int(rank), generated_at=started_at)
+                for owner, product, score, rank in zip(owners, products, scores, ranks)
+            ]
+            with transaction.atomic():
+                CustomerRecommendation.objects.filter(customer_id__in=customer_ids[lo:hi].tolist()).delete()
+                CustomerRecommendation.objects.bulk_create(rows, batch_size=batch_size)
+            written += len(rows)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    CustomerRecommendation.objects.filter(generated_at__lt=started_at).delete() # Customers that no longer have recommendations
+    return written
@@ -0,0 +1,47 @@
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def measure(func, repeat=3, setup=None):
+    # Time func over `repeat` clean runs, then do one extra instrumented run to count SQL queries
+    # and record peak Python memory (kept separate so tracing does not distort the timings).
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    if setup:
+        setup()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    if not was_tracing:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'max_seconds': max(timings),
+        'queries': len(queries.captured_queries),
+        'db_seconds': sum(float(query['time']) for query in queries.captured_queries),
+        'peak_memory_bytes': peak,
+    }
+
+
+def consume(response):
+    # Read a (possibly streaming) response to the end so its full cost is measured
+    if getattr(response, 'streaming', False):
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
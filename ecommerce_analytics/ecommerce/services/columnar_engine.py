@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import OrderItem
+from . import columnar_snapshot
+from .columnar_store import ColumnStore, changed_orders
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+LOAD_CHUNK_SIZE = 20000
+
+
+def day_number(day):
+    # Days since 1970-01-01, the unit of the store's day column
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+class ColumnarEngine:
+    # In-process columnar copy of every order line joined with its order, customer and product attributes.
+    # New lines are picked up by primary key high-water mark and orders written in this process are reloaded,
+    # other processes' updates to existing orders are picked up by a full reload after COLUMNAR_ENGINE_MAX_AGE seconds.
+    # With ANALYTICS_SNAPSHOT_DIR set, (re)loads map the current snapshot and its delta instead of reading every line,
+    # so only lines added since the last delta come from the database; updates to existing orders then show up
+    # once build_analytics_snapshot writes the next snapshot.
+
+    def __init__(self, max_age=None, snapshot_dir=None):
+        self.max_age = max_age if max_age is not None else getattr(settings, 'COLUMNAR_ENGINE_MAX_AGE', 300)
+        self.snapshot_dir = snapshot_dir or getattr(settings, 'ANALYTICS_SNAPSHOT_DIR', None)
+        self._lock = threading.Lock()
+        self.store = None
+        self.last_item_id = 0
+        self.loaded_at = None
+        self.changed_orders = changed_orders.subscribe()
+
+    def _load(self, store, items):
+        # Fetch order lines in primary key chunks and encode them into one block of columns
+        items = items.order_by('pk').values_list('pk', 'order_id', 'order__order_date', 'order__status', 'order__customer__country',
+                                                  'product_id', 'product__category__name', 'quantity', 'price_at_time_of_order')
+        item_ids, order_ids, days, units, revenue_cents = [], [], [], [], []
+        dimensions = {'category': [], 'country': [], 'status': [], 'product': []}
+        last_pk = 0
+        while True:
+            chunk = list(items.filter(pk__gt=last_pk)[:LOAD_CHUNK_SIZE])
+            if not chunk:
+                break
+            for pk, order_id, order_date, status, country, product_id, category, quantity, price in chunk:
+                item_ids.append(pk)
+                order_ids.append(order_id)
+                days.append(day_number(timezone.localtime(order_date).date() if timezone.is_aware(order_date) else order_date.date()))
+                units.append(quantity)
+                revenue_cents.append(int(price * 100) * quantity)
+                dimensions['category'].append(category)
+                dimensions['country'].append(country)
+                dimensions['status'].append(status)
+                dimensions['product'].append(product_id)
+            last_pk = chunk[-1][0]
+        return store.encode_rows(item_ids, order_ids, days, units, revenue_cents, dimensions)
+
+    def reload(self):
+        # Rebuild the store from the current snapshot when there is one, from the database otherwise
+        with self._lock:
+            self.changed_orders.drain()
+            snapshot = columnar_snapshot.current_snapshot(self.snapshot_dir) if self.snapshot_dir else None
+            if snapshot:
+                store, last_item_id = columnar_snapshot.load_snapshot(snapshot)
+                store.replace_orders((), self._load(store, OrderItem.objects.filter(pk__gt=last_item_id)))
+            else:
+                store = ColumnStore()
+                store.replace_base(self._load(store, OrderItem.objects.all()))
+            self.store, self.loaded_at = store, time.monotonic()
+            self.last_item_id = store.max_item_id()
+
+    def write_snapshot(self, keep=2):
+        # Load every line from the database and persist it as a new snapshot
+        with self._lock:
+            store = ColumnStore()
+            store.replace_base(self._load(store, OrderItem.objects.all()))
+            return columnar_snapshot.write_snapshot(store, self.snapshot_dir, store.max_item_id(), keep=keep)
+
+    def append_delta(self):
+        # Append the lines added since the current snapshot and its delta to the delta file, returns the line count
+        snapshot = columnar_snapshot.current_snapshot(self.snapshot_dir)
+        if snapshot is None:
+            raise columnar_snapshot.SnapshotError("No snapshot written yet")
+        with columnar_snapshot.delta_writer(snapshot) as delta:
+            store, last_item_id = columnar_snapshot.load_snapshot(snapshot)
+            sizes = {name: len(dictionary.values) for name, dictionary in store.dictionaries.items()}
+            block = self._load(store, OrderItem.objects.filter(pk__gt=last_item_id))
+            if not len(block):
+                return 0
+            additions = {name: dictionary.values[sizes[name]:] for name, dictionary in store.dictionaries.items()}
+            return columnar_snapshot.append_delta(delta, block, additions, int(block.item_id.max()))
+
+    def refresh(self):
+        # Apply new order lines and the orders changed in this process since the last refresh
+        if self.store is None or time.monotonic() - self.loaded_at > self.max_age:
+            return self.reload()
+        with self._lock:
+            changed = self.changed_orders.drain()
+            block = self._load(self.store, OrderItem.objects.filter(Q(pk__gt=self.last_item_id) | Q(order_id__in=changed)))
+            self.store.replace_orders(changed, block)
+            if len(block):
+                self.last_item_id = max(self.last_item_id, int(block.item_id.max()))
+
+    def query(self, group_by=(), measures=('revenue', 'units', 'lines'), filters=None, start_date=None, end_date=None, limit=None):
+        # Group-by/filter/sum over every order line, dates are inclusive
+        self.refresh()
+        store = self.store # a concurrent reload swaps the store, this query keeps the one it started with
+        return store.query(group_by, measures, filters,
+                                day_number(start_date) if start_date else None, day_number(end_date) if end_date else None, limit)
+
+    def stats(self):
+        store = self.store
+        return {
+            'rows': len(store) if store is not None else 0,
+            'bytes': store.nbytes if store is not None else 0,
+            'age_seconds': time.monotonic() - self.loaded_at if self.loaded_at else None,
+            'dictionary_sizes': dict(store.state.sizes) if store is not None else {},
+        }
+
+
+columnar_engine = ColumnarEngine()
@@ -0,0 +1,199 @@
+import fcntl
+import json
+import logging
+import os
+import struct
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from .columnar_store import Columns, ColumnStore, Dictionary, DICTIONARY_DIMENSIONS
+
+# Snapshot file: MAGIC, uint32 header length, JSON header, then one fixed-width array per column, each
+# starting on a 64 byte boundary so it can be mapped in place. The delta file next to it is a sequence of
+# blocks (DELTA_MAGIC, uint32 header length, JSON header, uint64 data length, column arrays) appended
+# for the order lines placed since the snapshot was written.
+MAGIC = b'ECOLSNAP'
+DELTA_MAGIC = b'ECOLDLTA'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+CURRENT = 'CURRENT'
+PREFIX = 'orderlines'
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _replace_atomically(path, write):
+    # Write to a temporary file and rename it over the target so readers never see a partial file
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'wb') as output:
+        write(output)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, path)
+
+
+def current_snapshot(directory):
+    # Path of the snapshot CURRENT points to, None when no snapshot has been written
+    pointer = Path(directory) / CURRENT
+    if not pointer.exists():
+        return None
+    path = Path(directory) / pointer.read_text().strip()
+    return path if path.exists() else None
+
+
+def delta_path(snapshot):
+    return snapshot.with_suffix('.delta')
+
+
+def write_snapshot(store, directory, last_item_id, keep=2):
+    # Write every live row of the store as a new snapshot, point CURRENT at it and prune older snapshots
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    columns = store.columns
+    name = f"{PREFIX}-v{FORMAT_VERSION}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.snap"
+
+    layout, offset = {}, 0
+    for column in Columns.NAMES:
+        array = getattr(columns, column)
+        layout[column] = {'dtype': array.dtype.str, 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'rows': len(columns),
+        'last_item_id': last_item_id,
+        'columns': layout,
+        'dictionaries': {dimension: store.dictionaries[dimension].values for dimension in DICTIONARY_DIMENSIONS},
+    }).encode()
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    def write(output):
+        output.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for column in Columns.NAMES:
+            output.seek(data_start + layout[column]['offset'])
+            output.write(np.ascontiguousarray(getattr(columns, column)).tobytes())
+        output.truncate(data_start + offset) # pad the file to its full aligned size, even without rows
+
+    _replace_atomically(directory / name, write)
+    _replace_atomically(directory / CURRENT, lambda output: output.write(name.encode()))
+
+    snapshots = sorted(directory.glob(f"{PREFIX}-v*.snap"))
+    for old in snapshots[:-keep]:
+        old.unlink() # processes still mapping an old snapshot keep reading it until they reload
+        delta_path(old).unlink(missing_ok=True)
+    return directory / name
+
+
+def _read_header(data, magic, offset=0):
+    if bytes(data[offset:offset + len(magic)]) != magic:
+        raise SnapshotError("Not an analytics snapshot file")
+    (length,) = struct.unpack_from('<I', data, offset + len(magic))
+    start = offset + len(magic) + 4
+    if start + length > len(data):
+        raise SnapshotError("Truncated header")
+    return json.loads(bytes(data[start:start + length])), start + length
+
+
+def load_snapshot(path):
+    # Map the snapshot read-only (the page cache is shared by every process mapping the same file),
+    # then replay its delta file. Returns the store and the highest order item id it contains.
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    header, header_end = _read_header(mapped, MAGIC)
+    if header['format'] != FORMAT_VERSION:
+        raise SnapshotError(f"Snapshot format {header['format']} is not supported")
+    data_start = _aligned(header_end)
+    base = Columns(**{
+        column: np.frombuffer(mapped, dtype=np.dtype(spec['dtype']), count=header['rows'], offset=data_start + spec['offset'])
+        for column, spec in header['columns'].items()
+    })
+    dictionaries = {dimension: Dictionary() for dimension in DICTIONARY_DIMENSIONS}
+    for dimension, values in header['dictionaries'].items():
+        dictionaries[dimension].encode(values)
+    store = ColumnStore(base=base, dictionaries=dictionaries)
+    last_item_id = header['last_item_id']
+
+    path = delta_path(Path(path))
+    blocks, end, size = _read_delta(path.read_bytes() if path.exists() else b'')
+    if end < size:
+        logger.warning("Ignoring %d bytes of an incomplete block at the end of %s", size - end, path)
+    for block_header, block in blocks:
+        for dimension, values in block_header['dictionary_additions'].items():
+            store.add_dictionary_values(dimension, values)
+        store.replace_orders((), block)
+        last_item_id = max(last_item_id, block_header['last_item_id'])
+    return store, last_item_id
+
+
+def _read_delta(data):
+    # Complete blocks of delta file contents, the offset where they end and the data length. The scan stops at a
+    # block cut short by a crash mid-append (or still being written), nothing after it is read.
+    blocks, offset = [], 0
+    while offset + len(DELTA_MAGIC) + 4 <= len(data):
+        try:
+            header, header_end = _read_header(data, DELTA_MAGIC, offset)
+        except (SnapshotError, ValueError):
+            break
+        if header_end + 8 > len(data):
+            break
+        (data_length,) = struct.unpack_from('<Q', data, header_end)
+        header_end += 8
+        if header_end + data_length > len(data):
+            break
+        arrays, position = {}, header_end
+        for column, dtype in header['dtypes'].items():
+            array = np.frombuffer(data, dtype=np.dtype(dtype), count=header['rows'], offset=position)
+            arrays[column] = array
+            position += array.nbytes
+        blocks.append((header, Columns(**arrays)))
+        offset = header_end + data_length
+    return blocks, offset, len(data)
+
+
+@contextmanager
+def delta_writer(snapshot):
+    # Exclusive lock on the snapshot's delta file, held from reading the snapshot and delta until the new block is
+    # appended so overlapping writers (cron overlap, hosts sharing the directory) never append the same lines twice
+    with open(delta_path(Path(snapshot)), 'a+b') as output:
+        fcntl.flock(output.fileno(), fcntl.LOCK_EX)
+        try:
+            yield output
+        finally:
+            fcntl.flock(output.fileno(), fcntl.LOCK_UN)
+
+
+def append_delta(output, block, dictionary_additions, last_item_id):
+    # Append order lines to the delta file opened by delta_writer together with the dictionary values they
+    # introduced. An incomplete block left by a crashed writer is cut off first, it would hide every later block.
+    # Lines at or below the delta's last item id are already in it and dropped. Returns the lines written.
+    output.seek(0)
+    blocks, end, size = _read_delta(output.read())
+    if end < size:
+        logger.warning("Truncating %d bytes of an incomplete block at the end of %s", size - end, output.name)
+        output.truncate(end)
+    written = max((header['last_item_id'] for header, _ in blocks), default=None)
+    if written is not None:
+        block = block.where(block.item_id > written)
+    if not len(block):
+        return 0
+    data = b''.join(np.ascontiguousarray(getattr(block, column)).tobytes() for column in Columns.NAMES)
+    header = json.dumps({
+        'rows': len(block),
+        'last_item_id': last_item_id,
+        'dtypes': {column: getattr(block, column).dtype.str for column in Columns.NAMES},
+        'dictionary_additions': dictionary_additions,
+    }).encode()
+    output.write(DELTA_MAGIC + struct.pack('<I', len(header)) + header + struct.pack('<Q', len(data)) + data)
+    output.flush()
+    os.fsync(output.fileno())
+    return len(block)
@@ -0,0 +1,268 @@
+import threading
+import weakref
+from decimal import Decimal
+
+import numpy as np
+
+# Dimensions stored as dictionary codes, and dimensions derived from the order day
+DICTIONARY_DIMENSIONS = ('category', 'country', 'status', 'product')
+DATE_DIMENSIONS = {'day': 'datetime64[D]', 'month': 'datetime64[M]', 'year': 'datetime64[Y]'}
+DIMENSIONS = DICTIONARY_DIMENSIONS + tuple(DATE_DIMENSIONS)
+MEASURES = ('revenue', 'units', 'lines')
+
+
+class Dictionary:
+    # Dictionary encoding of one dimension: each distinct value gets a small int code, codes are never reused
+    # so arrays encoded earlier stay valid while new values are appended
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for index, value in enumerate(values):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            codes[index] = code
+        return codes
+
+    def lookup(self, values):
+        # Codes of the given values, values never seen are skipped
+        return [self.codes[value] for value in values if value in self.codes]
+
+
+class Columns:
+    # One block of column arrays, never modified in place: where() and append() return new blocks
+    NAMES = ('item_id', 'order_id', 'day', 'units', 'revenue_cents') + DICTIONARY_DIMENSIONS
+
+    def __init__(self, **arrays):
+        for name in self.NAMES:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def empty(cls):
+        return cls(item_id=np.empty(0, np.int64), order_id=np.empty(0, np.int64), day=np.empty(0, np.int32),
+                   units=np.empty(0, np.int64), revenue_cents=np.empty(0, np.int64),
+                   **{name: np.empty(0, np.int32) for name in DICTIONARY_DIMENSIONS})
+
+    def __len__(self):
+        return len(self.item_id)
+
+    def where(self, mask):
+        return Columns(**{name: getattr(self, name)[mask] for name in self.NAMES})
+
+    def append(self, other):
+        return Columns(**{name: np.concatenate((getattr(self, name), getattr(other, name))) for name in self.NAMES})
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.NAMES)
+
+
+class ChangedOrders:
+    # Ids of orders written in this process since one engine last refreshed, filled through ChangedOrdersFeed
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = set()
+
+    def add(self, order_ids):
+        with self._lock:
+            self._ids.update(order_ids)
+
+    def drain(self):
+        with self._lock:
+            ids, self._ids = self._ids, set()
+        return ids
+
+
+class ChangedOrdersFeed:
+    # Hands the order ids reported by the model receivers to every subscribed engine, each drains its own copy
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = weakref.WeakSet() # a discarded engine stops receiving ids
+
+    def subscribe(self):
+        queue = ChangedOrders()
+        with self._lock:
+            self._subscribers.add(queue)
+        return queue
+
+    def add(self, order_ids):
+        order_ids = list(order_ids)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            queue.add(order_ids)
+
+
+changed_orders = ChangedOrdersFeed()
+
+
+def mark_orders_changed(order_ids):
+    changed_orders.add(order_ids)
+
+
+class StoreState:
+    # One published version of a ColumnStore's rows: the base segment, the mask of its live rows (None while
+    # every row is live), the tail, and how many values each dictionary had when the version was published.
+    # Never modified, writers publish a new state with a single assignment.
+
+    def __init__(self, base, base_alive, tail, sizes):
+        self.base = base
+        self.base_alive = base_alive
+        self.tail = tail
+        self.sizes = sizes
+
+
+class ColumnStore:
+    # Order lines as NumPy columns with group-by/filter/sum answered by vectorized bincount aggregation.
+    # Rows live in a base segment, which may be a read-only memory-mapped snapshot shared between processes,
+    # plus a private in-memory tail; rows dropped from the base are masked out instead of copying it.
+    # Writers are serialized by a lock, readers take the current state once and never lock: dictionaries only
+    # grow, so labels cut to the state's dictionary sizes match the codes of its segments.
+
+    def __init__(self, base=None, dictionaries=None):
+        self.dictionaries = dictionaries or {name: Dictionary() for name in DICTIONARY_DIMENSIONS}
+        self._lock = threading.Lock()
+        self._publish(base if base is not None else Columns.empty(), None, Columns.empty())
+
+    def _publish(self, base, base_alive, tail):
+        # Called by writers, after any dictionary values the new segments use were encoded
+        self.state = StoreState(base, base_alive, tail, {name: len(dictionary.values) for name, dictionary in self.dictionaries.items()})
+
+    @property
+    def base(self):
+        return self.state.base
+
+    @property
+    def tail(self):
+        return self.state.tail
+
+    def __len__(self):
+        state = self.state
+        alive = len(state.base) if state.base_alive is None else int(state.base_alive.sum())
+        return alive + len(state.tail)
+
+    @property
+    def nbytes(self):
+        state = self.state
+        return state.base.nbytes + state.tail.nbytes
+
+    def max_item_id(self):
+        state = self.state
+        return max([int(columns.item_id.max()) for columns in (state.base, state.tail) if len(columns)], default=0)
+
+    @property
+    def columns(self):
+        # Every live row as one block (a copy whenever the tail or dropped rows are involved)
+        state = self.state
+        if state.base_alive is None and not len(state.tail):
+            return state.base
+        base = state.base if state.base_alive is None else state.base.where(state.base_alive)
+        return base.append(state.tail)
+
+    def encode_rows(self, item_ids, order_ids, days, units, revenue_cents, dimensions):
+        # Build a Columns block from plain lists, dimensions maps each dictionary dimension to its values
+        with self._lock:
+            return Columns(
+                item_id=np.asarray(item_ids, dtype=np.int64), order_id=np.asarray(order_ids, dtype=np.int64),
+                day=np.asarray(days, dtype=np.int32), units=np.asarray(units, dtype=np.int64),
+                revenue_cents=np.asarray(revenue_cents, dtype=np.int64),
+                **{name: self.dictionaries[name].encode(dimensions[name]) for name in DICTIONARY_DIMENSIONS},
+            )
+
+    def add_dictionary_values(self, dimension, values):
+        # Register dictionary values ahead of the segments using them (snapshot loading)
+        with self._lock:
+            self.dictionaries[dimension].encode(values)
+            self._publish(self.state.base, self.state.base_alive, self.state.tail)
+
+    def replace_base(self, base):
+        # Make base the only rows of the store
+        with self._lock:
+            self._publish(base, None, Columns.empty())
+
+    def replace_orders(self, order_ids, block):
+        # Drop the rows of the given orders and append freshly loaded rows to the tail
+        with self._lock:
+            state = self.state
+            base_alive, tail = state.base_alive, state.tail
+            if order_ids:
+                order_ids = np.fromiter(order_ids, dtype=np.int64)
+                dropped = np.isin(state.base.order_id, order_ids)
+                if dropped.any():
+                    base_alive = ~dropped if base_alive is None else base_alive & ~dropped
+                tail = tail.where(~np.isin(tail.order_id, order_ids))
+            if len(block):
+                tail = tail.append(block)
+            self._publish(state.base, base_alive, tail)
+
+    def _dimension(self, columns, name, sizes):
+        # (codes, labels) of a dimension for the selected rows
+        if name in DATE_DIMENSIONS:
+            periods = columns.day.astype('datetime64[D]').astype(DATE_DIMENSIONS[name])
+            unique, codes = np.unique(periods, return_inverse=True)
+            return codes.reshape(-1), [str(period) for period in unique]
+        return getattr(columns, name), self.dictionaries[name].values[:sizes[name]]
+
+    def query(self, group_by=(), measures=MEASURES, filters=None, start_day=None, end_day=None, limit=None):
+        # Sum the measures per combination of the group_by dimensions over the filtered rows.
+        # Returns columnar output sorted by the first measure, descending.
+        state = self.state # one consistent version for the whole query
+        selected = Columns.empty()
+        for columns, alive in ((state.base, state.base_alive), (state.tail, None)):
+            if not len(columns):
+                continue
+            mask = np.ones(len(columns), dtype=bool) if alive is None else alive.copy()
+            if start_day is not None:
+                mask &= columns.day >= start_day
+            if end_day is not None:
+                mask &= columns.day <= end_day
+            for name, values in (filters or {}).items():
+                if name in DATE_DIMENSIONS:
+                    codes, labels = self._dimension(columns, name, state.sizes)
+                    values = set(values)
+                    wanted = [index for index, label in enumerate(labels) if label in values]
+                else:
+                    codes, wanted = getattr(columns, name), self.dictionaries[name].lookup(values)
+                mask &= np.isin(codes, wanted)
+            selected = selected.append(columns.where(mask))
+
+        # Mixed radix key over the group-by codes, compacted with np.unique when the key space is large
+        key = np.zeros(len(selected), dtype=np.int64)
+        labels = []
+        for name in group_by:
+            codes, values = self._dimension(selected, name, state.sizes)
+            key = key * max(len(values), 1) + codes
+            labels.append(values)
+        cardinality = int(np.prod([max(len(values), 1) for values in labels])) if labels else 1
+        if cardinality <= 1 << 22:
+            groups, inverse = np.arange(cardinality), key
+        else:
+            groups, inverse = np.unique(key, return_inverse=True)
+
+        sums = {
+            'revenue': np.bincount(inverse, weights=selected.revenue_cents, minlength=len(groups)),
+            'units': np.bincount(inverse, weights=selected.units, minlength=len(groups)),
+            'lines': np.bincount(inverse, minlength=len(groups)),
+        }
+        present = np.flatnonzero(sums['lines'])
+        order = present[np.argsort(-sums[measures[0]][present], kind='stable')] if measures else present
+        if limit is not None:
+            order = order[:limit]
+
+        result = {name: [] for name in group_by}
+        remainder = groups[order]
+        for name, values in reversed(list(zip(group_by, labels))):
+            radix = max(len(values), 1)
+            result[name] = [values[code] for code in (remainder % radix)]
+            remainder = remainder // radix
+        for measure in measures:
+            if measure == 'revenue':
+                result['revenue'] = [Decimal(int(cents)).scaleb(-2) for cents in sums['revenue'][order]]
+            else:
+                result[measure] = sums[measure][order].astype(np.int64).tolist()
+        return {'group_by': list(group_by), 'measures': list(measures), 'rows': len(order), 'columns': result}
@@ -0,0 +1,33 @@
+import functools
+import weakref
+
+from django.db import transaction
+
+
+class CommitBatch:
+    # Collects values added by signal receivers during a transaction and passes them to handler in one call once
+    # the transaction commits, so a transaction writing many rows updates derived data once instead of per row.
+    # Outside a transaction the handler runs immediately. Values added inside a savepoint that is later rolled
+    # back are still passed on, handlers re-read the rows they need and skip what no longer matches.
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._pending = weakref.WeakKeyDictionary() # connection -> (flush callback, values) of its open transaction
+
+    def add(self, values, using=None):
+        connection = transaction.get_connection(using)
+        flush, pending = self._pending.get(connection, (None, None))
+        if flush is None or not any(entry[1] is flush for entry in connection.run_on_commit):
+            # First values of this transaction, or the transaction holding the previous batch was rolled back
+            pending = []
+            flush = functools.partial(self.flush, weakref.ref(connection)) # a rolled back batch must not keep the connection alive
+            self._pending[connection] = (flush, pending)
+            pending.extend(values)
+            transaction.on_commit(flush, using=using)
+        else:
+            pending.extend(values)
+
+    def flush(self, connection_ref):
+        _, pending = self._pending.pop(connection_ref(), (None, None))
+        if pending:
+            self.handler(pending)
@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from ..models import Inventory
+
+
+class InsufficientStock(Exception):
+    # Raised when a reservation cannot be met, nothing is reserved in that case
+    def __init__(self, shortfalls):
+        super().__init__("Not enough stock to fulfill the reservation.")
+        self.shortfalls = shortfalls # [{'product_id', 'requested', 'available'}]
+
+
+def reserve_stock(items):
+    # Atomically reserve and decrement stock for several (product_id, quantity) pairs.
+    # Each product is decremented with a conditional UPDATE in product id order, so concurrent
+    # reservations lock rows in the same order and hold each lock only for this short transaction.
+    # Either every item is reserved or none is and InsufficientStock is raised.
+    requested = defaultdict(int)
+    for product_id, quantity in items:
+        requested[product_id] += quantity
+
+    try:
+        with transaction.atomic():
+            for product_id in sorted(requested):
+                if not Inventory.objects.decrement(product_id, requested[product_id]):
+                    raise InsufficientStock([]) # Roll back the items already decremented
+    except InsufficientStock:
+        available = dict(Inventory.objects.filter(product_id__in=requested).values_list('product_id', 'quantity'))
+        raise InsufficientStock([
+            {'product_id': product_id, 'requested': quantity, 'available': available.get(product_id, 0)}
+            for product_id, quantity in sorted(requested.items()) if available.get(product_id, 0) < quantity
+        ])
+    return [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in sorted(requested.items())]
@@ -0,0 +1,164 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..models import Inventory, Product
+from .low_stock import low_stock_alerts
+
+RESTOCK_CSV_COLUMNS = ('sku', 'product_id', 'delta', 'quantity', 'restocked_at')
+RESTOCK_MAX_ROWS = 50000 # rows accepted per API request
+
+
+def read_restock_csv(text):
+    # Rows of a CSV batch with a header naming some of RESTOCK_CSV_COLUMNS, empty cells are left out
+    reader = csv.DictReader(io.StringIO(text))
+    unknown = set(reader.fieldnames or ()) - set(RESTOCK_CSV_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}.")
+    return [{name: value.strip() for name, value in row.items() if value and value.strip()} for row in reader]
+
+
+def _integer(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError
+    return int(value)
+
+
+def _restock_date(value):
+    # Aware datetime from an ISO datetime or ISO date (midnight) string
+    if not isinstance(value, str):
+        raise ValueError
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError
+        moment = datetime(day.year, day.month, day.day)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def _parse_row(row):
+    # (product reference, change, restocked_at) of one batch row, raises ValueError with the row's error code
+    if not isinstance(row, dict):
+        raise ValueError('invalid_row')
+    if ('sku' in row) == ('product_id' in row):
+        raise ValueError('sku_or_product_id_required')
+    if ('delta' in row) == ('quantity' in row):
+        raise ValueError('delta_or_quantity_required')
+    try:
+        reference = ('sku', str(row['sku'])) if 'sku' in row else ('product_id', _integer(row['product_id']))
+    except ValueError:
+        raise ValueError('invalid_product_id')
+    try:
+        change = ('delta', _integer(row['delta'])) if 'delta' in row else ('quantity', _integer(row['quantity']))
+    except ValueError:
+        raise ValueError(f"invalid_{'delta' if 'delta' in row else 'quantity'}")
+    if change[0] == 'quantity' and change[1] < 0:
+        raise ValueError('invalid_quantity')
+    try:
+        restocked_at = _restock_date(row['restocked_at']) if row.get('restocked_at') is not None else None
+    except ValueError:
+        raise ValueError('invalid_restocked_at')
+    return reference, change, restocked_at
+
+
+def restock_inventory(rows, chunk_size=1000):
+    # Apply a batch of stock changes with one locking SELECT and CASE UPDATEs per chunk of products.
+    #
+    # rows is a list of dicts with sku or product_id, delta (added to the stock, may be negative) or quantity
+    # (new absolute stock) and an optional restocked_at, defaulting to now for rows that add stock.
+    # The batch is validated in memory first. Rows that fail validation, name an unknown product or would take
+    # the stock below zero are rejected, every other row is applied in input order in a single transaction.
+    # Products without an Inventory row get one. Returns one result dict per input row.
+    now = timezone.now()
+    results = [{'index': index, 'product_id': None, 'status': 'rejected'} for index in range(len(rows))]
+    parsed = {}
+    for index, row in enumerate(rows):
+        try:
+            parsed[index] = _parse_row(row)
+        except ValueError as exc:
+            results[index]['error'] = str(exc)
+
+    skus = {reference[1] for reference, _, _ in parsed.values() if reference[0] == 'sku'}
+    ids = {reference[1] for reference, _, _ in parsed.values() if reference[0] == 'product_id'}
+    product_by_sku = dict(_in_chunks(skus, chunk_size, lambda chunk: Product.objects.filter(SKU__in=chunk).values_list('SKU', 'pk')))
+    known_ids = set(_in_chunks(ids, chunk_size, lambda chunk: Product.objects.filter(pk__in=chunk).values_list('pk', flat=True)))
+
+    changes = defaultdict(list) # product_id -> [(row index, change, restocked_at)] in input order
+    for index, (reference, change, restocked_at) in parsed.items():
+        product_id = product_by_sku.get(reference[1]) if reference[0] == 'sku' else reference[1] if reference[1] in known_ids else None
+        if product_id is None:
+            results[index]['error'] = 'unknown_product'
+            continue
+        results[index]['product_id'] = product_id
+        changes[product_id].append((index, change, restocked_at))
+
+    product_ids = sorted(changes) # lock rows in product id order like the order and reservation paths
+    with transaction.atomic():
+        for start in range(0, len(product_ids), chunk_size):
+            _apply_chunk(product_ids[start:start + chunk_size], changes, results, now, chunk_size)
+    return results
+
+
+def _in_chunks(values, chunk_size, query):
+    # Rows of query run over values chunk_size at a time, keeping IN lists bounded
+    values = sorted(values)
+    for start in range(0, len(values), chunk_size):
+        yield from query(values[start:start + chunk_size])
+
+
+def _apply_chunk(product_ids, changes, results, now, batch_size):
+    # Lock the chunk's inventory rows, fold each product's changes in memory and write the new stock back
+    current = {inventory.product_id: inventory for inventory in
+               Inventory.objects.select_for_update().filter(product_id__in=product_ids).order_by('product_id').only('pk', 'product_id', 'quantity', 'last_restocked_date', 'low_stock_threshold')}
+    changed, created, crossed = [], [], []
+    for product_id in product_ids:
+        inventory = current.get(product_id)
+        is_new = inventory is None
+        if is_new:
+            inventory = Inventory(product_id=product_id, quantity=0, last_restocked_date=now)
+        applied = False
+        for index, (kind, value), restocked_at in changes[product_id]:
+            quantity = inventory.quantity + value if kind == 'delta' else value
+            if quantity < 0:
+                results[index]['error'] = 'insufficient_stock'
+                results[index]['available'] = inventory.quantity
+                continue
+            if restocked_at is not None or quantity > inventory.quantity:
+                inventory.last_restocked_date = restocked_at or now
+            inventory.quantity = quantity
+            applied = True
+            results[index].update(status='created' if is_new else 'updated', quantity=quantity)
+            is_new = False # later rows of the same product update the row this one creates
+        if applied:
+            (created if inventory.pk is None else changed).append(inventory)
+            if inventory.is_low_stock() and (inventory.pk is None or not inventory._was_low_stock):
+                crossed.append(product_id)
+    _write_stock(changed, batch_size)
+    Inventory.objects.bulk_create(created, batch_size=batch_size)
+    low_stock_alerts.crossed(crossed)
+
+
+def _write_stock(inventories, batch_size):
+    # UPDATE ... SET quantity = CASE id WHEN ... END, last_restocked_date = CASE id WHEN ... END WHERE id IN (...).
+    # Same statement as bulk_update(), written out directly because building 2 When() expressions per row costs
+    # more than running the query for large batches.
+    quote = connection.ops.quote_name
+    table, pk = quote(Inventory._meta.db_table), quote(Inventory._meta.pk.column)
+    quantity, restocked = quote(Inventory._meta.get_field('quantity').column), quote(Inventory._meta.get_field('last_restocked_date').column)
+    per_statement = min(batch_size, (connection.features.max_query_params or 5 * batch_size) // 5) # 5 parameters per row
+    for start in range(0, len(inventories), per_statement):
+        batch = inventories[start:start + per_statement]
+        whens = ' '.join(['WHEN %s THEN %s'] * len(batch))
+        sql = (f"UPDATE {table} SET {quantity} = CASE {pk} {whens} END, {restocked} = CASE {pk} {whens} END "
+               f"WHERE {pk} IN ({', '.join(['%s'] * len(batch))})")
+        params = [value for inventory in batch for value in (inventory.pk, inventory.quantity)]
+        params += [value for inventory in batch for value in (inventory.pk, connection.ops.adapt_datetimefield_value(inventory.last_restocked_date))]
+        params += [inventory.pk for inventory in batch]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
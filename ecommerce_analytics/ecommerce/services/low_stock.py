@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class LoggingSink:
+    # Default sink, one warning per low-stock product
+    def send(self, alerts):
+        for alert in alerts:
+            logger.warning("Restock alert: %s (%s) is low on stock, %s left (threshold %s)",
+                           alert['name'], alert['sku'], alert['quantity'], alert['threshold'])
+
+
+class WebhookSink:
+    # POSTs each batch as {"alerts": [...]} JSON to LOW_STOCK_ALERT_WEBHOOK_URL
+    def __init__(self, url=None, timeout=10):
+        self.url = url or settings.LOW_STOCK_ALERT_WEBHOOK_URL
+        self.timeout = timeout
+
+    def send(self, alerts):
+        body = json.dumps({'alerts': alerts}, default=str).encode()
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class LowStockAlerter:
+    # Edge-triggered low-stock alerts. Stock writers report the products whose quantity just fell below their
+    # threshold; once the write commits they are queued, deduplicated, and handed to the configured sinks in one
+    # batch from a background thread, LOW_STOCK_ALERT_BATCH_SECONDS after the first one or as soon as
+    # LOW_STOCK_ALERT_BATCH_SIZE are waiting. A product is alerted at most once per LOW_STOCK_ALERT_COOLDOWN seconds.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {} # product_id -> time its stock crossed the threshold, in arrival order
+        self._last_sent = {} # product_id -> time.monotonic() of its last alert
+        self._timer = None
+        self._sinks = None
+        self.sent = 0
+        self.suppressed = 0
+        self.failed = 0
+
+    def crossed(self, product_ids):
+        # Called inside the writing transaction, alerts of a rolled back write are never queued
+        product_ids = list(product_ids)
+        if product_ids:
+            transaction.on_commit(lambda: self.enqueue(product_ids))
+
+    def enqueue(self, product_ids):
+        now, detected_at = time.monotonic(), timezone.now()
+        cooldown = getattr(settings, 'LOW_STOCK_ALERT_COOLDOWN', 3600)
+        with self._lock:
+            for product_id in product_ids:
+                last_sent = self._last_sent.get(product_id)
+                if product_id in self._pending or (last_sent is not None and now - last_sent < cooldown):
+                    self.suppressed += 1
+                else:
+                    self._pending[product_id] = detected_at
+            eager = getattr(settings, 'LOW_STOCK_ALERTS_EAGER', False)
+            if self._pending and not eager:
+                if len(self._pending) >= getattr(settings, 'LOW_STOCK_ALERT_BATCH_SIZE', 500):
+                    self._schedule(0)
+                elif self._timer is None:
+                    self._schedule(getattr(settings, 'LOW_STOCK_ALERT_BATCH_SECONDS', 5))
+        if eager:
+            self.flush()
+
+    def _schedule(self, delay):
+        # Called with the lock held
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        # Timer thread entry point, the thread gets its own database connection
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        # Send every queued alert now. Products restocked in the meantime are dropped.
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return []
+        from ..models import Inventory
+        rows = (Inventory.objects.low_stock().filter(product_id__in=list(pending))
+                .values('product_id', 'product__SKU', 'product__name', 'quantity', 'low_stock_threshold'))
+        alerts = sorted(({'product_id': row['product_id'], 'sku': row['product__SKU'], 'name': row['product__name'], 'quantity': row['quantity'],
+                          'threshold': row['low_stock_threshold'], 'detected_at': pending[row['product_id']].isoformat()} for row in rows),
+                        key=lambda alert: alert['detected_at'])
+        if not alerts:
+            return []
+        for sink in self.sinks():
+            try:
+                sink.send(alerts)
+            except Exception:
+                logger.exception("Low-stock alert sink %s failed for %d alerts", type(sink).__name__, len(alerts))
+                with self._lock:
+                    self.failed += 1
+        with self._lock:
+            now = time.monotonic()
+            self._last_sent.update((alert['product_id'], now) for alert in alerts)
+            self.sent += len(alerts)
+        return alerts
+
+    def sinks(self):
+        if self._sinks is None:
+            self._sinks = [import_string(path)() for path in getattr(settings, 'LOW_STOCK_ALERT_SINKS', ['ecommerce.services.low_stock.LoggingSink'])]
+        return self._sinks
+
+    def reset(self):
+        # Forget queued alerts, cooldowns and the configured sinks (tests, settings changes)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._pending, self._last_sent, self._timer, self._sinks = {}, {}, None, None
+            self.sent = self.suppressed = self.failed = 0
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'sent': self.sent, 'suppressed': self.suppressed, 'failed_batches': self.failed}
+
+
+low_stock_alerts = LowStockAlerter()
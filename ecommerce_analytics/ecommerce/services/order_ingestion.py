@@ -0,0 +1,105 @@
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..models import Customer, Inventory, Order, OrderItem, Product, orders_ingested
+
+
+def ingest_orders(orders):
+    # Insert a batch of orders with set-based stock updates instead of per-item post_save work.
+    #
+    # orders is a list of dicts: customer_id, items (list of product_id, quantity and optional
+    # price_at_time_of_order) and optional order_date, status and total_amount.
+    # Stock is taken with one conditional UPDATE per product. An order is only created when every
+    # one of its lines gets stock; otherwise its lines are reported and its stock is put back.
+    # Returns one result dict per input order.
+    results = [{'index': index, 'order_id': None, 'status': 'created', 'lines': [{'index': line, 'status': 'ok'} for line in range(len(order['items']))]}
+               for index, order in enumerate(orders)]
+
+    customer_ids = set(Customer.objects.filter(pk__in={order['customer_id'] for order in orders}).values_list('pk', flat=True))
+    prices = dict(Product.objects.filter(pk__in={item['product_id'] for order in orders for item in order['items']}).values_list('pk', 'price'))
+
+    # Validate references in memory and collect the lines that need stock, in input order
+    requested = defaultdict(list) # product_id -> [(order index, line index, quantity)]
+    for index, order in enumerate(orders):
+        if order['customer_id'] not in customer_ids:
+            results[index]['status'] = 'rejected'
+            results[index]['error'] = 'unknown_customer'
+            continue
+        for line, item in enumerate(order['items']):
+            if item['product_id'] not in prices:
+                results[index]['lines'][line]['status'] = 'unknown_product'
+            else:
+                requested[item['product_id']].append((index, line, item['quantity']))
+
+    with transaction.atomic():
+        allocated = _allocate_stock(requested, results)
+
+        # Reject orders with any failed line and put back the stock their other lines took
+        released = defaultdict(int)
+        for result in results:
+            if result['status'] == 'created' and any(line['status'] != 'ok' for line in result['lines']):
+                result['status'] = 'rejected'
+            if result['status'] == 'rejected':
+                for product_id, quantity in allocated.pop(result['index'], []):
+                    released[product_id] += quantity
+        for product_id in sorted(released):
+            Inventory.objects.increment(product_id, released[product_id])
+
+        accepted = [index for index in range(len(orders)) if results[index]['status'] == 'created']
+        new_orders = _create_orders([orders[index] for index in accepted], prices)
+        new_items = []
+        for index, order in zip(accepted, new_orders):
+            results[index]['order_id'] = order.pk
+            for item in orders[index]['items']:
+                price = item.get('price_at_time_of_order', prices[item['product_id']])
+                new_items.append(OrderItem(order=order, product_id=item['product_id'], quantity=item['quantity'], price_at_time_of_order=price))
+        OrderItem.objects.bulk_create(new_items, batch_size=1000)
+
+        orders_ingested.send(sender=Order, orders=new_orders, items=new_items)
+    return results
+
+
+def _allocate_stock(requested, results):
+    # Decrement stock for every requested product, products in id order to keep lock order stable.
+    # Returns order index -> [(product_id, quantity)] of the stock taken.
+    allocated = defaultdict(list)
+    for product_id in sorted(requested):
+        lines = requested[product_id]
+        if Inventory.objects.decrement(product_id, sum(quantity for _, _, quantity in lines)):
+            for index, _, quantity in lines:
+                allocated[index].append((product_id, quantity))
+            continue
+        # Not enough for the whole batch: give stock to lines in input order until it runs out
+        for index, line, quantity in lines:
+            if Inventory.objects.decrement(product_id, quantity):
+                allocated[index].append((product_id, quantity))
+            else:
+                results[index]['lines'][line]['status'] = 'insufficient_stock'
+    return allocated
+
+
+def _create_orders(orders, prices):
+    # Insert the accepted orders and return them with primary keys set
+    new_orders = []
+    for order in orders:
+        total = order.get('total_amount')
+        if total is None:
+            total = sum((Decimal(item['quantity']) * item.get('price_at_time_of_order', prices[item['product_id']]) for item in order['items']), Decimal('0.00'))
+        new_orders.append(Order(customer_id=order['customer_id'], order_date=order.get('order_date') or timezone.now(), status=order.get('status', 'PENDING'), total_amount=total))
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Order.objects.bulk_create(new_orders, batch_size=1000)
+    # MySQL cannot return ids from a multi-row INSERT: tag the batch, insert it, then read the ids back.
+    # Auto-increment ids grow in insert order within the transaction, so they pair up with the orders in order.
+    batch = uuid.uuid4()
+    for order in new_orders:
+        order.ingest_batch = batch
+    Order.objects.bulk_create(new_orders, batch_size=1000)
+    ids = list(Order.objects.filter(ingest_batch=batch).order_by('pk').values_list('pk', flat=True))
+    for order, pk in zip(new_orders, ids, strict=True):
+        order.pk = pk
+    return new_orders
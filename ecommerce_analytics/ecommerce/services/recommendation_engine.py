@@ -1,4 +1,7 @@
-from ..models import OrderItem,Customer,Product
+from django.db.models import Sum
+from ..models import OrderItem,Customer,Product,ProductCoPurchase
+from ..instrumentation import instrumented
+from ..routers import replica_reads
 
 class RecommendationEngine:
 
@@ -6,18 +9,33 @@ class RecommendationEngine:
         # Initialize the class with a specific customer
         self.customer = customer
 
+    @instrumented
+    @replica_reads
     def suggest_from_order_history(self):
         # Suggest products based on the customer's order history
         ordered_products = OrderItem.objects.filter(order__customer=self.customer).values_list('product', flat=True) #Get a list of product IDs the customer has previously ordered
         ordered_categories = Product.objects.filter(id__in=ordered_products).values_list('category', flat=True) # Get the categories of those ordered products
         return Product.objects.filter(category__in=ordered_categories).exclude(id__in=ordered_products).distinct() # Suggest products from the same categories but exclude already ordered products
     
-    def suggest_from_similar_customers(self):
-        # Suggest products based on similar customers' purchases
-        ordered_products = OrderItem.objects.filter(order__customer=self.customer).values_list('product', flat=True)  # Find products that the customer has ordered
-        similar_customers = Customer.objects.filter(orders__items__product__in=ordered_products).exclude(id=self.customer.id).distinct()  # Identify other customers who have ordered the same products (exclude the current customer)
-        return Product.objects.filter(orderitem__order__customer__in=similar_customers).exclude(orderitem__order__customer=self.customer).distinct()  # Suggest products ordered by these similar customers that the current customer hasn't ordered
+    @instrumented
+    @replica_reads
+    def suggest_from_similar_customers(self, limit=20):
+        # Suggest products co-purchased with the customer's products, ranked by co-purchase score
+        ordered_products = OrderItem.objects.filter(order__customer=self.customer).values('product')  # Find products that the customer has ordered
+        scores = (ProductCoPurchase.objects.filter(product__in=ordered_products, score__gt=0).exclude(related_product__in=ordered_products)
+                  .values('related_product').annotate(score=Sum('score')).order_by('-score', 'related_product')[:limit])  # Merge the index entries of every ordered product
+        scores = {row['related_product']: row['score'] for row in scores}
+        products = Product.objects.select_related('category').prefetch_related('tags').in_bulk(scores)
+        recommended = []
+        for product_id, score in scores.items():
+            if product_id in products:
+                product = products[product_id]
+                product.recommendation_score = score
+                recommended.append(product)
+        return recommended
 
+    @instrumented
+    @replica_reads
     def suggest_based_on_inventory(self):
         # Suggest products that are currently in stock, ordered by the highest available quantity
         return Product.objects.filter(inventory__quantity__gt=0).order_by('-inventory__quantity')
@@ -0,0 +1,126 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import ReportJob
+from ..routers import analytics_reads
+from .sales_analytics import SalesAnalytics
+from .sales_report import CATEGORY_HEADER, ORDER_LINE_HEADER, category_rows, order_line_rows, csv_stream, write_xlsx
+
+SUBMIT_ATTEMPTS = 2 # INSERTs tried before an IntegrityError without a matching in-flight job is raised
+
+_executor = None
+
+
+def get_executor():
+    # Process-wide worker pool, created on first use
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'REPORT_JOBS_WORKERS', 2), thread_name_prefix='report-job')
+    return _executor
+
+
+def report_dir():
+    path = Path(getattr(settings, 'REPORT_JOBS_DIR', Path(settings.BASE_DIR) / 'reports'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def fingerprint(kind, parameters):
+    # Stable hash of the report request used to find identical in-flight jobs
+    payload = json.dumps({'kind': kind, 'parameters': parameters}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def expire_stale_jobs(key=None):
+    # Mark jobs that have been in flight for longer than REPORT_JOBS_TIMEOUT seconds as failed. The executor is
+    # in memory, so a job whose worker process restarted or crashed would otherwise stay in flight for good.
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'REPORT_JOBS_TIMEOUT', 3600))
+    stale = ReportJob.objects.filter(Q(started_at__lt=cutoff) | Q(started_at__isnull=True, created_at__lt=cutoff), status__in=ReportJob.IN_FLIGHT_STATUSES)
+    if key is not None:
+        stale = stale.filter(fingerprint=key)
+    return stale.update(status='FAILED', error="Timed out, the worker computing the report did not finish.", finished_at=timezone.now(), in_flight_key=None)
+
+
+def submit_report_job(kind, parameters, user=None):
+    # Create a report job, or return the in-flight job computing the same report.
+    # The unique in_flight_key makes the check hold across worker processes. Returns (job, created).
+    key = fingerprint(kind, parameters)
+    expire_stale_jobs(key)
+    for attempt in range(SUBMIT_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                job = ReportJob.objects.create(kind=kind, parameters=parameters, fingerprint=key, in_flight_key=key, requested_by=user)
+            break
+        except IntegrityError:
+            job = ReportJob.objects.filter(in_flight_key=key).first()
+            if job is not None:
+                return job, False
+            if attempt == SUBMIT_ATTEMPTS - 1:
+                raise # no in-flight job to share, the INSERT failed on another constraint
+            # the in-flight job finished between the INSERT and the lookup, try again
+
+    if getattr(settings, 'REPORT_JOBS_EAGER', False):
+        _run_report_job(job.pk) # Compute inline, used by tests and single-process setups
+        job.refresh_from_db()
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_report_job, job.pk))
+    return job, True
+
+
+def run_report_job(job_id):
+    # Worker thread entry point, the thread gets its own database connection
+    close_old_connections()
+    try:
+        _run_report_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def _run_report_job(job_id):
+    # Compute the report file and record the outcome on the job
+    if not ReportJob.objects.filter(pk=job_id, status='PENDING').update(status='RUNNING', started_at=timezone.now()):
+        return # Already picked up by another worker
+    job = ReportJob.objects.get(pk=job_id)
+    try:
+        with analytics_reads(): # report queries may run on the read replica, the job bookkeeping stays on the primary
+            result_file = _build_report(job)
+    except Exception as exc:
+        ReportJob.objects.filter(pk=job_id, status='RUNNING').update(status='FAILED', error=str(exc), finished_at=timezone.now(), in_flight_key=None)
+        return
+    # Conditional so a job already expired as stale keeps its FAILED status
+    ReportJob.objects.filter(pk=job_id, status='RUNNING').update(status='SUCCEEDED', result_file=result_file, finished_at=timezone.now(), in_flight_key=None)
+
+
+def _build_report(job):
+    # Write the report for the job into REPORT_JOBS_DIR and return its file name
+    params = job.parameters
+    start_date = datetime.strptime(params['start_date'], '%Y-%m-%d')
+    end_date = datetime.strptime(params['end_date'], '%Y-%m-%d')
+
+    if job.kind == 'SALES_ANALYTICS':
+        file_name = f"{job.pk}.json"
+        with open(report_dir() / file_name, 'w') as output:
+            json.dump(SalesAnalytics(start_date, end_date).summary(), output, cls=DjangoJSONEncoder)
+        return file_name
+
+    if params.get('detail') == 'lines':
+        header, rows = ORDER_LINE_HEADER, order_line_rows(start_date, end_date)
+    else:
+        header, rows = CATEGORY_HEADER, category_rows(SalesAnalytics(start_date, end_date))
+    file_type = params.get('file_type', 'xlsx')
+    file_name = f"{job.pk}.{file_type}"
+    if file_type == 'csv':
+        with open(report_dir() / file_name, 'w', newline='') as output:
+            output.writelines(csv_stream(header, rows))
+    else:
+        write_xlsx(report_dir() / file_name, "Monthly Sales Report", header, rows)
+    return file_name
@@ -1,6 +1,39 @@
-from django.db.models import Sum, Count, F
-from datetime import datetime, timedelta
-from ..models import OrderItem,Customer
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import Sum, Count, F, Q, Exists, OuterRef, Window
+from django.db.models.functions import TruncMonth, TruncWeek, RowNumber, Round
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from ..models import OrderItem,Customer,Order,Product,DailySalesRollup,SalesSketch
+from ..instrumentation import instrumented
+from ..routers import replica_reads
+from .sketches import CMS_DELTA, HEAVY_HITTER_CAPACITY, HLL_RELATIVE_ERROR
+from .tax_rates import tax_rates
+
+CHURN_INACTIVITY_DAYS = 180 # churn is defined as no orders in the last 6 months
+
+TIME_SERIES_INTERVALS = ('day', 'week', 'month') # weeks start on Monday
+TIME_SERIES_MAX_BUCKETS = 1000 # about 2.7 years of days, 19 years of weeks
+TIME_SERIES_SPLITS = {'category': 'category__name', 'country': 'country'}
+
+async def in_worker_thread(func):
+    # Run blocking ORM work on a pooled thread, each thread holding its own database connection so several calls
+    # of one request run concurrently. The connection is kept or closed per CONN_MAX_AGE, like at the end of a request.
+    def run():
+        close_old_connections()
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return await sync_to_async(run, thread_sensitive=False)()
+
+def order_date_bounds(start_date, end_date):
+    # A date range covers whole days, from the start day through the end day like the daily rollup. Returns the aware
+    # [start, end) datetimes to filter order_date with: midnight of the start day and midnight after the end day.
+    days = [value.date() if isinstance(value, datetime) else value for value in (start_date, end_date)]
+    return tuple(timezone.make_aware(datetime.combine(day, time.min)) for day in (days[0], days[1] + timedelta(days=1)))
 
 class SalesAnalytics:
 
@@ -9,19 +42,193 @@ class SalesAnalytics:
         self.start_date = start_date
         self.end_date = end_date
 
-    def calculate_revenue_by_category(self):
-        # Calculate total revenue grouped by product category within the given date range
-        return (OrderItem.objects.filter(order__order_date__range=[self.start_date, self.end_date]).values('product__category__name').annotate(revenue=Sum(F('quantity') * F('price_at_time_of_order'))).order_by('-revenue'))
-
-    def top_selling_products_by_country(self):
-        # Identify the top-selling products by country in the given date range
-        return (OrderItem.objects.filter(order__order_date__range=[self.start_date, self.end_date]).values('order__customer__country', 'product__name').annotate(total_sales=Sum('quantity')).order_by('-total_sales'))
-
-    def calculate_customer_churn_rate(self):
-        # churn is defined as no orders in the last 6 months
-        six_months_ago = datetime.now() - timedelta(days=6 * 30)
-        total_customers = Customer.objects.count()
-        active_customers = Customer.objects.filter(orders__order_date__gte=six_months_ago).distinct().count() # Count customers with orders in the last 6 months
-        churned_customers = total_customers - active_customers
-        churn_rate = churned_customers / total_customers if total_customers > 0 else 0
-        return churn_rate
+    def _days(self):
+        # First and last day touched by the date range
+        start_day = self.start_date.date() if isinstance(self.start_date, datetime) else self.start_date
+        end_day = self.end_date.date() if isinstance(self.end_date, datetime) else self.end_date
+        return start_day, end_day
+
+    def _rollup(self):
+        # Daily rollup rows covering every day touched by the date range
+        return DailySalesRollup.objects.filter(day__range=self._days())
+
+    @staticmethod
+    def _bucket_start(day, interval):
+        if interval == 'week':
+            return day - timedelta(days=day.weekday())
+        if interval == 'month':
+            return day.replace(day=1)
+        return day
+
+    def _bucket_count(self, interval):
+        start_day, end_day = (self._bucket_start(day, interval) for day in self._days())
+        if interval == 'month':
+            return (end_day.year - start_day.year) * 12 + end_day.month - start_day.month + 1
+        return (end_day - start_day).days // (7 if interval == 'week' else 1) + 1
+
+    def _buckets(self, interval):
+        # Every bucket overlapping the range, in order, so gaps without sales come back as zeros
+        start_day, end_day = self._days()
+        bucket, buckets = self._bucket_start(start_day, interval), []
+        while bucket <= end_day:
+            buckets.append(bucket)
+            bucket = (bucket + timedelta(days=32)).replace(day=1) if interval == 'month' else bucket + timedelta(days=7 if interval == 'week' else 1)
+        return buckets
+
+    @instrumented
+    @replica_reads
+    def calculate_revenue_by_category(self, with_tax=False):
+        # Calculate total revenue grouped by product category within the given date range,
+        # with_tax adds the tax on that revenue at each rollup row's country rate
+        revenue = self._rollup().values(product__category__name=F('category__name'))
+        if with_tax: # annotated before the revenue total shadows the revenue column
+            revenue = revenue.annotate(tax=Round(Sum(F('revenue') * tax_rates.rate_expression('country')), 2, output_field=DailySalesRollup._meta.get_field('revenue')))
+        return revenue.annotate(revenue=Sum('revenue')).order_by('-revenue')
+
+    @instrumented
+    @replica_reads
+    def tax_by_country(self):
+        # Orders, order totals and tax per customer country in the date range, one grouped query with the rates as a CASE
+        start, end = order_date_bounds(self.start_date, self.end_date)
+        return (Order.objects.with_tax().filter(order_date__gte=start, order_date__lt=end)
+                .values('tax_rate', country=F('customer__country'))
+                .annotate(orders=Count('pk'), total_amount=Sum('total_amount'), tax=Sum('tax')).order_by('-tax', 'country'))
+
+    @instrumented
+    @replica_reads
+    def top_selling_products_by_country(self, limit=None, approx=False):
+        # Identify the top-selling products by country in the given date range, at most limit per country.
+        # approx=True merges the daily heavy hitter sketches instead of grouping rollup rows, see error_bounds().
+        if approx:
+            return self._approximate_top_selling(limit or HEAVY_HITTER_CAPACITY)
+        top = self._rollup().values(order__customer__country=F('country'), product__name=F('product__name')).annotate(total_sales=Sum('units'))
+        if limit is not None:
+            rank = Window(RowNumber(), partition_by=F('country'), order_by=[F('total_sales').desc(), F('product__name')])
+            top = top.annotate(rank=rank).filter(rank__lte=limit)
+        return top.order_by('-total_sales')
+
+    def _approximate_top_selling(self, limit):
+        top = []
+        for country, sketch in SalesSketch.top_products(*self._days()).items():
+            top += [(country, product_id, units, rank) for rank, (product_id, units) in enumerate(sketch.top(limit), 1)]
+        names = dict(Product.objects.filter(pk__in={product_id for _, product_id, _, _ in top}).values_list('pk', 'name'))
+        rows = [{'order__customer__country': country, 'product__name': names.get(product_id), 'total_sales': units, 'rank': rank}
+                for country, product_id, units, rank in top]
+        return sorted(rows, key=lambda row: -row['total_sales'])
+
+    @replica_reads
+    def error_bounds(self):
+        # Error bounds of the approx=True results: approximate unit counts never undercount and overcount by at most
+        # max_overcount per country with the given probability, active customer counts have the given relative error
+        return {
+            'top_selling_products': {
+                'max_overcount': {country: sketch.max_overcount() for country, sketch in SalesSketch.top_products(*self._days()).items()},
+                'probability': 1 - CMS_DELTA,
+            },
+            'customer_churn_rate': {'active_customers_relative_standard_error': HLL_RELATIVE_ERROR},
+        }
+
+    def _churn_dates(self, as_of=None, inactivity_days=CHURN_INACTIVITY_DAYS):
+        # Aware as-of datetime (end of the range by default) and the start of the inactivity window before it
+        as_of = as_of or self.end_date
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+        return as_of, as_of - timedelta(days=inactivity_days)
+
+    def _churn_window(self, as_of=None, inactivity_days=CHURN_INACTIVITY_DAYS):
+        # Customers registered by the as-of date and the Q matching the active ones
+        as_of, cutoff = self._churn_dates(as_of, inactivity_days)
+        # last_order_date answers the question directly unless the customer ordered again after as_of,
+        # only those customers need an (indexed) look at their orders inside the window
+        ordered_in_window = Exists(Order.objects.filter(customer=OuterRef('pk'), order_date__gte=cutoff, order_date__lte=as_of))
+        active = Q(last_order_date__gte=cutoff, last_order_date__lte=as_of) | Q(Q(last_order_date__gt=as_of) & ordered_in_window)
+        return Customer.objects.filter(registration_date__lte=as_of), active
+
+    @staticmethod
+    def _churn_counts(row):
+        churned = row['customers'] - row['active_customers']
+        return {**row, 'churned_customers': churned, 'churn_rate': churned / row['customers'] if row['customers'] else 0}
+
+    @instrumented
+    @replica_reads
+    def calculate_customer_churn_rate(self, as_of=None, inactivity_days=CHURN_INACTIVITY_DAYS, approx=False):
+        # Share of customers registered by as_of without an order in the inactivity window before it,
+        # a single count over the denormalized customer last_order_date.
+        # approx=True counts the active customers with the union of the daily HyperLogLog sketches instead.
+        customers, active = self._churn_window(as_of, inactivity_days)
+        if approx:
+            as_of, cutoff = self._churn_dates(as_of, inactivity_days)
+            registered = customers.count()
+            active_customers = min(SalesSketch.active_customers(timezone.localdate(cutoff), timezone.localdate(as_of)).count(), registered)
+            return self._churn_counts({'customers': registered, 'active_customers': active_customers})['churn_rate']
+        return self._churn_counts(customers.aggregate(customers=Count('pk'), active_customers=Count('pk', filter=active)))['churn_rate']
+
+    @instrumented
+    @replica_reads
+    def churn_breakdown(self, as_of=None, inactivity_days=CHURN_INACTIVITY_DAYS):
+        # Overall churn plus churn per monthly registration cohort and per country
+        customers, active = self._churn_window(as_of, inactivity_days)
+        counts = {'customers': Count('pk'), 'active_customers': Count('pk', filter=active)}
+        by_cohort = customers.annotate(cohort=TruncMonth('registration_date')).values('cohort').annotate(**counts).order_by('cohort')
+        by_country = customers.values('country').annotate(**counts).order_by('country')
+        return {
+            'as_of': (as_of or self.end_date).isoformat(),
+            'inactivity_days': inactivity_days,
+            'overall': self._churn_counts(customers.aggregate(**counts)),
+            'by_cohort': [self._churn_counts({**row, 'cohort': row['cohort'].date().isoformat()}) for row in by_cohort],
+            'by_country': [self._churn_counts(row) for row in by_country],
+        }
+
+    @instrumented
+    @replica_reads
+    def revenue_time_series(self, interval='day', split_by=None):
+        # Revenue and units per day, week or month (optionally per category or country) from one grouped
+        # rollup query, returned column-wise: one list of bucket dates and one value list per series
+        if interval not in TIME_SERIES_INTERVALS:
+            raise ValueError(f"interval must be one of {', '.join(TIME_SERIES_INTERVALS)}")
+        if split_by is not None and split_by not in TIME_SERIES_SPLITS:
+            raise ValueError(f"split_by must be one of {', '.join(TIME_SERIES_SPLITS)}")
+        if self._bucket_count(interval) > TIME_SERIES_MAX_BUCKETS:
+            raise ValueError(f"The date range spans more than {TIME_SERIES_MAX_BUCKETS} {interval} buckets, use a longer interval or a shorter range")
+
+        bucket = {'day': F('day'), 'week': TruncWeek('day'), 'month': TruncMonth('day')}[interval]
+        groups = {'bucket': bucket, 'series': F(TIME_SERIES_SPLITS[split_by])} if split_by else {'bucket': bucket}
+        rows = self._rollup().values(**groups).annotate(revenue=Sum('revenue'), units=Sum('units')).order_by()
+
+        buckets = self._buckets(interval)
+        position = {bucket: index for index, bucket in enumerate(buckets)}
+        series = {}
+        for row in rows:
+            values = series.setdefault(row.get('series'), {'revenue': [Decimal('0')] * len(buckets), 'units': [0] * len(buckets)})
+            index = position[row['bucket']]
+            values['revenue'][index] = row['revenue']
+            values['units'][index] = row['units']
+        return {
+            'interval': interval,
+            'split_by': split_by,
+            'buckets': [bucket.isoformat() for bucket in buckets],
+            'series': [{'key': key, **values} for key, values in sorted(series.items(), key=lambda item: (item[0] is None, item[0] or ''))],
+        }
+
+    def _summary_parts(self, limit, approx):
+        # Name and computation of each independent part of the summary
+        parts = {
+            'revenue_by_category': lambda: list(self.calculate_revenue_by_category()),
+            'top_selling_products': lambda: list(self.top_selling_products_by_country(limit, approx)),
+            'customer_churn_rate': lambda: self.calculate_customer_churn_rate(approx=approx),
+        }
+        if approx:
+            parts['error_bounds'] = self.error_bounds
+        return parts
+
+    @instrumented
+    @replica_reads
+    def summary(self, limit=None, approx=False):
+        # Revenue, top sellers and churn for the date range as plain lists for JSON responses and reports
+        return {name: compute() for name, compute in self._summary_parts(limit, approx).items()}
+
+    async def asummary(self, limit=None, approx=False):
+        # summary() for async views, the parts are queried concurrently on separate connections
+        parts = self._summary_parts(limit, approx)
+        values = await asyncio.gather(*(in_worker_thread(compute) for compute in parts.values()))
+        return dict(zip(parts, values))
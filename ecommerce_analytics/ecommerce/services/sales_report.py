@@ -0,0 +1,60 @@
+import csv
+from django.utils import timezone
+from openpyxl import Workbook
+from ..models import OrderItem
+from ..routers import analytics_db
+from .sales_analytics import order_date_bounds
+from .tax_rates import tax_rates, round_tax
+
+CATEGORY_HEADER = ['Category', 'Revenue', 'Tax']
+ORDER_LINE_HEADER = ['Order ID', 'Order Date', 'Status', 'Country', 'SKU', 'Product', 'Category', 'Quantity', 'Unit Price', 'Line Revenue', 'Line Tax']
+
+
+def category_rows(sales_analytics):
+    # One row per category with its revenue and tax for the analytics date range
+    for item in sales_analytics.calculate_revenue_by_category(with_tax=True):
+        yield [item['product__category__name'], item['revenue'], item['tax']]
+
+
+def order_line_rows(start_date, end_date, chunk_size=2000):
+    # One row per order item in the date range (whole days, see order_date_bounds), fetched in primary key order with keyset
+    # pagination so only chunk_size rows are held in memory on any database backend. Read from the replica when available.
+    start, end = order_date_bounds(start_date, end_date)
+    items = (OrderItem.objects.using(analytics_db()).filter(order__order_date__gte=start, order__order_date__lt=end).order_by('pk')
+             .values_list('pk', 'order_id', 'order__order_date', 'order__status', 'order__customer__country',
+                          'product__SKU', 'product__name', 'product__category__name', 'quantity', 'price_at_time_of_order'))
+    rates, default_rate = tax_rates.rates(), tax_rates.default_rate() # line tax is computed from the cached rates, no extra queries
+    last_pk = 0
+    while True:
+        chunk = list(items.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        for pk, order_id, order_date, status, country, sku, name, category, quantity, price in chunk:
+            order_date = timezone.localtime(order_date).replace(tzinfo=None) if timezone.is_aware(order_date) else order_date
+            revenue = quantity * price
+            yield [order_id, order_date, status, country, sku, name, category, quantity, price, revenue, round_tax(revenue * rates.get(country, default_rate))]
+        last_pk = chunk[-1][0]
+
+
+class _Echo:
+    # Pseudo-buffer handing each written CSV line straight back to the caller
+    def write(self, value):
+        return value
+
+
+def csv_stream(header, rows):
+    # Encode the header and rows as CSV lines one at a time for StreamingHttpResponse
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(output, title, header, rows):
+    # Write rows to an Excel file using openpyxl's write-only mode, which streams rows to disk
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=title)
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(output)
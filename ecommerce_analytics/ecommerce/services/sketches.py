@@ -0,0 +1,107 @@
+import hashlib
+import math
+
+import numpy as np
+
+# Count-Min: estimates overcount by at most EPSILON * total units with probability 1 - DELTA
+CMS_WIDTH = 512
+CMS_DEPTH = 4
+CMS_EPSILON = math.e / CMS_WIDTH
+CMS_DELTA = math.exp(-CMS_DEPTH)
+# Space-Saving: candidates tracked per sketch, any item above total / capacity is guaranteed to be kept
+HEAVY_HITTER_CAPACITY = 64
+# HyperLogLog: 2^precision one-byte registers, relative standard error 1.04 / sqrt(registers)
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_RELATIVE_ERROR = 1.04 / math.sqrt(HLL_REGISTERS)
+
+
+def _hash(key):
+    # Two independent 64 bit hashes of a key, stable across processes (unlike hash())
+    digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class HeavyHitters:
+    # Top products of one sketch: Space-Saving keeps the candidate keys, a Count-Min table gives their counts.
+    # Both merge (table sums, candidate union), so per-day sketches combine into any date range.
+
+    def __init__(self, table=None, candidates=None, total=0):
+        self.table = np.zeros((CMS_DEPTH, CMS_WIDTH), dtype=np.int64) if table is None else table
+        self.candidates = candidates or {} # key -> Space-Saving count
+        self.total = total
+
+    def _columns(self, key):
+        h1, h2 = _hash(key)
+        return [(h1 + row * h2) % CMS_WIDTH for row in range(CMS_DEPTH)]
+
+    def add(self, key, count=1):
+        self.table[np.arange(CMS_DEPTH), self._columns(key)] += count
+        self.total += count
+        if key in self.candidates or len(self.candidates) < HEAVY_HITTER_CAPACITY:
+            self.candidates[key] = self.candidates.get(key, 0) + count
+        else:
+            # Space-Saving: the new key takes over the smallest counter, inheriting its count as error
+            smallest = min(self.candidates, key=self.candidates.get)
+            self.candidates[key] = self.candidates.pop(smallest) + count
+
+    def estimate(self, key):
+        return int(self.table[np.arange(CMS_DEPTH), self._columns(key)].min())
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        for key, count in other.candidates.items():
+            self.candidates[key] = self.candidates.get(key, 0) + count
+
+    def top(self, limit):
+        # (key, estimated count) of the largest candidates, counted with the Count-Min table
+        estimates = sorted(((key, self.estimate(key)) for key in self.candidates), key=lambda item: (-item[1], str(item[0])))
+        return estimates[:limit]
+
+    def max_overcount(self):
+        # Count-Min error bound for the estimates of this sketch
+        return math.ceil(CMS_EPSILON * self.total)
+
+    def to_bytes(self):
+        return self.table.astype(np.int64).tobytes()
+
+    @classmethod
+    def from_bytes(cls, payload, candidates, total):
+        table = np.frombuffer(payload, dtype=np.int64).reshape(CMS_DEPTH, CMS_WIDTH).copy()
+        return cls(table, dict(candidates), total)
+
+
+class HyperLogLog:
+    # Distinct count estimate from 2^p registers holding the longest run of leading zero bits seen
+
+    def __init__(self, registers=None):
+        self.registers = np.zeros(HLL_REGISTERS, dtype=np.uint8) if registers is None else registers
+
+    def add(self, key, count=1):
+        # count is accepted for symmetry with HeavyHitters, repeats never change a distinct count
+        h1, _ = _hash(key)
+        index = h1 >> (64 - HLL_PRECISION)
+        rest = h1 & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = HLL_REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros) # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, payload):
+        return cls(np.frombuffer(payload, dtype=np.uint8).copy())
@@ -2,6 +2,7 @@ from django.test import TestCase
 from ..models import Category, Tag, Product, Customer, Order, OrderItem, Inventory
 from django.utils import timezone
 from decimal import Decimal
+from datetime import timedelta
 
 
 class CategoryModelTest(TestCase):
@@ -76,6 +77,37 @@ class CustomerModelTest(TestCase):
         lifetime_value = self.customer.lifetime_value()
         self.assertEqual(lifetime_value, Decimal('1000.00'))
 
+    def test_denormalized_order_stats(self):
+        # Test that order statistics are maintained on the customer row as orders change
+        first = Order.objects.create(customer=self.customer, total_amount=Decimal('100.00'), order_date=timezone.now() - timedelta(days=10))
+        last = Order.objects.create(customer=self.customer, total_amount=Decimal('50.00'))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.total_spent, Decimal('150.00'))
+        self.assertEqual(self.customer.order_count, 2)
+        self.assertEqual(self.customer.first_order_date, first.order_date)
+        self.assertEqual(self.customer.last_order_date, last.order_date)
+        last.delete()
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.total_spent, self.customer.order_count), (Decimal('100.00'), 1))
+
+    def test_stale_customer_save_keeps_order_stats(self):
+        # Test that saving an instance loaded before the latest order does not write back its old statistics
+        Order.objects.create(customer=self.customer, total_amount=Decimal('10.00'))
+        stale = Customer.objects.get(pk=self.customer.pk)
+        Order.objects.create(customer=self.customer, total_amount=Decimal('5.00'))
+        stale.name = "Jane Doe"
+        stale.save()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.name, "Jane Doe")
+        self.assertEqual((self.customer.total_spent, self.customer.order_count), (Decimal('15.00'), 2))
+
+    def test_with_order_stats_for_range(self):
+        # Test the ad-hoc range annotation only counts orders inside the range
+        Order.objects.create(customer=self.customer, total_amount=Decimal('100.00'), order_date=timezone.now() - timedelta(days=10))
+        Order.objects.create(customer=self.customer, total_amount=Decimal('50.00'))
+        customer = Customer.objects.with_order_stats(start_date=timezone.now() - timedelta(days=1)).get(pk=self.customer.pk)
+        self.assertEqual((customer.period_total_spent, customer.period_order_count), (Decimal('50.00'), 1))
+
 class OrderModelTest(TestCase):
     def setUp(self):
         # Create a test customer and order
@@ -98,6 +130,12 @@ class OrderModelTest(TestCase):
         default_tax_rate = Decimal('0.05') 
         tax_rate = country_tax_rates.get(self.customer.country, default_tax_rate)
         return self.total_amount * tax_rate
+
+    def test_calculate_tax(self):
+        # Test that tax uses the rate table with Decimal arithmetic and falls back to the default rate
+        self.assertEqual(self.order.calculate_tax(), Decimal('70.00'))
+        self.customer.country = "NZ"
+        self.assertEqual(self.order.calculate_tax(), Decimal('50.00'))
  
 class OrderItemModelTest(TestCase):
     def setUp(self):
@@ -0,0 +1,1008 @@
+from datetime import date, datetime, timedelta
+from io import StringIO
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import connection, models
+from django.db.models import F, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ..models import Category, Product, Customer, Order, OrderItem, Inventory, DailySalesRollup
+from ..services.sales_analytics import SalesAnalytics
+
+
+class DailySalesRollupTest(TestCase):
+    def setUp(self):
+        # Create a catalog, a customer and two orders on the same day
+        self.category = Category.objects.create(name="Electronics")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="LAPTOP1", category=self.category)
+        self.phone = Product.objects.create(name="Phone", price=Decimal('500.00'), SKU="PHONE1", category=self.category)
+        for product in (self.laptop, self.phone):
+            Inventory.objects.create(product=product, quantity=100, last_restocked_date=timezone.now())
+        self.customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+        self.order_date = timezone.make_aware(datetime(2024, 5, 10, 12, 0))
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('3500.00'), order_date=self.order_date)
+        OrderItem.objects.create(order=order, product=self.laptop, quantity=2, price_at_time_of_order=Decimal('1500.00'))
+        OrderItem.objects.create(order=order, product=self.phone, quantity=1, price_at_time_of_order=Decimal('500.00'))
+        self.analytics = SalesAnalytics(datetime(2024, 5, 1), datetime(2024, 5, 31))
+
+    def test_rollup_updated_incrementally(self):
+        # Each new order item should land in the rollup row for its day, country and product
+        row = DailySalesRollup.objects.get(product=self.laptop)
+        self.assertEqual(row.day, self.order_date.date())
+        self.assertEqual(row.country, "US")
+        self.assertEqual(row.units, 2)
+        self.assertEqual(row.revenue, Decimal('3000.00'))
+
+    def test_revenue_by_category_from_rollup(self):
+        # Revenue by category should be answered from the rollup rows
+        revenue = list(self.analytics.calculate_revenue_by_category())
+        self.assertEqual(revenue, [{'product__category__name': "Electronics", 'revenue': Decimal('3500.00')}])
+
+    def test_top_selling_products_by_country(self):
+        # Top sellers should be ordered by units sold
+        top = list(self.analytics.top_selling_products_by_country())
+        self.assertEqual(top[0], {'order__customer__country': "US", 'product__name': "Laptop", 'total_sales': 2})
+
+    def test_deleting_item_removes_it_from_rollup(self):
+        # Deleting an order item should subtract it from the rollup
+        OrderItem.objects.get(product=self.phone).delete()
+        row = DailySalesRollup.objects.get(product=self.phone)
+        self.assertEqual(row.units, 0)
+        self.assertEqual(row.revenue, Decimal('0.00'))
+
+    def test_edits_move_rollup_rows(self):
+        # Editing a line, moving the order to another day and moving the customer to another country should leave
+        # the rollup as a rebuild would
+        item = OrderItem.objects.get(product=self.laptop)
+        item.quantity, item.price_at_time_of_order = 3, Decimal('1400.00')
+        item.save()
+        self.assertEqual((DailySalesRollup.objects.get(product=self.laptop).units, DailySalesRollup.objects.get(product=self.laptop).revenue), (3, Decimal('4200.00')))
+        order = Order.objects.get()
+        order.order_date = self.order_date + timedelta(days=2)
+        order.save()
+        customer = Customer.objects.get()
+        customer.country = "CA"
+        customer.save()
+        rows = lambda: set(DailySalesRollup.objects.exclude(units=0).values_list('day', 'country', 'product', 'units', 'revenue'))
+        self.assertEqual(rows(), {(date(2024, 5, 12), "CA", self.laptop.pk, 3, Decimal('4200.00')), (date(2024, 5, 12), "CA", self.phone.pk, 1, Decimal('500.00'))})
+        expected = rows()
+        call_command('rebuild_sales_rollup', stdout=StringIO())
+        self.assertEqual(rows(), expected)
+
+    def test_end_day_is_included_everywhere(self):
+        # An order in the afternoon of the end day counts in rollup, order and order line queries alike
+        from ..services.sales_report import order_line_rows
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('500.00'), order_date=timezone.make_aware(datetime(2024, 5, 31, 15, 0)))
+        OrderItem.objects.create(order=order, product=self.phone, quantity=1, price_at_time_of_order=Decimal('500.00'))
+        Order.objects.create(customer=self.customer, total_amount=Decimal('500.00'), order_date=timezone.make_aware(datetime(2024, 6, 1)))
+        self.assertEqual(list(self.analytics.calculate_revenue_by_category())[0]['revenue'], Decimal('4000.00'))
+        self.assertEqual([(row['orders'], row['total_amount']) for row in self.analytics.tax_by_country()], [(2, Decimal('4000.00'))])
+        self.assertEqual(sorted(row[0] for row in order_line_rows(self.analytics.start_date, self.analytics.end_date)), sorted([Order.objects.get(order_date=self.order_date).pk] * 2 + [order.pk]))
+
+    def test_rebuild_command(self):
+        # Rebuilding a date range should recreate the same rollup rows from order items
+        DailySalesRollup.objects.all().delete()
+        call_command('rebuild_sales_rollup', start_date='2024-05-01', end_date='2024-05-31', stdout=StringIO())
+        self.assertEqual(DailySalesRollup.objects.count(), 2)
+        self.assertEqual(DailySalesRollup.objects.get(product=self.laptop).revenue, Decimal('3000.00'))
+
+    def test_daily_time_series_is_columnar(self):
+        # Every day of the range gets a bucket, days without sales are zero
+        with self.assertNumQueries(1):
+            series = self.analytics.revenue_time_series('day')
+        self.assertEqual(len(series['buckets']), 31)
+        self.assertEqual(series['buckets'][9], '2024-05-10')
+        self.assertEqual(len(series['series']), 1)
+        self.assertEqual(series['series'][0]['revenue'][9], Decimal('3500.00'))
+        self.assertEqual(series['series'][0]['units'][9], 3)
+        self.assertEqual(sum(series['series'][0]['units']), 3)
+
+    def test_weekly_time_series_split_by_category(self):
+        # Weeks start on Monday and each category is its own series
+        uncategorized = Product.objects.create(name="Cable", price=Decimal('5.00'), SKU="CABLE1")
+        Inventory.objects.create(product=uncategorized, quantity=10, last_restocked_date=timezone.now())
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('5.00'), order_date=timezone.make_aware(datetime(2024, 5, 20, 12, 0)))
+        OrderItem.objects.create(order=order, product=uncategorized, quantity=1, price_at_time_of_order=Decimal('5.00'))
+        series = self.analytics.revenue_time_series('week', split_by='category')
+        self.assertEqual(series['buckets'], ['2024-04-29', '2024-05-06', '2024-05-13', '2024-05-20', '2024-05-27'])
+        self.assertEqual([row['key'] for row in series['series']], ['Electronics', None])
+        self.assertEqual(series['series'][0]['revenue'], [0, Decimal('3500.00'), 0, 0, 0])
+        self.assertEqual(series['series'][1]['units'], [0, 0, 0, 1, 0])
+
+    def test_monthly_time_series_rejects_unknown_split(self):
+        # Months are keyed by their first day and unsupported splits are refused
+        self.assertEqual(self.analytics.revenue_time_series('month')['buckets'], ['2024-05-01'])
+        with self.assertRaises(ValueError):
+            self.analytics.revenue_time_series('month', split_by='status')
+
+    def test_time_series_revenue_is_decimal(self):
+        # Buckets without sales are Decimal zeros like the buckets with sales
+        revenue = self.analytics.revenue_time_series('day')['series'][0]['revenue']
+        self.assertTrue(all(isinstance(value, Decimal) for value in revenue))
+
+
+from django.test import override_settings
+from ..services.analytics_cache import AnalyticsCache
+
+
+class AnalyticsCacheTest(TestCase):
+    def setUp(self):
+        # Use a private cache instance so counters start at zero
+        self.cache = AnalyticsCache()
+        self.cache.backend.clear()
+        self.customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+
+    def test_hit_and_miss_counters(self):
+        # The second lookup for the same key should be served from the cache
+        calls = []
+        compute = lambda: calls.append(1) or ['result']
+        self.assertEqual(self.cache.get_or_compute('sales', '2024-01-01', '2024-01-31', compute), ['result'])
+        self.assertEqual(self.cache.get_or_compute('sales', '2024-01-01', '2024-01-31', compute), ['result'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+    def test_order_write_invalidates_entries(self):
+        # Creating an order should bump the data version so the next lookup recomputes
+        self.cache.get_or_compute('sales', '2024-01-01', '2024-01-31', lambda: ['old'])
+        Order.objects.create(customer=self.customer, total_amount=Decimal('10.00'))
+        self.assertEqual(self.cache.get_or_compute('sales', '2024-01-01', '2024-01-31', lambda: ['new']), ['new'])
+
+    @override_settings(CACHES={'analytics': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'lru-test', 'OPTIONS': {'MAX_ENTRIES': 2}}})
+    def test_least_recently_used_entry_is_evicted(self):
+        # Touching the first key keeps it, so the second key is evicted by the third insert
+        self.cache.get_or_compute('sales', 'a', 'a', lambda: 1)
+        self.cache.get_or_compute('sales', 'b', 'b', lambda: 2)
+        self.cache.get_or_compute('sales', 'a', 'a', lambda: 1)
+        self.cache.get_or_compute('sales', 'c', 'c', lambda: 3)
+        self.assertEqual(self.cache.get_or_compute('sales', 'a', 'a', lambda: 'recomputed'), 1)
+        self.assertEqual(self.cache.get_or_compute('sales', 'b', 'b', lambda: 'recomputed'), 'recomputed')
+        self.assertEqual(self.cache.stats()['evictions'], 2)
+
+
+class CustomerHistoryTestCase(TestCase):
+    def setUp(self):
+        # Customers registered in January and February 2024 with different ordering histories
+        jan, feb = timezone.make_aware(datetime(2024, 1, 10)), timezone.make_aware(datetime(2024, 2, 10))
+        self.active = Customer.objects.create(name="Active", email="active@example.com", country="US", registration_date=jan)
+        self.lapsed = Customer.objects.create(name="Lapsed", email="lapsed@example.com", country="US", registration_date=jan)
+        self.returning = Customer.objects.create(name="Returning", email="returning@example.com", country="UK", registration_date=feb)
+        Customer.objects.create(name="Never", email="never@example.com", country="UK", registration_date=feb)
+        Customer.objects.create(name="Later", email="later@example.com", country="UK", registration_date=timezone.make_aware(datetime(2024, 12, 1)))
+        for customer, day in ((self.active, datetime(2024, 9, 28)), (self.lapsed, datetime(2024, 1, 15)), (self.returning, datetime(2024, 5, 1)), (self.returning, datetime(2024, 10, 1))):
+            Order.objects.create(customer=customer, total_amount=Decimal('10.00'), order_date=timezone.make_aware(day))
+        self.analytics = SalesAnalytics(datetime(2024, 9, 1), datetime(2024, 9, 30))
+
+
+class CustomerChurnTest(CustomerHistoryTestCase):
+    def test_churn_rate_as_of_end_date(self):
+        # Test that churn is anchored on the end of the range and ignores customers registered later
+        with self.assertNumQueries(1):
+            rate = self.analytics.calculate_customer_churn_rate()
+        self.assertEqual(rate, 2 / 4) # lapsed and never, returning ordered in May before ordering again after the range
+
+    def test_inactivity_window(self):
+        # Test that a shorter window no longer sees the May order
+        self.assertEqual(self.analytics.calculate_customer_churn_rate(inactivity_days=7), 3 / 4)
+
+    def test_breakdown_by_cohort_and_country(self):
+        # Test that churn is broken down by registration month and by country
+        breakdown = self.analytics.churn_breakdown()
+        self.assertEqual(breakdown['overall']['churned_customers'], 2)
+        self.assertEqual([(row['cohort'], row['customers'], row['churned_customers']) for row in breakdown['by_cohort']], [('2024-01-01', 2, 1), ('2024-02-01', 2, 1)])
+        self.assertEqual([(row['country'], row['churn_rate']) for row in breakdown['by_country']], [('UK', 0.5), ('US', 0.5)])
+
+
+import inspect
+import re
+
+
+# Tables that grow with order volume and must never be read with a full scan
+FACT_TABLES = {OrderItem._meta.db_table, Order._meta.db_table, DailySalesRollup._meta.db_table}
+
+
+class AnalyticsQueryPlanTest(CustomerHistoryTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name="Electronics")
+        laptop = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="LAPTOP1", category=category)
+        Inventory.objects.create(product=laptop, quantity=100, last_restocked_date=timezone.now())
+        for order in Order.objects.all():
+            OrderItem.objects.create(order=order, product=laptop, quantity=1, price_at_time_of_order=Decimal('10.00'))
+
+    def full_scans(self, sql):
+        # Fact tables read with a full table scan according to the database's plan for the query, also when the
+        # query reads them under an alias (Django names subquery tables U0, U1, ...)
+        names = {table: table for table in FACT_TABLES}
+        names.update((alias, table) for table, alias in re.findall(r'"(\w+)" (?:AS )?"?(\w+)"?', sql) if table in FACT_TABLES)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('EXPLAIN ' + sql)
+                columns = [column[0] for column in cursor.description]
+                plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                return {names[row['table']] for row in plan if row['type'] == 'ALL' and row['table'] in names}
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            scanned = [re.match(r'SCAN (\w+)', row[-1]) for row in cursor.fetchall()]
+            return {names[match[1]] for match in scanned if match and match[1] in names}
+
+    def test_sales_analytics_queries_use_indexes(self):
+        # Test that no public SalesAnalytics method scans a whole fact table
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest("EXPLAIN output is only checked on SQLite and MySQL")
+        methods = [name for name, method in inspect.getmembers(SalesAnalytics, inspect.isfunction)
+                   if not name.startswith('_') and not inspect.iscoroutinefunction(method)]
+        self.assertIn('tax_by_country', methods)
+        self.assertEqual(self.full_scans(f'SELECT U0."id" FROM "{Order._meta.db_table}" U0'), {Order._meta.db_table}) # aliases are resolved
+        for name in methods:
+            with CaptureQueriesContext(connection) as queries:
+                result = getattr(self.analytics, name)()
+                if isinstance(result, models.QuerySet):
+                    list(result) # querysets are returned lazily
+            self.assertTrue(queries.captured_queries)
+            for query in queries.captured_queries:
+                with self.subTest(method=name, sql=query['sql']):
+                    self.assertEqual(self.full_scans(query['sql']), set())
+
+from ..models import ProductCoPurchase, co_purchase_additions
+from ..services.recommendation_engine import RecommendationEngine
+
+
+class PurchaseHistoryTestCase(TestCase):
+    def setUp(self):
+        # Three customers with overlapping baskets
+        self.products = {}
+        for sku in ('A', 'B', 'C', 'D'):
+            self.products[sku] = Product.objects.create(name=sku, price=Decimal('10.00'), SKU=sku)
+            Inventory.objects.create(product=self.products[sku], quantity=100, last_restocked_date=timezone.now())
+        self.alice = self._customer('alice', ['A'])
+        self._customer('bob', ['A', 'B', 'C'])
+        self._customer('carol', ['A', 'B'])
+
+    def _customer(self, name, skus):
+        customer = Customer.objects.create(name=name, email=f"{name}@example.com", country="US")
+        for sku in skus:
+            self._order(customer, sku)
+        return customer
+
+    def _order(self, customer, sku):
+        # The co-purchase index is updated once the order's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(customer=customer, total_amount=Decimal('10.00'))
+            OrderItem.objects.create(order=order, product=self.products[sku], quantity=1, price_at_time_of_order=Decimal('10.00'))
+        return order
+
+
+class CoPurchaseRecommendationTest(PurchaseHistoryTestCase):
+    def test_index_counts_customers_per_pair(self):
+        # A and B were bought together by two customers, A and C by one
+        score = lambda p, q: ProductCoPurchase.objects.get(product=self.products[p], related_product=self.products[q]).score
+        self.assertEqual(score('A', 'B'), 2)
+        self.assertEqual(score('B', 'A'), 2)
+        self.assertEqual(score('A', 'C'), 1)
+        self.assertFalse(ProductCoPurchase.objects.filter(product=self.products['D']).exists())
+
+    def test_repeat_purchase_does_not_double_count(self):
+        # Buying a product again should not add to its pairs
+        self._order(self.alice, 'A')
+        self.assertEqual(ProductCoPurchase.objects.get(product=self.products['A'], related_product=self.products['B']).score, 2)
+
+    def test_deleted_items_are_subtracted(self):
+        # Deleting an order takes its products out of the customer's pairs, unless another order still has them
+        score = lambda p, q: ProductCoPurchase.objects.get(product=self.products[p], related_product=self.products[q]).score
+        order = self._order(self.alice, 'B')
+        self._order(self.alice, 'C')
+        self.assertEqual((score('A', 'B'), score('B', 'C')), (3, 2))
+        repeat = self._order(self.alice, 'C')
+        with self.captureOnCommitCallbacks(execute=True):
+            repeat.delete()
+        self.assertEqual(score('B', 'C'), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual((score('A', 'B'), score('B', 'A'), score('B', 'C'), score('C', 'B')), (2, 2, 1, 1))
+        self.assertEqual(score('A', 'C'), 2)
+        expected = set(ProductCoPurchase.objects.filter(score__gt=0).values_list('product', 'related_product', 'score'))
+        call_command('rebuild_copurchase_index', stdout=StringIO())
+        self.assertEqual(set(ProductCoPurchase.objects.values_list('product', 'related_product', 'score')), expected)
+
+    def test_index_updated_once_per_transaction(self):
+        # Both items of an order are applied in one batch after commit, the new product's pairs in 2 UPDATEs
+        bob = Customer.objects.get(name='bob')
+        with self.captureOnCommitCallbacks() as callbacks:
+            order = Order.objects.create(customer=bob, total_amount=Decimal('20.00'))
+            for _ in range(2):
+                OrderItem.objects.create(order=order, product=self.products['D'], quantity=1, price_at_time_of_order=Decimal('10.00'))
+        self.assertFalse(ProductCoPurchase.objects.filter(product=self.products['D']).exists())
+        index_callbacks = [callback for callback in callbacks if getattr(callback, 'func', None) == co_purchase_additions.flush]
+        self.assertEqual(len(index_callbacks), 1)
+        with self.assertNumQueries(7): # savepoint, new items, purchase history, row inserts, 2 UPDATEs, release
+            index_callbacks[0]()
+        self.assertEqual(set(ProductCoPurchase.objects.filter(product=self.products['D']).values_list('related_product__SKU', 'score')), {('A', 1), ('B', 1), ('C', 1)})
+        self.assertEqual(ProductCoPurchase.objects.get(product=self.products['A'], related_product=self.products['D']).score, 1)
+
+    def test_recommendations_ranked_by_score(self):
+        # Alice bought A, so B (score 2) should rank ahead of C (score 1)
+        recommended = RecommendationEngine(self.alice).suggest_from_similar_customers()
+        self.assertEqual([product.SKU for product in recommended], ['B', 'C'])
+        self.assertEqual(recommended[0].recommendation_score, 2)
+
+    def test_instrumented_results_stay_lazy(self):
+        # Test that instrumented service methods do not evaluate the querysets they return
+        from ..instrumentation import service_stats
+        service_stats.reset()
+        with self.assertNumQueries(0):
+            suggestions = RecommendationEngine(self.alice).suggest_from_order_history()
+        with self.assertNumQueries(1):
+            list(suggestions[:1])
+        RecommendationEngine(self.alice).suggest_from_similar_customers()
+        self.assertGreater(service_stats.snapshot()['RecommendationEngine.suggest_from_similar_customers']['mean_queries'], 0)
+
+    def test_rebuild_command_matches_incremental_index(self):
+        # Rebuilding from order history should reproduce the incrementally maintained scores
+        expected = set(ProductCoPurchase.objects.values_list('product', 'related_product', 'score'))
+        call_command('rebuild_copurchase_index', stdout=StringIO())
+        self.assertEqual(set(ProductCoPurchase.objects.values_list('product', 'related_product', 'score')), expected)
+
+
+from ..models import CustomerRecommendation
+from ..services.batch_recommendations import generate_recommendations
+
+
+class BatchRecommendationTest(PurchaseHistoryTestCase):
+    def test_batch_matches_live_engine(self):
+        # The vectorized batch should produce the same ranking as the live engine
+        self.assertEqual(generate_recommendations(top_k=5), 3) # Alice gets B and C, Carol gets C, Bob owns everything
+        rows = CustomerRecommendation.objects.filter(customer=self.alice).order_by('rank')
+        self.assertEqual([(row.product.SKU, row.score, row.rank) for row in rows], [('B', 2.0, 1), ('C', 1.0, 2)])
+
+    def test_top_k_limits_rows_per_customer(self):
+        # Only the best recommendation per customer is kept with top_k=1
+        generate_recommendations(top_k=1)
+        self.assertEqual(CustomerRecommendation.objects.filter(customer=self.alice).get().product.SKU, 'B')
+
+
+from ..services.order_ingestion import ingest_orders
+
+
+class BulkOrderIngestionTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Electronics")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="LAPTOP1", category=self.category)
+        self.phone = Product.objects.create(name="Phone", price=Decimal('500.00'), SKU="PHONE1", category=self.category)
+        Inventory.objects.create(product=self.laptop, quantity=3, last_restocked_date=timezone.now())
+        Inventory.objects.create(product=self.phone, quantity=10, last_restocked_date=timezone.now())
+        self.customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+
+    def order(self, *items):
+        return {'customer_id': self.customer.pk, 'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in items]}
+
+    def test_batch_within_stock_is_created(self):
+        # All orders fit, so stock drops once per product and derived data is maintained
+        results = ingest_orders([self.order((self.laptop, 1), (self.phone, 2)), self.order((self.laptop, 2))])
+        self.assertEqual([result['status'] for result in results], ['created', 'created'])
+        self.assertEqual(Inventory.objects.get(product=self.laptop).quantity, 0)
+        self.assertEqual(Inventory.objects.get(product=self.phone).quantity, 8)
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.customer.refresh_from_db()
+        self.assertEqual((self.customer.order_count, self.customer.total_spent), (2, Decimal('5500.00')))
+        self.assertEqual(DailySalesRollup.objects.get(product=self.laptop).units, 3)
+
+    def test_insufficient_stock_reported_per_line(self):
+        # The second order cannot get a laptop, so it is rejected and its phone stock is put back
+        results = ingest_orders([self.order((self.laptop, 2)), self.order((self.phone, 4), (self.laptop, 2))])
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertEqual(results[1]['status'], 'rejected')
+        self.assertEqual([line['status'] for line in results[1]['lines']], ['ok', 'insufficient_stock'])
+        self.assertEqual(Inventory.objects.get(product=self.laptop).quantity, 1)
+        self.assertEqual(Inventory.objects.get(product=self.phone).quantity, 10)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_unknown_references_are_rejected(self):
+        # Unknown customers and products are reported without touching stock
+        results = ingest_orders([{'customer_id': 999, 'items': [{'product_id': self.phone.pk, 'quantity': 1}]},
+                                 {'customer_id': self.customer.pk, 'items': [{'product_id': 999, 'quantity': 1}]}])
+        self.assertEqual(results[0]['error'], 'unknown_customer')
+        self.assertEqual(results[1]['lines'][0]['status'], 'unknown_product')
+        self.assertEqual(Inventory.objects.get(product=self.phone).quantity, 10)
+
+    def test_ids_read_back_without_bulk_returning(self):
+        # Backends that cannot return ids from bulk inserts (MySQL) read them back by the batch's marker
+        from unittest import mock
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                mock.patch('ecommerce.services.order_ingestion.Order.objects.bulk_create', wraps=Order.objects.bulk_create) as bulk_create:
+            results = ingest_orders([self.order((self.phone, 1)) for _ in range(3)])
+        bulk_create.assert_called_once()
+        orders = Order.objects.filter(pk__in=[result['order_id'] for result in results])
+        self.assertEqual(len({order.ingest_batch for order in orders}), 1)
+        self.assertEqual(OrderItem.objects.filter(order__in=orders).count(), 3)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.order_count, 3)
+
+
+import json
+import tempfile
+from pathlib import Path
+from django.core.management.base import CommandError
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_generate_and_benchmark(self):
+        # A small synthetic data set should be generated and benchmarked end to end
+        call_command('generate_synthetic_data', order_lines=300, customers=30, products=20, categories=3, stdout=StringIO())
+        self.assertEqual(OrderItem.objects.count(), 300)
+        self.assertEqual(DailySalesRollup.objects.aggregate(units=models.Sum('units'))['units'], OrderItem.objects.aggregate(units=models.Sum('quantity'))['units'])
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            call_command('run_benchmarks', only=['sales_analytics', 'customer'], repeat=1, output=str(output), stdout=StringIO())
+            report = json.loads(output.read_text())
+        self.assertEqual(report['row_counts']['OrderItem'], 300)
+        self.assertEqual(report['results']['sales_analytics.revenue_by_category']['queries'], 1)
+
+    def test_stress_command_refuses_unsafe_runs(self):
+        # Without DEBUG every run needs --yes, and empty runs are refused before anything is written
+        with self.assertRaises(CommandError):
+            call_command('stress_inventory_reservations', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('stress_inventory_reservations', attempts=0, yes=True, stdout=StringIO())
+        product = Product.objects.create(name="Widget", price=Decimal('1.00'), SKU="WIDGET1")
+        Inventory.objects.create(product=product, quantity=3, last_restocked_date=timezone.now())
+        with self.assertRaises(CommandError):
+            call_command('stress_inventory_reservations', product=product.pk, stdout=StringIO())
+        self.assertEqual(Product.objects.get().pk, product.pk)
+        self.assertEqual(Inventory.objects.get().quantity, 3)
+
+
+from django.test import TransactionTestCase
+
+
+class StressReservationCommandTest(TransactionTestCase):
+    def test_product_stock_is_put_back(self):
+        # Reservations against an existing product are undone once the run is over
+        product = Product.objects.create(name="Widget", price=Decimal('1.00'), SKU="WIDGET1")
+        Inventory.objects.create(product=product, quantity=3, last_restocked_date=timezone.now())
+        stdout = StringIO()
+        call_command('stress_inventory_reservations', product=product.pk, threads=1, attempts=5, yes=True, stdout=stdout)
+        self.assertIn("reserved 3, rejected 2", stdout.getvalue())
+        self.assertEqual(Inventory.objects.get().quantity, 3)
+
+
+from datetime import date
+from ..services.columnar_engine import ColumnarEngine
+
+
+class ColumnarEngineTest(TestCase):
+    def setUp(self):
+        # Two categories sold in two countries over two months
+        electronics, books = Category.objects.create(name="Electronics"), Category.objects.create(name="Books")
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="LAPTOP1", category=electronics)
+        self.novel = Product.objects.create(name="Novel", price=Decimal('12.50'), SKU="NOVEL1", category=books)
+        for product in (self.laptop, self.novel):
+            Inventory.objects.create(product=product, quantity=100, last_restocked_date=timezone.now())
+        us = Customer.objects.create(name="Ann", email="ann@example.com", country="US")
+        uk = Customer.objects.create(name="Bob", email="bob@example.com", country="UK")
+        self.orders = []
+        for customer, day, product, quantity, status in ((us, datetime(2024, 4, 30), self.laptop, 1, 'DELIVERED'), (us, datetime(2024, 5, 2), self.novel, 4, 'DELIVERED'),
+                                                         (uk, datetime(2024, 5, 3), self.novel, 2, 'PENDING'), (uk, datetime(2024, 5, 20), self.laptop, 2, 'SHIPPED')):
+            order = Order.objects.create(customer=customer, total_amount=product.price * quantity, order_date=timezone.make_aware(day), status=status)
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price_at_time_of_order=product.price)
+            self.orders.append(order)
+        self.engine = ColumnarEngine(max_age=3600)
+
+    def test_group_by_matches_sql(self):
+        # Test that a multi-dimension group-by gives the same sums as the database
+        result = self.engine.query(['category', 'country'])
+        rows = set(zip(*(result['columns'][name] for name in ('category', 'country', 'revenue', 'units', 'lines'))))
+        expected = OrderItem.objects.values_list('product__category__name', 'order__customer__country').annotate(
+            revenue=Sum(F('quantity') * F('price_at_time_of_order')), units=Sum('quantity'), lines=models.Count('pk'))
+        self.assertEqual(rows, set(expected))
+        self.assertEqual(result['columns']['revenue'][0], Decimal('3000.00')) # sorted by revenue, UK laptops first
+
+    def test_filters_and_date_dimensions(self):
+        # Test filtering on dimension values and an inclusive date range, grouped by month
+        result = self.engine.query(['month'], ['units'], filters={'status': ['DELIVERED', 'PENDING']}, start_date=date(2024, 4, 30), end_date=date(2024, 5, 3))
+        self.assertEqual(result['columns'], {'month': ['2024-05', '2024-04'], 'units': [6, 1]})
+
+    def test_incremental_refresh(self):
+        # Test that new lines and updated or deleted orders are picked up without a full reload
+        self.engine.query()
+        loaded_at = self.engine.loaded_at
+        order = self.orders[2]
+        order.status = 'CANCELLED'
+        order.save()
+        self.orders[3].delete()
+        new_order = Order.objects.create(customer=order.customer, total_amount=Decimal('12.50'), status='PENDING')
+        OrderItem.objects.create(order=new_order, product=self.novel, quantity=1, price_at_time_of_order=Decimal('12.50'))
+        result = self.engine.query(['status'], ['units'])
+        self.assertEqual(self.engine.loaded_at, loaded_at)
+        self.assertEqual(dict(zip(result['columns']['status'], result['columns']['units'])), {'DELIVERED': 5, 'CANCELLED': 2, 'PENDING': 1})
+
+    def test_every_engine_sees_order_changes(self):
+        # Test that a second engine draining its change notifications leaves this engine's untouched
+        other = ColumnarEngine(max_age=3600)
+        self.engine.query()
+        other.query()
+        order = self.orders[2]
+        order.status = 'CANCELLED'
+        order.save()
+        other.refresh()
+        result = self.engine.query(['status'], ['units'])
+        self.assertEqual(result['columns'], other.query(['status'], ['units'])['columns'])
+        self.assertIn('CANCELLED', result['columns']['status'])
+
+    def test_query_reads_one_state(self):
+        # Test that a refresh landing mid-query, adding dictionary values, does not change what the query sees
+        group_by = ['status', 'country', 'category']
+        expected = self.engine.query(group_by)
+        store = self.engine.store
+        customer = Customer.objects.create(name="Chloe", email="chloe@example.com", country="FR")
+        order = Order.objects.create(customer=customer, total_amount=Decimal('25.00'), status='RETURNED')
+        OrderItem.objects.create(order=order, product=self.novel, quantity=2, price_at_time_of_order=Decimal('12.50'))
+        dimension, calls = store._dimension, []
+        def refresh_mid_query(*args):
+            calls.append(args[1])
+            if len(calls) == len(group_by):
+                self.engine.refresh() # after the first two group-by dimensions were folded into the key
+            return dimension(*args)
+        with mock.patch.object(store, '_dimension', side_effect=refresh_mid_query):
+            self.assertEqual(store.query(group_by), expected)
+        self.assertEqual(len(store.dictionaries['country'].values), 3)
+        self.assertEqual(self.engine.query(['country'], ['lines'], filters={'country': ['FR']})['columns'], {'country': ['FR'], 'lines': [1]})
+
+import fcntl
+import tempfile
+import numpy as np
+from ..services.columnar_snapshot import append_delta, current_snapshot, delta_path, delta_writer, load_snapshot
+
+
+# Also runs the engine tests against an engine warm started from a snapshot
+class ColumnarSnapshotTest(ColumnarEngineTest):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.engine = ColumnarEngine(max_age=3600, snapshot_dir=self.directory.name)
+        self.engine.write_snapshot()
+
+    def test_warm_start_maps_snapshot(self):
+        # Test that a reload maps the snapshot read-only and answers like a database load
+        self.engine.reload()
+        self.assertIsInstance(self.engine.store.base.item_id.base, np.memmap)
+        self.assertFalse(self.engine.store.base.item_id.flags.writeable)
+        self.assertEqual(self.engine.query(['category', 'month']), ColumnarEngine(snapshot_dir=None).query(['category', 'month']))
+
+    def test_delta_carries_new_lines_and_dictionary_values(self):
+        # Test that lines appended to the delta, including a new country, are replayed on load
+        customer = Customer.objects.create(name="Chloe", email="chloe@example.com", country="FR")
+        order = Order.objects.create(customer=customer, total_amount=Decimal('25.00'))
+        OrderItem.objects.create(order=order, product=self.novel, quantity=2, price_at_time_of_order=Decimal('12.50'))
+        self.assertEqual(self.engine.append_delta(), 1)
+        self.assertEqual(self.engine.append_delta(), 0)
+        with open(delta_path(current_snapshot(self.directory.name)), 'ab') as delta:
+            delta.write(b'ECOLDLTA\x10') # a block cut short is ignored
+        with self.assertLogs('ecommerce.services.columnar_snapshot', 'WARNING'):
+            self.engine.reload()
+        result = self.engine.query(['country'], ['units'])
+        self.assertEqual(dict(zip(result['columns']['country'], result['columns']['units'])), {'US': 5, 'UK': 4, 'FR': 2})
+        self.assertEqual(len(self.engine.store.tail), 1)
+
+    def test_delta_writers_do_not_repeat_lines(self):
+        # Test that the delta is locked while appending, that lines already in it are dropped and that the next
+        # append cuts off an incomplete block so the blocks after it are read
+        order = Order.objects.create(customer=self.orders[0].customer, total_amount=Decimal('25.00'))
+        OrderItem.objects.create(order=order, product=self.novel, quantity=2, price_at_time_of_order=Decimal('12.50'))
+        snapshot = current_snapshot(self.directory.name)
+        with delta_writer(snapshot) as delta:
+            with open(delta_path(snapshot), 'rb') as other, self.assertRaises(BlockingIOError):
+                fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            store, _ = load_snapshot(snapshot)
+            block = self.engine._load(store, OrderItem.objects.filter(order=order))
+            self.assertEqual(append_delta(delta, block, {}, int(block.item_id.max())), 1)
+            self.assertEqual(append_delta(delta, block, {}, int(block.item_id.max())), 0)
+            delta.write(b'ECOLDLTA\x10')
+        OrderItem.objects.create(order=order, product=self.laptop, quantity=1, price_at_time_of_order=Decimal('1500.00'))
+        with self.assertLogs('ecommerce.services.columnar_snapshot', 'WARNING'):
+            self.assertEqual(self.engine.append_delta(), 1)
+        self.engine.reload()
+        self.assertEqual(len(self.engine.store.tail), 2)
+
+
+from ..models import SalesSketch, sales_sketch_additions
+from ..services.sketches import HeavyHitters, HyperLogLog, HLL_RELATIVE_ERROR
+
+
+class SalesSketchTest(CustomerHistoryTestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True): # sketches are updated once the transaction commits
+            super().setUp()
+            # Two countries buying a catalog with a clear order of best sellers
+            category = Category.objects.create(name="Books")
+            self.products = [Product.objects.create(name=f"Book {index}", price=Decimal('10.00'), SKU=f"BOOK{index}", category=category) for index in range(5)]
+            for product in self.products:
+                Inventory.objects.create(product=product, quantity=100, last_restocked_date=timezone.now())
+            for customer, quantities in ((self.active, (9, 7, 5, 3, 1)), (self.returning, (2, 4, 6, 8, 10))):
+                order = Order.objects.create(customer=customer, total_amount=Decimal('10.00'), order_date=timezone.make_aware(datetime(2024, 9, 15)))
+                for product, quantity in zip(self.products, quantities):
+                    OrderItem.objects.create(order=order, product=product, quantity=quantity, price_at_time_of_order=Decimal('10.00'))
+
+    def test_sketches_updated_once_per_transaction(self):
+        # Test that a transaction's orders and items reach each sketch row in a single read-modify-write
+        with self.captureOnCommitCallbacks() as callbacks:
+            for customer in (self.active, self.lapsed):
+                order = Order.objects.create(customer=customer, total_amount=Decimal('10.00'), order_date=timezone.make_aware(datetime(2024, 9, 16)))
+                for product in self.products[:3]:
+                    OrderItem.objects.create(order=order, product=product, quantity=1, price_at_time_of_order=Decimal('10.00'))
+        self.assertFalse(SalesSketch.objects.filter(day=date(2024, 9, 16)).exists())
+        sketch_callbacks = [callback for callback in callbacks if getattr(callback, 'func', None) == sales_sketch_additions.flush]
+        with CaptureQueriesContext(connection) as queries:
+            for callback in sketch_callbacks:
+                callback()
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE') and 'salessketch' in query['sql']]
+        self.assertEqual(len(updates), 2) # US top products and active customers, every customer of the day is in the US
+        self.assertEqual(SalesSketch.top_products(date(2024, 9, 16), date(2024, 9, 16))['US'].top(1), [(self.products[0].pk, 2)])
+        self.assertEqual(SalesSketch.active_customers(date(2024, 9, 16), date(2024, 9, 16)).count(), 2)
+
+    def test_hyperloglog_within_error_bounds(self):
+        # Test that the distinct count of a large stream, repeats included, stays within a few standard errors
+        sketch, other = HyperLogLog(), HyperLogLog()
+        for key in range(20000):
+            sketch.add(key)
+            other.add(key + 10000)
+        sketch.merge(HyperLogLog.from_bytes(other.to_bytes()))
+        self.assertLess(abs(sketch.count() - 30000) / 30000, 4 * HLL_RELATIVE_ERROR)
+
+    def test_heavy_hitters_find_frequent_keys(self):
+        # Test that frequent keys survive a long tail of rare ones and are never undercounted
+        sketch = HeavyHitters()
+        for key in range(1000):
+            sketch.add(key, 1000 - key if key < 5 else 1)
+        top = sketch.top(5)
+        self.assertEqual([key for key, _ in top], [0, 1, 2, 3, 4])
+        for key, count in top:
+            self.assertGreaterEqual(count, 1000 - key)
+            self.assertLessEqual(count, 1000 - key + sketch.max_overcount())
+
+    def test_exact_top_n_per_country(self):
+        # Test that limit keeps the best sellers of every country rather than of the whole result
+        top = list(self.analytics.top_selling_products_by_country(limit=2))
+        self.assertEqual(sorted((row['order__customer__country'], row['product__name'], row['total_sales'], row['rank']) for row in top),
+                         [('UK', 'Book 3', 8, 2), ('UK', 'Book 4', 10, 1), ('US', 'Book 0', 9, 1), ('US', 'Book 1', 7, 2)])
+
+    def test_approximate_top_sellers_match_exact(self):
+        # Test that small sketches answer exactly and report their error bounds
+        approx = self.analytics.top_selling_products_by_country(limit=2, approx=True)
+        exact = self.analytics.top_selling_products_by_country(limit=2)
+        self.assertEqual(sorted(approx, key=str), sorted(exact, key=str))
+        self.assertEqual(self.analytics.error_bounds()['top_selling_products']['max_overcount'], {'US': 1, 'UK': 1})
+
+    def test_approximate_churn_matches_exact(self):
+        # Test that churn from the active customers sketches matches the exact rate on small data
+        self.assertEqual(self.analytics.calculate_customer_churn_rate(approx=True), self.analytics.calculate_customer_churn_rate())
+
+    def test_rebuild_command(self):
+        # Test that rebuilding from history recreates the sketches kept up to date on insert
+        before = {(row.kind, row.day, row.country): (bytes(row.payload), row.total) for row in SalesSketch.objects.all()}
+        call_command('rebuild_sales_sketches', chunk_size=3, stdout=StringIO())
+        after = {(row.kind, row.day, row.country): (bytes(row.payload), row.total) for row in SalesSketch.objects.all()}
+        self.assertEqual(after, before)
+
+
+from ..models import TaxRate
+from ..services.tax_rates import tax_rates
+
+
+class TaxTest(TestCase):
+    def setUp(self):
+        # Two customers buying the same day, one in a country without a rate row taxed at the default rate
+        self.addCleanup(tax_rates.invalidate) # rates cached inside a rolled back test must not leak into the next
+        category = Category.objects.create(name="Electronics")
+        self.phone = Product.objects.create(name="Phone", price=Decimal('500.00'), SKU="PHONE1", category=category)
+        Inventory.objects.create(product=self.phone, quantity=100, last_restocked_date=timezone.now())
+        for country, quantity in (("US", 7), ("NZ", 1)):
+            customer = Customer.objects.create(name=country, email=f"{country}@example.com", country=country)
+            order = Order.objects.create(customer=customer, total_amount=Decimal('500.00') * quantity, order_date=timezone.make_aware(datetime(2024, 5, 10, 12, 0)))
+            OrderItem.objects.create(order=order, product=self.phone, quantity=quantity, price_at_time_of_order=Decimal('500.00'))
+        self.analytics = SalesAnalytics(datetime(2024, 5, 1), datetime(2024, 5, 31))
+
+    def test_with_tax_in_one_query(self):
+        # Test that a queryset of orders is taxed in the query that loads it
+        tax_rates.rates()
+        with self.assertNumQueries(1):
+            taxes = {order.customer_id: (order.tax, order.calculate_tax()) for order in Order.objects.with_tax()}
+        self.assertEqual(sorted(taxes.values()), [(Decimal('25.00'), Decimal('25.00')), (Decimal('245.00'), Decimal('245.00'))])
+
+    def test_tax_by_country(self):
+        # Test that the report groups orders by country with their rate
+        tax_rates.rates()
+        with self.assertNumQueries(1):
+            report = list(self.analytics.tax_by_country())
+        self.assertEqual([(row['country'], row['tax_rate'], row['orders'], row['total_amount'], row['tax']) for row in report],
+                         [("US", Decimal('0.0700'), 1, Decimal('3500.00'), Decimal('245.00')), ("NZ", Decimal('0.0500'), 1, Decimal('500.00'), Decimal('25.00'))])
+
+    def test_revenue_by_category_with_tax(self):
+        # Test that category tax sums each country's revenue at its own rate
+        revenue = list(self.analytics.calculate_revenue_by_category(with_tax=True))
+        self.assertEqual(revenue, [{'product__category__name': "Electronics", 'revenue': Decimal('4000.00'), 'tax': Decimal('270.00')}])
+
+    def test_rate_change_invalidates_cache(self):
+        # Test that cached rates are reused until a rate is written
+        tax_rates.rates()
+        with self.assertNumQueries(0):
+            self.assertEqual(tax_rates.rate_for("US"), Decimal('0.0700'))
+        TaxRate.objects.create(country="NZ", rate=Decimal('0.15'))
+        self.assertEqual(Order.objects.with_tax().get(customer__country="NZ").tax, Decimal('75.00'))
+
+
+import threading
+import time
+from unittest import mock
+from django.db import connections
+from ..db_backends.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.autocommit_mode = True
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        pass
+
+    def autocommit(self, value):
+        self.autocommit_mode = value
+
+
+class ConnectionPoolTest(TestCase):
+    def test_connections_are_reused(self):
+        # Test that a returned connection is handed out again instead of opening a new one
+        pool = ConnectionPool(FakeConnection, size=2)
+        first, reused = pool.acquire()
+        self.assertFalse(reused)
+        pool.release(first)
+        self.assertEqual(pool.acquire(), (first, True))
+        self.assertEqual((pool.stats()['opened'], pool.stats()['in_use'], pool.stats()['checkouts']), (1, 1, 2))
+
+    def test_bounded_with_waits_and_timeouts(self):
+        # Test that a full pool makes callers wait for a release and gives up after the timeout
+        pool = ConnectionPool(FakeConnection, size=1, timeout=0.05)
+        connection, _ = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.timeout = 5
+        threading.Timer(0.05, pool.release, [connection]).start()
+        self.assertEqual(pool.acquire(), (connection, True))
+        stats = pool.stats()
+        self.assertEqual((stats['open'], stats['waits'], stats['timeouts']), (1, 2, 1))
+        self.assertGreater(stats['wait_ms'], 0)
+
+    def test_unusable_and_expired_connections_are_replaced(self):
+        # Test that a failed health check or an exceeded lifetime closes the idle connection
+        pool = ConnectionPool(FakeConnection, size=1, is_usable=lambda connection: False)
+        connection, _ = pool.acquire()
+        pool.release(connection)
+        replacement, reused = pool.acquire()
+        self.assertTrue(connection.closed)
+        self.assertFalse(reused)
+        pool = ConnectionPool(FakeConnection, size=1, max_lifetime=0)
+        connection, _ = pool.acquire()
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_mysql_backend_returns_connections_to_pool(self):
+        # Test that closing the pooled backend's connection hands it back, and discards it mid-transaction
+        from ..db_backends.mysql_pool.base import DatabaseWrapper, mysql
+        settings_dict = {**connections['default'].settings_dict, 'NAME': 'pooltest', 'CONN_HEALTH_CHECKS': False, 'POOL': {'SIZE': 1}, 'OPTIONS': {}}
+        wrapper = DatabaseWrapper(settings_dict, alias='pooltest')
+        with mock.patch.object(mysql.DatabaseWrapper, 'get_new_connection', lambda self, params: FakeConnection()):
+            wrapper.connection = first = wrapper.get_new_connection({})
+            wrapper.autocommit = False # closed with an open transaction
+            wrapper.close()
+            self.assertFalse(first.closed)
+            self.assertTrue(first.autocommit_mode)
+            wrapper.connection = wrapper.get_new_connection({})
+            self.assertIs(wrapper.connection, first)
+            wrapper.in_atomic_block = True
+            wrapper.close()
+            self.assertTrue(first.closed)
+        self.assertEqual(wrapper.pool.stats()['in_use'], 0)
+
+
+from ..routers import AnalyticsReplicaRouter, RequestState, _request_state, analytics_db, analytics_reads, replica_reads, replica_status
+
+@override_settings(ANALYTICS_REPLICA_DATABASE='replica', REPLICA_CHECK_INTERVAL=60, REPLICA_MAX_LAG=30)
+class ReplicaRoutingTest(TestCase):
+    def setUp(self):
+        replica_status.reset()
+        self.addCleanup(replica_status.reset)
+
+    def test_analytics_reads_use_replica_when_caught_up(self):
+        # Test that analytics querysets are pinned to the replica while plain reads and writes stay on the primary
+        router = AnalyticsReplicaRouter()
+        with mock.patch('ecommerce.routers.replication_lag', return_value=5):
+            self.assertEqual(replica_reads(lambda: Order.objects.all())().db, 'replica')
+            with analytics_reads():
+                self.assertEqual(router.db_for_read(Order), 'replica')
+                self.assertEqual(router.db_for_write(Order), 'default')
+            self.assertEqual(Order.objects.all().db, 'default')
+            self.assertFalse(router.allow_migrate('replica', 'ecommerce'))
+
+    def test_falls_back_to_primary(self):
+        # Test that a lagging, stopped or unreachable replica is bypassed until the next check
+        for lag in (31, None):
+            replica_status.reset()
+            with mock.patch('ecommerce.routers.replication_lag', return_value=lag):
+                self.assertEqual(analytics_db(), 'default')
+        replica_status.reset()
+        with mock.patch('ecommerce.routers.replication_lag', side_effect=OSError("connection refused")):
+            self.assertEqual(analytics_db(), 'default')
+        self.assertEqual(replica_status.stats()['error'], "connection refused")
+        with mock.patch('ecommerce.routers.replication_lag', return_value=0) as lag:
+            self.assertEqual(analytics_db(), 'default') # cached until REPLICA_CHECK_INTERVAL has passed
+            lag.assert_not_called()
+
+    def test_write_pins_request_to_primary(self):
+        # Test that reads after a write in the same request are not sent to the replica
+        state = RequestState()
+        token = _request_state.set(state)
+        self.addCleanup(_request_state.reset, token)
+        with mock.patch('ecommerce.routers.replication_lag', return_value=0):
+            self.assertEqual(analytics_db(), 'replica')
+            AnalyticsReplicaRouter().db_for_write(Inventory)
+            self.assertEqual(analytics_db(), 'default')
+        self.assertTrue(state.wrote)
+
+
+from ..services.inventory_restock import read_restock_csv, restock_inventory
+
+
+class InventoryRestockTest(TestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name=f"Part {number}", price=Decimal('2.00'), SKU=f"PART{number}") for number in range(4)]
+        for product in self.products[:3]:
+            Inventory.objects.create(product=product, quantity=10, last_restocked_date=timezone.make_aware(datetime(2024, 1, 1)))
+
+    def test_batch_is_applied_with_set_based_updates(self):
+        # Test deltas, absolute quantities, SKUs, repeated products and new inventory rows in a constant number of queries
+        rows = [
+            {'sku': 'PART0', 'delta': 5, 'restocked_at': '2024-03-01'},
+            {'product_id': self.products[1].pk, 'quantity': 3},
+            {'product_id': self.products[0].pk, 'delta': -12},
+            {'sku': 'PART3', 'quantity': 7},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            results = restock_inventory(rows, chunk_size=2)
+        self.assertEqual([(result['status'], result.get('quantity')) for result in results], [('updated', 15), ('updated', 3), ('updated', 3), ('created', 7)])
+        stock = {inventory.product.SKU: inventory for inventory in Inventory.objects.select_related('product')}
+        self.assertEqual({sku: inventory.quantity for sku, inventory in stock.items()}, {'PART0': 3, 'PART1': 3, 'PART2': 10, 'PART3': 7})
+        self.assertEqual(stock['PART0'].last_restocked_date, timezone.make_aware(datetime(2024, 3, 1)))
+        self.assertEqual(stock['PART1'].last_restocked_date, timezone.make_aware(datetime(2024, 1, 1))) # lowering stock is not a restock
+        # SKU and id lookups, then per chunk of two products one locking SELECT and one UPDATE or INSERT, plus the savepoint
+        self.assertLessEqual(len(queries), 8)
+
+    def test_invalid_rows_are_rejected_individually(self):
+        # Test that bad rows are reported per row while the valid ones are applied
+        rows = [
+            {'sku': 'MISSING', 'delta': 1},
+            {'product_id': self.products[2].pk, 'delta': -11},
+            {'product_id': self.products[2].pk},
+            {'sku': 'PART2', 'product_id': self.products[2].pk, 'delta': 1},
+            {'product_id': 'abc', 'quantity': 1},
+            {'product_id': self.products[2].pk, 'quantity': -1},
+            {'product_id': self.products[2].pk, 'delta': 2, 'restocked_at': 'yesterday'},
+            {'product_id': self.products[2].pk, 'delta': 2},
+        ]
+        results = restock_inventory(rows)
+        self.assertEqual([result.get('error') for result in results], [
+            'unknown_product', 'insufficient_stock', 'delta_or_quantity_required', 'sku_or_product_id_required',
+            'invalid_product_id', 'invalid_quantity', 'invalid_restocked_at', None])
+        self.assertEqual(results[1]['available'], 10)
+        self.assertEqual(Inventory.objects.get(product=self.products[2]).quantity, 12)
+
+    def test_restock_command_reads_csv(self):
+        # Test that the management command applies a CSV batch and reports rejected rows
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write("sku,product_id,delta,quantity,restocked_at\nPART0,,4,,\n,%d,,0,\nNOPE,,1,,\n" % self.products[1].pk)
+        self.addCleanup(Path(source.name).unlink)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('restock_inventory', source.name, stdout=stdout, stderr=stderr)
+        self.assertIn("Updated 2 inventory rows, created 0, rejected 1.", stdout.getvalue())
+        self.assertIn("Row 2 rejected: unknown_product", stderr.getvalue())
+        self.assertEqual(list(Inventory.objects.filter(product__in=self.products[:2]).order_by('product_id').values_list('quantity', flat=True)), [14, 0])
+        with self.assertRaises(ValueError):
+            read_restock_csv("sku,amount\nPART0,1\n")
+
+
+from django.db import transaction
+from ..services.low_stock import low_stock_alerts
+
+
+class RecordingSink:
+    batches = []
+
+    def send(self, alerts):
+        RecordingSink.batches.append(alerts)
+
+
+@override_settings(LOW_STOCK_ALERTS_EAGER=True, LOW_STOCK_ALERT_SINKS=['ecommerce.tests_files.test_Service.RecordingSink'], LOW_STOCK_ALERT_COOLDOWN=3600)
+class LowStockAlertTest(TestCase):
+    def setUp(self):
+        low_stock_alerts.reset()
+        self.addCleanup(low_stock_alerts.reset)
+        RecordingSink.batches = []
+        self.widget = Product.objects.create(name="Widget", price=Decimal('3.00'), SKU="WIDGET1")
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('4.00'), SKU="GADGET1")
+        Inventory.objects.create(product=self.widget, quantity=12, low_stock_threshold=10, last_restocked_date=timezone.now())
+        Inventory.objects.create(product=self.gadget, quantity=8, last_restocked_date=timezone.now())
+
+    def alerted(self):
+        return [[alert['sku'] for alert in batch] for batch in RecordingSink.batches]
+
+    def test_alert_only_when_crossing_threshold(self):
+        # Test that the per-product threshold is used and only the decrement crossing it raises an alert
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                self.assertTrue(Inventory.objects.decrement(self.widget.pk, 1)) # 11 left, still above 10
+            self.assertTrue(Inventory.objects.decrement(self.widget.pk, 3)) # 8 left, crossed
+            self.assertTrue(Inventory.objects.decrement(self.widget.pk, 1)) # already low
+            self.assertTrue(Inventory.objects.decrement(self.gadget.pk, 3)) # 5 left, default threshold 5 not crossed
+            self.assertFalse(Inventory.objects.decrement(self.gadget.pk, 6))
+        self.assertEqual(self.alerted(), [['WIDGET1']])
+        self.assertEqual(RecordingSink.batches[0][0]['quantity'], 7)
+
+    def test_rolled_back_write_does_not_alert(self):
+        # Test that alerts are only sent for committed stock changes
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Inventory.objects.decrement(self.widget.pk, 5)
+                    raise ValueError
+        self.assertEqual(self.alerted(), [])
+
+    def test_save_alerts_without_loading_the_product(self):
+        # Test that saving a loaded row alerts on the crossing with a single UPDATE and no product query
+        inventory = Inventory.objects.get(product=self.gadget)
+        inventory.quantity = 2
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertNumQueries(1):
+                inventory.save()
+            inventory.quantity = 1
+            inventory.save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.alerted(), [['GADGET1']])
+
+    def test_low_stock_rows_found_through_index(self):
+        # Test that low-stock rows are listed from the inventory_low_stock expression index, sorted without a scan
+        Inventory.objects.filter(product=self.gadget).update(quantity=2)
+        rows = Inventory.objects.low_stock().order_by('quantity')
+        self.assertEqual([row.product_id for row in rows], [self.gadget.pk])
+        if connection.vendor != 'sqlite':
+            self.skipTest("query plan checked on SQLite only")
+        plan = rows.explain()
+        self.assertIn('USING INDEX inventory_low_stock', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    @override_settings(LOW_STOCK_ALERTS_EAGER=False, LOW_STOCK_ALERT_BATCH_SECONDS=3600)
+    def test_alerts_are_batched_and_deduplicated(self):
+        # Test that queued alerts go out in one batch, once per product, and restocked products are dropped
+        low_stock_alerts.enqueue([self.widget.pk, self.gadget.pk])
+        low_stock_alerts.enqueue([self.widget.pk])
+        Inventory.objects.filter(product=self.widget).update(quantity=2)
+        Inventory.objects.filter(product=self.gadget).update(quantity=2)
+        self.assertEqual(low_stock_alerts.stats()['pending'], 2)
+        self.assertEqual(RecordingSink.batches, [])
+        low_stock_alerts.flush()
+        self.assertEqual(self.alerted(), [['WIDGET1', 'GADGET1']])
+        low_stock_alerts.enqueue([self.widget.pk]) # within the cooldown
+        self.assertEqual((low_stock_alerts.stats()['pending'], low_stock_alerts.stats()['suppressed']), (0, 2))
+        Inventory.objects.filter(product=self.gadget).update(quantity=50)
+        low_stock_alerts.reset()
+        low_stock_alerts.enqueue([self.gadget.pk])
+        self.assertEqual(low_stock_alerts.flush(), [])
+
+    def test_bulk_restock_alerts_on_crossing(self):
+        # Test that an adjustment below the threshold in a restock batch raises an alert, a restock above it none
+        with self.captureOnCommitCallbacks(execute=True):
+            restock_inventory([{'sku': 'WIDGET1', 'delta': -5}, {'sku': 'GADGET1', 'delta': 20}])
+        self.assertEqual(self.alerted(), [['WIDGET1']])
@@ -3,7 +3,7 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
-from ..models import Customer, Order, OrderItem, Product, Inventory, Category  
+from ..models import Customer, Order, OrderItem, Product, Inventory, Category, Tag
 from django.utils import timezone  
 class SalesDataViewTest(APITestCase):
     def setUp(self):
@@ -100,7 +100,30 @@ class ExportSalesReportViewTest(TestCase):
         ws = wb.active
         self.assertEqual(ws.title, "Monthly Sales Report")
         header = [cell.value for cell in ws[1]]
-        self.assertEqual(header, ['Category', 'Revenue'])
+        self.assertEqual(header, ['Category', 'Revenue', 'Tax'])
+
+    def test_export_order_lines_csv_streams(self):
+        # Test streaming CSV export of individual order lines
+        category = Category.objects.create(name="Electronics")
+        product = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="ABC123", category=category)
+        Inventory.objects.create(product=product, quantity=10, last_restocked_date=timezone.now())
+        customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+        order = Order.objects.create(customer=customer, total_amount=Decimal('3000.00'), order_date=timezone.make_aware(timezone.datetime(2024, 3, 5)))
+        OrderItem.objects.create(order=order, product=product, quantity=2, price_at_time_of_order=Decimal('1500.00'))
+        response = self.client.get(self.url, {'start_date': '2024-03-01', 'end_date': '2024-03-31', 'detail': 'lines', 'file_type': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'Order ID,Order Date,Status,Country,SKU,Product,Category,Quantity,Unit Price,Line Revenue,Line Tax')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith('US,ABC123,Laptop,Electronics,2,1500.00,3000.00,210.00'))
+
+    def test_export_order_lines_xlsx(self):
+        # Test write-only Excel export of order lines served from a temporary file
+        response = self.client.get(self.url, {'start_date': '2024-03-01', 'end_date': '2024-03-31', 'detail': 'lines'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        wb = load_workbook(filename=BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual([cell.value for cell in wb.active[1]][:3], ['Order ID', 'Order Date', 'Status'])
 
 # Test cases for Customer Info View
 from ..serializers import CustomerSerializer
@@ -125,4 +148,435 @@ class CustomerInfoViewTest(APITestCase):
     def test_get_customer_info_not_found(self):
         # Test response when customer is not found
         response = self.client.get(reverse('customer-info', kwargs={'pk': 999})) 
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+# Test cases for background report jobs
+import tempfile
+from datetime import timedelta
+from django.test import override_settings
+from ..models import ReportJob
+
+class ReportJobViewTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyst', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.report_dir.cleanup)
+        self.payload = {'kind': 'sales_export', 'start_date': '2024-01-01', 'end_date': '2024-03-31', 'file_type': 'csv'}
+
+    def test_identical_in_flight_requests_are_deduplicated(self):
+        # Test that a second identical request reuses the pending job
+        with override_settings(REPORT_JOBS_EAGER=False):
+            first = self.client.post(reverse('report-job-create'), self.payload, format='json')
+            second = self.client.post(reverse('report-job-create'), self.payload, format='json')
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertTrue(second.data['deduplicated'])
+        self.assertEqual(ReportJob.objects.count(), 1)
+        download = self.client.get(first.data['download_url'])
+        self.assertEqual(download.status_code, status.HTTP_409_CONFLICT)
+
+    def test_stale_in_flight_job_is_not_reused(self):
+        # Test that a job left in flight by a dead worker is failed after REPORT_JOBS_TIMEOUT and a new one is created
+        with override_settings(REPORT_JOBS_EAGER=False, REPORT_JOBS_TIMEOUT=60):
+            first = self.client.post(reverse('report-job-create'), self.payload, format='json')
+            ReportJob.objects.filter(pk=first.data['id']).update(status='RUNNING', started_at=now() - timedelta(minutes=5))
+            second = self.client.post(reverse('report-job-create'), self.payload, format='json')
+        self.assertNotEqual(first.data['id'], second.data['id'])
+        self.assertFalse(second.data['deduplicated'])
+        stale = ReportJob.objects.get(pk=first.data['id'])
+        self.assertEqual((stale.status, stale.in_flight_key), ('FAILED', None))
+
+    def test_in_flight_key_is_unique(self):
+        # Test that the database refuses a second in-flight job for the same report, whichever process creates it
+        from django.db import IntegrityError, transaction
+        from ..services.report_jobs import fingerprint
+        key = fingerprint('SALES_EXPORT', {})
+        ReportJob.objects.create(kind='SALES_EXPORT', fingerprint=key, in_flight_key=key)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReportJob.objects.create(kind='SALES_EXPORT', fingerprint=key, in_flight_key=key)
+
+    def test_other_integrity_errors_are_raised(self):
+        # Test that an INSERT failing on another constraint is raised after a bounded number of attempts
+        from unittest import mock
+        from django.db import IntegrityError
+        from ..services.report_jobs import SUBMIT_ATTEMPTS, submit_report_job
+        with mock.patch.object(ReportJob.objects, 'create', side_effect=IntegrityError) as create, self.assertRaises(IntegrityError):
+            submit_report_job('SALES_EXPORT', {}, user=self.user)
+        self.assertEqual(create.call_count, SUBMIT_ATTEMPTS)
+
+    def test_job_completes_and_downloads(self):
+        # Test polling a finished job and downloading its file
+        with override_settings(REPORT_JOBS_EAGER=True, REPORT_JOBS_DIR=self.report_dir.name):
+            created = self.client.post(reverse('report-job-create'), self.payload, format='json')
+            detail = self.client.get(created.data['status_url'])
+            download = self.client.get(created.data['download_url'])
+        self.assertEqual(detail.data['status'], 'SUCCEEDED')
+        self.assertEqual(download.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(download.streaming_content).decode().splitlines(), ['Category,Revenue,Tax'])
+
+# Test cases for the top customers by lifetime value view
+class TopCustomersViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='analyst', password='testpass'))
+        for name, amount in (('small', '10.00'), ('large', '500.00'), ('medium', '100.00')):
+            customer = Customer.objects.create(name=name, email=f"{name}@example.com", country="US")
+            Order.objects.create(customer=customer, total_amount=Decimal(amount))
+
+    def test_top_customers_ordered_by_lifetime_value(self):
+        # Test that customers come back ordered by lifetime value and limited
+        response = self.client.get(reverse('top-customers'), {'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['name'] for row in response.data], ['large', 'medium'])
+        self.assertEqual(response.data[0]['total_spent'], '500.00')
+
+    def test_invalid_limit_is_rejected(self):
+        # Test that a limit below 1 or not a number is a client error, not a server error
+        for limit in ('-1', '0', 'x'):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.client.get(reverse('top-customers'), {'limit': limit}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test cases for the inventory reservation view
+class InventoryReservationViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='checkout', password='testpass'))
+        self.laptop = Product.objects.create(name="Laptop", price=Decimal('1500.00'), SKU="LAPTOP1")
+        self.phone = Product.objects.create(name="Phone", price=Decimal('500.00'), SKU="PHONE1")
+        Inventory.objects.create(product=self.laptop, quantity=2, last_restocked_date=now())
+        Inventory.objects.create(product=self.phone, quantity=5, last_restocked_date=now())
+        self.url = reverse('inventory-reserve')
+
+    def test_multi_item_reservation(self):
+        # Test that every item of a reservation is decremented
+        response = self.client.post(self.url, {'items': [{'product_id': self.laptop.pk, 'quantity': 2}, {'product_id': self.phone.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Inventory.objects.get(product=self.laptop).quantity, 0)
+        self.assertEqual(Inventory.objects.get(product=self.phone).quantity, 4)
+
+    def test_reservation_is_all_or_nothing(self):
+        # Test that a shortfall on one item leaves the stock of every item untouched
+        response = self.client.post(self.url, {'items': [{'product_id': self.laptop.pk, 'quantity': 3}, {'product_id': self.phone.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['shortfalls'], [{'product_id': self.laptop.pk, 'requested': 3, 'available': 2}])
+        self.assertEqual(Inventory.objects.get(product=self.laptop).quantity, 2)
+        self.assertEqual(Inventory.objects.get(product=self.phone).quantity, 5)
+
+
+# Test cases for the request instrumentation middleware and stats view
+class InstrumentationViewTest(APITestCase):
+    def setUp(self):
+        from ..instrumentation import request_stats, service_stats
+        request_stats.reset()
+        service_stats.reset()
+        self.client.force_authenticate(User.objects.create_user(username='ops', password='testpass'))
+
+    def test_server_timing_header(self):
+        # Test that responses carry total, DB and service spans in the Server-Timing header
+        response = self.client.get(reverse('sales_analytics'), {'start_date': '2024-01-01', 'end_date': '2024-12-31'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('SalesAnalytics-summary;dur=', response['Server-Timing'])
+
+    def test_stats_report_percentiles_per_route(self):
+        # Test that the stats view reports per-route and per-service percentiles
+        for _ in range(3):
+            self.client.get(reverse('top-customers'))
+        response = self.client.get(reverse('instrumentation-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        route = response.data['routes']['GET /api/customers/top-ltv/']
+        self.assertEqual(route['count'], 3)
+        self.assertLessEqual(route['p50_ms'], route['p99_ms'])
+        self.assertGreater(route['mean_queries'], 0)
+
+
+# Test cases for the sales time series view
+class SalesTimeSeriesViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='dashboard', password='testpass'))
+
+    def test_time_series_buckets(self):
+        # Test that the range is returned as one bucket per day
+        response = self.client.get(reverse('sales-timeseries'), {'start_date': '2024-05-01', 'end_date': '2024-05-07', 'interval': 'day'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['buckets']), 7)
+        self.assertEqual(response.data['series'], [])
+
+    def test_invalid_interval(self):
+        # Test that an unknown interval is rejected
+        response = self.client.get(reverse('sales-timeseries'), {'interval': 'hour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_too_many_buckets(self):
+        # Test that a range longer than the bucket limit is rejected, a coarser interval is accepted
+        params = {'start_date': '2000-01-01', 'end_date': '2024-12-31', 'interval': 'day'}
+        response = self.client.get(reverse('sales-timeseries'), params)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('sales-timeseries'), {**params, 'interval': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['buckets']), 300)
+
+
+# Test cases for tax per customer country
+class SalesTaxViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='accountant', password='testpass'))
+        for country, total in (("US", '100.00'), ("US", '50.00'), ("NZ", '10.00')):
+            customer = Customer.objects.create(name=f"{country} {total}", email=f"{country}{total}@example.com", country=country)
+            Order.objects.create(customer=customer, total_amount=Decimal(total), order_date=timezone.make_aware(timezone.datetime(2024, 2, 10)))
+
+    def test_tax_by_country(self):
+        # Test that orders are taxed at their country's rate and the default rate otherwise
+        response = self.client.get(reverse('sales-tax'), {'start_date': '2024-01-01', 'end_date': '2024-03-31'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['country'], row['orders'], row['tax']) for row in response.data], [("US", 2, Decimal('10.50')), ("NZ", 1, Decimal('0.50'))])
+
+    def test_invalid_dates(self):
+        # Test that a malformed date is rejected
+        response = self.client.get(reverse('sales-tax'), {'start_date': '2024/01/01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test cases for the keyset-paginated customer and product listings
+class ListingViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='lister', password='testpass'))
+        category = Category.objects.create(name="Electronics")
+        tags = [Tag.objects.create(name=name) for name in ("new", "sale")]
+        for i in range(30):
+            product = Product.objects.create(name=f"Product {i}", description="", price=Decimal('10.00'), SKU=f"SKU{i}", category=category)
+            product.tags.set(tags)
+            Customer.objects.create(name=f"Customer {i}", email=f"customer{i}@example.com", country="US" if i % 2 else "UK")
+
+    def test_product_pages_take_constant_queries(self):
+        # Test that a page of products with category and tags is served in a fixed number of queries
+        with self.assertNumQueries(2): # page, then one tags prefetch
+            response = self.client.get(reverse('product-list'), {'page_size': 25})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertEqual(len(response.data['results'][0]['tags']), 2)
+
+    def test_category_filter(self):
+        # Test that products are filtered by category id and a non-integer category is a client error
+        category = Category.objects.get()
+        response = self.client.get(reverse('product-list'), {'category': category.pk, 'page_size': 50, 'fields': 'id,category'})
+        self.assertEqual({row['category'] for row in response.data['results']}, {category.pk})
+        self.assertEqual(len(response.data['results']), 30)
+        response = self.client.get(reverse('product-list'), {'category': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"error": "category must be an integer."})
+
+    def test_cursor_walks_every_customer_once(self):
+        # Test that following the next cursor returns every customer exactly once
+        seen, url, params = [], reverse('customer-list'), {'page_size': 7, 'fields': 'id,name'}
+        while url:
+            response = self.client.get(url, params)
+            seen += [row['id'] for row in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(seen, sorted(Customer.objects.values_list('id', flat=True)))
+
+    def test_sparse_fieldset(self):
+        # Test that only the requested fields are returned
+        response = self.client.get(reverse('customer-list'), {'fields': 'id,country', 'country': 'US'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 15)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'country'})
+        response = self.client.get(reverse('product-list'), {'fields': 'name'})
+        self.assertEqual(set(response.data['results'][0]), {'name'})
+        response = self.client.get(reverse('product-list'), {'fields': 'id,category,tags'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'category', 'tags'})
+
+
+import json
+from rest_framework.renderers import JSONRenderer
+from ..renderers import FastJSONRenderer
+from ..serializers import ProductReadSerializer, CustomerReadSerializer, ProductSerializer, CustomerSerializer
+
+# Test cases for the orjson renderer and the read-only fast path serializers
+class FastRenderingTest(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Electronics")
+        self.product = Product.objects.create(name="Laptop", description="", price=Decimal('1500.00'), SKU="LAPTOP1", category=category)
+        self.product.tags.set([Tag.objects.create(name="new")])
+        self.customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+        Order.objects.create(customer=self.customer, total_amount=Decimal('99.90'))
+        self.customer.refresh_from_db()
+
+    def test_read_serializers_match_model_serializers(self):
+        # Test that the fast path renders exactly what the ModelSerializers render
+        for fast, slow, instance in ((ProductReadSerializer, ProductSerializer, self.product), (CustomerReadSerializer, CustomerSerializer, self.customer)):
+            with self.subTest(serializer=slow.__name__):
+                self.assertEqual(json.loads(FastJSONRenderer().render(fast(instance).data)), json.loads(JSONRenderer().render(slow(instance).data)))
+        self.assertEqual(set(CustomerReadSerializer(self.customer, fields=['id', 'total_spent']).data), {'id', 'total_spent'})
+
+    def test_decimals_in_rows(self):
+        # Test that Decimals in values() rows are encoded as numbers, like DRF's JSON renderer does
+        self.assertEqual(FastJSONRenderer().render([{'revenue': Decimal('12.50')}]), b'[{"revenue":12.5}]')
+
+
+from ..services.columnar_engine import columnar_engine
+
+# Test cases for the ad-hoc analytics query view
+class AnalyticsQueryViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='explorer', password='testpass'))
+        columnar_engine.store = None # reload from this test's data
+        product = Product.objects.create(name="Laptop", description="", price=Decimal('1500.00'), SKU="LAPTOP1", category=Category.objects.create(name="Electronics"))
+        Inventory.objects.create(product=product, quantity=10, last_restocked_date=now())
+        customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+        order = Order.objects.create(customer=customer, total_amount=Decimal('3000.00'), status='SHIPPED')
+        OrderItem.objects.create(order=order, product=product, quantity=2, price_at_time_of_order=Decimal('1500.00'))
+
+    def test_group_by_query(self):
+        # Test that the engine answers a columnar group-by
+        response = self.client.get(reverse('analytics-query'), {'group_by': 'category,status', 'country': 'US'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['columns'], {'category': ['Electronics'], 'status': ['SHIPPED'], 'revenue': [3000.0], 'units': [2], 'lines': [1]})
+
+    def test_unknown_dimension(self):
+        # Test that unknown dimensions are rejected
+        response = self.client.get(reverse('analytics-query'), {'group_by': 'colour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_limit_is_rejected(self):
+        # Test that a limit below 1 is a client error instead of a truncated result
+        for limit in ('-1', '0', 'x'):
+            with self.subTest(limit=limit):
+                response = self.client.get(reverse('analytics-query'), {'group_by': 'category', 'limit': limit})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command
+from django.test import LiveServerTestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from ..models import CustomerRecommendation
+from ..services.analytics_cache import analytics_cache
+
+# Test cases for the async views, on committed data because their queries run on other threads' connections
+class AsyncViewTest(LiveServerTestCase):
+    def setUp(self):
+        self.token = str(RefreshToken.for_user(User.objects.create_user(username='async', password='testpass')).access_token)
+        category = Category.objects.create(name="Electronics")
+        self.laptop = Product.objects.create(name="Laptop", description="", price=Decimal('1500.00'), SKU="LAPTOP1", category=category)
+        Inventory.objects.create(product=self.laptop, quantity=10, last_restocked_date=now())
+        self.customer = Customer.objects.create(name="John Doe", email="john@example.com", country="US")
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('3000.00'), order_date=timezone.make_aware(timezone.datetime(2024, 5, 10)))
+        OrderItem.objects.create(order=order, product=self.laptop, quantity=2, price_at_time_of_order=Decimal('1500.00'))
+        self.dates = {'start_date': '2024-05-01', 'end_date': '2024-05-31'}
+
+    def test_sales_analytics_matches_sync_view(self):
+        # Test that the concurrently computed summary is the one the sync view returns
+        sync = self.client.get(reverse('sales_analytics'), {**self.dates, 'limit': 5})
+        analytics_cache.bump_data_version()
+        response = self.client.get(reverse('async-sales-analytics'), {**self.dates, 'limit': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual([Decimal(row['revenue']) for row in response.json()['revenue_by_category']], [Decimal('3000.00')])
+
+    def test_sales_data_requires_token(self):
+        # Test that the async sales data view authenticates like SalesDataView
+        self.assertEqual(self.client.get(reverse('async-sales-data'), self.dates).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse('async-sales-data'), self.dates, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [{'product__category__name': "Electronics", 'revenue': 3000.0}])
+
+    def test_recommendations(self):
+        # Test that precomputed recommendations are served and unknown customers get a 404
+        CustomerRecommendation.objects.create(customer=self.customer, product=self.laptop, rank=1, score=1)
+        response = self.client.get(reverse('async-product-recommendations', kwargs={'customer_id': self.customer.id}))
+        self.assertEqual([product['SKU'] for product in response.json()], ["LAPTOP1"])
+        response = self.client.get(reverse('async-product-recommendations', kwargs={'customer_id': 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_load_test_command(self):
+        # Test that the harness loads each target over HTTP and reports latency percentiles
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'load.json'
+            call_command('load_test', f"sync={self.live_server_url}{reverse('sales_analytics')}", f"async={self.live_server_url}{reverse('async-sales-analytics')}",
+                         requests=6, concurrency=3, warmup=1, output=str(output), stdout=StringIO())
+            report = json.loads(output.read_text())
+        self.assertEqual(set(report['results']), {'sync', 'async'})
+        for result in report['results'].values():
+            self.assertEqual((result['requests'], result['errors']), (6, 0))
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+from unittest import mock
+from django.test import override_settings
+from ..routers import PIN_COOKIE, AnalyticsReplicaRouter, replica_status
+
+
+@override_settings(ANALYTICS_REPLICA_DATABASE='replica', REPLICA_PIN_SECONDS=15)
+class ReplicaPinningTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='stocker', password='testpass'))
+        product = Product.objects.create(name="Pinned Product", price=10, SKU="PIN1", category=Category.objects.create(name="Garden"))
+        self.inventory = Inventory.objects.create(product=product, quantity=5, last_restocked_date=now())
+        self.customer = Customer.objects.create(name="Reader", email="reader@example.com", country="US")
+        replica_status.reset()
+        self.addCleanup(replica_status.reset)
+
+    def test_inventory_update_pins_reads_to_primary(self):
+        # Test that an inventory write sets the pin cookie and later recommendation reads skip the replica
+        reads = []
+        db_for_read = AnalyticsReplicaRouter.db_for_read
+
+        def route(router, model, **hints):
+            reads.append(db_for_read(router, model, **hints))
+            return None # run on the test database, there is no replica server here
+
+        with mock.patch('ecommerce.routers.replication_lag', return_value=0), \
+             mock.patch.object(AnalyticsReplicaRouter, 'db_for_read', route):
+            response = self.client.get(reverse('product-recommendations', kwargs={'customer_id': self.customer.pk}))
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+            response = self.client.post(reverse('inventory-update', kwargs={'pk': self.inventory.pk}),
+                                        {'quantity': 8, 'last_restocked_date': now(), 'product': self.inventory.product_id}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 15)
+            pinned_from = len(reads)
+            self.client.get(reverse('product-recommendations', kwargs={'customer_id': self.customer.pk}))
+        self.assertIn('replica', reads[:pinned_from])
+        self.assertEqual(set(reads[pinned_from:]) - {None}, {'default'}) # None are the plain reads, e.g. of the user
+
+
+class InventoryRestockViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='warehouse', password='testpass'))
+        self.bolt = Product.objects.create(name="Bolt", price=Decimal('0.10'), SKU="BOLT1")
+        self.nut = Product.objects.create(name="Nut", price=Decimal('0.05'), SKU="NUT1")
+        Inventory.objects.create(product=self.bolt, quantity=100, last_restocked_date=now())
+        self.url = reverse('inventory-restock')
+
+    def test_json_batch(self):
+        # Test that a JSON batch returns counts and per-row results
+        response = self.client.post(self.url, {'items': [{'sku': 'BOLT1', 'delta': 50}, {'product_id': self.nut.pk, 'quantity': 20}, {'sku': 'BOLT1'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['updated'], response.data['created'], response.data['rejected']), (1, 1, 1))
+        self.assertEqual(response.data['rows'][2]['error'], 'delta_or_quantity_required')
+        self.assertEqual(Inventory.objects.get(product=self.bolt).quantity, 150)
+
+    def test_csv_batch(self):
+        # Test that a text/csv body is accepted and malformed batches are refused
+        response = self.client.post(self.url, "sku,delta\nBOLT1,-30\n", content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Inventory.objects.get(product=self.bolt).quantity, 70)
+        self.assertEqual(self.client.post(self.url, "sku,amount\nBOLT1,1\n", content_type='text/csv').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(self.url, {'items': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class LowStockInventoryViewTest(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='planner', password='testpass'))
+        for number, (quantity, threshold) in enumerate([(3, 5), (40, 5), (12, 20), (0, 1)]):
+            product = Product.objects.create(name=f"Item {number}", price=Decimal('1.00'), SKU=f"ITEM{number}")
+            Inventory.objects.create(product=product, quantity=quantity, low_stock_threshold=threshold, last_restocked_date=now())
+
+    def test_lists_rows_below_their_threshold(self):
+        # Test that only rows below their own threshold are listed, lowest stock first
+        response = self.client.get(reverse('inventory-low-stock'), {'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([(item['sku'], item['quantity'], item['threshold']) for item in response.data['items']], [('ITEM3', 0, 1), ('ITEM0', 3, 5)])
+        self.assertEqual(self.client.get(reverse('inventory-low-stock'), {'limit': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import SalesDataView, InventoryUpdateView, ExportSalesReportView, CustomerInfoView,sales_analytics_view, ProductRecommendationView
+from .views import SalesDataView, InventoryUpdateView, ExportSalesReportView, CustomerInfoView,sales_analytics_view, ProductRecommendationView, AnalyticsCacheStatsView, ReportJobCreateView, ReportJobDetailView, ReportJobDownloadView, TopCustomersView, BulkOrderIngestView, InventoryReservationView, InventoryRestockView, LowStockInventoryView, InstrumentationStatsView, CustomerChurnView, SalesTaxView, SalesTimeSeriesView, CustomerListView, ProductListView, AnalyticsQueryView, async_sales_data_view, async_sales_analytics_view, async_product_recommendation_view
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
@@ -7,15 +7,37 @@ urlpatterns = [
     # URL for fetching sales data within a date range
     path('sales/', SalesDataView.as_view(), name='sales-data'),
 
+    # URL for revenue and units bucketed by day, week or month
+    path('sales/timeseries/', SalesTimeSeriesView.as_view(), name='sales-timeseries'),
+
     # URL for updating inventory based on a specific product
     path('inventory/<int:pk>/', InventoryUpdateView.as_view(), name='inventory-update'),
 
+    # URL for atomically reserving stock for several products
+    path('inventory/reserve/', InventoryReservationView.as_view(), name='inventory-reserve'),
+
+    # URL for restocking or adjusting many inventory rows from a JSON or CSV batch
+    path('inventory/restock/', InventoryRestockView.as_view(), name='inventory-restock'),
+
+    # URL for listing inventory below its low-stock threshold
+    path('inventory/low-stock/', LowStockInventoryView.as_view(), name='inventory-low-stock'),
+
+    # URL for ingesting orders in bulk
+    path('orders/bulk/', BulkOrderIngestView.as_view(), name='orders-bulk'),
+
     # URL for exporting sales data into an Excel file
     path('export-sales/', ExportSalesReportView.as_view(), name='export-sales'),
 
     # URL for retrieving customer details 
     path('customer/<int:pk>/', CustomerInfoView.as_view(), name='customer-info'),
 
+    # URLs for keyset-paginated customer and product listings with ?fields= sparse fieldsets
+    path('customers/', CustomerListView.as_view(), name='customer-list'),
+    path('products/', ProductListView.as_view(), name='product-list'),
+
+    # URL for the customers with the highest lifetime value
+    path('customers/top-ltv/', TopCustomersView.as_view(), name='top-customers'),
+
     # URL for obtaining JWT tokens (login)
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
 
@@ -27,4 +49,29 @@ urlpatterns = [
 
     # URL for viewing sales analytics
     path('sales-analytics/', sales_analytics_view, name='sales_analytics'),
+
+    # URL for churn by registration cohort and country
+    path('sales-analytics/churn/', CustomerChurnView.as_view(), name='customer-churn'),
+
+    # URL for tax per customer country
+    path('sales-analytics/tax/', SalesTaxView.as_view(), name='sales-tax'),
+
+    # URL for ad-hoc group-by queries answered by the in-process columnar engine
+    path('analytics/query/', AnalyticsQueryView.as_view(), name='analytics-query'),
+
+    # URL for the analytics cache hit/miss counters
+    path('sales-analytics/cache-stats/', AnalyticsCacheStatsView.as_view(), name='analytics-cache-stats'),
+
+    # URLs for queueing background report jobs, polling their status and downloading the result
+    path('reports/', ReportJobCreateView.as_view(), name='report-job-create'),
+    path('reports/<uuid:pk>/', ReportJobDetailView.as_view(), name='report-job-detail'),
+    path('reports/<uuid:pk>/download/', ReportJobDownloadView.as_view(), name='report-job-download'),
+
+    # URLs for the async variants of the sales data, sales analytics and recommendation views, for ASGI servers
+    path('async/sales/', async_sales_data_view, name='async-sales-data'),
+    path('async/sales-analytics/', async_sales_analytics_view, name='async-sales-analytics'),
+    path('async/recommendation/<int:customer_id>/', async_product_recommendation_view, name='async-product-recommendations'),
+
+    # URL for the rolling request and service timing statistics
+    path('instrumentation/stats/', InstrumentationStatsView.as_view(), name='instrumentation-stats'),
 ]
@@ -3,17 +3,20 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from .models import Inventory, Customer
-from .serializers import InventorySerializer, CustomerSerializer, ProductSerializer
+from .serializers import InventorySerializer, CustomerSerializer, ProductSerializer, CustomerLifetimeValueSerializer, InventoryReservationSerializer, ProductReadSerializer, CustomerReadSerializer
+from .renderers import FAST_RENDERER_CLASSES, FastJsonResponse
+from .services.inventory_reservation import reserve_stock, InsufficientStock
+from django.db import transaction
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # API view to handle fetching sales data within a date range
 class SalesDataView(APIView):
     permission_classes= [IsAuthenticated] # Requires authentication
+    renderer_classes = FAST_RENDERER_CLASSES
 
     # Handles GET requests to retrieve sales data based on date range
     def get(self, request):
-        print("hi")
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date')
         # If either start or end date is missing, return an error
@@ -25,7 +28,7 @@ class SalesDataView(APIView):
         end_date = datetime.strptime(end_date, '%Y-%m-%d')
         # Perform sales analytics calculation for the given date range by calling the SalesAnalytics class
         sales_analytics = SalesAnalytics(start_date, end_date)
-        revenue_by_category = sales_analytics.calculate_revenue_by_category()
+        revenue_by_category = analytics_cache.get_or_compute('sales', start_date, end_date, lambda: list(sales_analytics.calculate_revenue_by_category()))
         return Response(revenue_by_category)
     
 # API view to handle inventory updates
@@ -34,47 +37,124 @@ class InventoryUpdateView(APIView):
 
     # Handles POST requests to update inventory by product ID
     def post(self, request, pk):
-        print("hi")
-        try:
-            print(pk)
-            inventory = Inventory.objects.get(pk=pk) # Retrieve the inventory id
-            print(pk)
-        except Inventory.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND) # Return 404 if inventory not found
-        # Serialize the incoming data for inventory update
-        serializer = InventorySerializer(inventory, data=request.data)
-        if serializer.is_valid():
-            serializer.save() # Save the updated inventory
-            return Response(serializer.data)
+        with transaction.atomic():
+            try:
+                inventory = Inventory.objects.select_for_update().get(pk=pk) # Retrieve and lock the inventory row so concurrent writers cannot interleave
+            except Inventory.DoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND) # Return 404 if inventory not found
+            # Serialize the incoming data for inventory update
+            serializer = InventorySerializer(inventory, data=request.data)
+            if serializer.is_valid():
+                serializer.save() # Save the updated inventory
+                return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    
 
-from django.http import HttpResponse
-from openpyxl import Workbook
+# API view to reserve stock for several products at once
+class InventoryReservationView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    # Handles POST requests with {"items": [{"product_id", "quantity"}]}, all items are reserved or none
+    def post(self, request):
+        serializer = InventoryReservationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            reserved = reserve_stock((item['product_id'], item['quantity']) for item in serializer.validated_data['items'])
+        except InsufficientStock as exc:
+            return Response({"error": str(exc), "shortfalls": exc.shortfalls}, status=status.HTTP_409_CONFLICT)
+        return Response({"reserved": reserved})
+
+import csv
+from .services.inventory_restock import RESTOCK_MAX_ROWS, read_restock_csv, restock_inventory
+
+# API view to restock or adjust many inventory rows in one request
+class InventoryRestockView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    # Handles POST requests with {"items": [{"sku" or "product_id", "delta" or "quantity", "restocked_at"}]}
+    # or a text/csv body with those columns, returns per-row results
+    def post(self, request):
+        if request.content_type.startswith('text/csv'):
+            try:
+                rows = read_restock_csv(request.body.decode('utf-8-sig'))
+            except (UnicodeDecodeError, ValueError, csv.Error) as exc:
+                return Response({"error": f"Invalid CSV: {exc}"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            rows = request.data.get('items') if isinstance(request.data, dict) else None
+            if not isinstance(rows, list):
+                return Response({"error": "Provide the rows as a list under \"items\"."}, status=status.HTTP_400_BAD_REQUEST)
+        if not rows or len(rows) > RESTOCK_MAX_ROWS:
+            return Response({"error": f"Provide between 1 and {RESTOCK_MAX_ROWS} rows."}, status=status.HTTP_400_BAD_REQUEST)
+        results = restock_inventory(rows)
+        counts = {outcome: sum(1 for result in results if result['status'] == outcome) for outcome in ('updated', 'created', 'rejected')}
+        return Response({**counts, 'rows': results})
+
+# API view listing inventory below its low-stock threshold, lowest stock first
+class LowStockInventoryView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    # Handles GET requests, limit caps the number of rows returned (default 100, at most 1000)
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 100)), 1000)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+        low_stock = Inventory.objects.low_stock()
+        rows = (low_stock.order_by('quantity', 'product_id')
+                .values('product_id', 'product__SKU', 'product__name', 'quantity', 'low_stock_threshold', 'last_restocked_date')[:limit])
+        items = [{'product_id': row['product_id'], 'sku': row['product__SKU'], 'name': row['product__name'], 'quantity': row['quantity'],
+                  'threshold': row['low_stock_threshold'], 'last_restocked_date': row['last_restocked_date']} for row in rows]
+        return Response({'count': low_stock.count(), 'items': items})
+
+
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from tempfile import NamedTemporaryFile
+from .services.sales_report import CATEGORY_HEADER, ORDER_LINE_HEADER, category_rows, order_line_rows, csv_stream, write_xlsx
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
 class ExportSalesReportView(APIView):
     #permission_classes = [IsAuthenticated]
-    # Handles GET requests to generate a sales report and export it as an Excel file
+    # Handles GET requests to generate a sales report and export it as an Excel or CSV file.
+    # detail=lines exports individual order items instead of category totals, file_type=csv streams CSV rows.
     def get(self, request):
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+        # Default to the last 30 days if no date range is provided
+        start_date = request.query_params.get('start_date', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'))
+        end_date = request.query_params.get('end_date', datetime.now().strftime('%Y-%m-%d'))
         start_date = datetime.strptime(start_date, '%Y-%m-%d')
         end_date = datetime.strptime(end_date, '%Y-%m-%d')
-        sales_analytics = SalesAnalytics(start_date, end_date)
-        report_data = sales_analytics.calculate_revenue_by_category()
-        print(report_data)
-        # Create an Excel workbook and populate it with sales data
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Monthly Sales Report"
-        ws.append(['Category', 'Revenue'])
-        for item in report_data:
-            ws.append([item['product__category__name'], item['revenue']]) # Append sales data to Excel sheet
-
-        # Prepare the response to return the Excel file
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="sales_report.xlsx"'
-        wb.save(response)  # Save the workbook to the response
-        return response
+        detail = request.query_params.get('detail', 'categories')
+        file_type = request.query_params.get('file_type', 'xlsx')
+        if detail not in ('categories', 'lines') or file_type not in ('xlsx', 'csv'):
+            return Response({"error": "detail must be 'categories' or 'lines' and file_type must be 'xlsx' or 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if detail == 'lines':
+            header, rows = ORDER_LINE_HEADER, order_line_rows(start_date, end_date)
+        else:
+            header, rows = CATEGORY_HEADER, category_rows(SalesAnalytics(start_date, end_date))
+
+        if file_type == 'csv':
+            # Stream CSV rows straight from the database cursor chunks
+            response = StreamingHttpResponse(csv_stream(header, rows), content_type='text/csv')
+            response['Content-Disposition'] = f'attachment; filename="sales_report.csv"'
+            return response
+
+        if detail == 'categories':
+            # Category totals are small, so the workbook is written directly into the response
+            response = HttpResponse(content_type=XLSX_CONTENT_TYPE)
+            response['Content-Disposition'] = f'attachment; filename="sales_report.xlsx"'
+            write_xlsx(response, "Monthly Sales Report", header, rows)
+            return response
+
+        # Order lines are written to a temporary file in write-only mode and streamed back from disk
+        report_file = NamedTemporaryFile(suffix='.xlsx')
+        write_xlsx(report_file, "Sales Order Lines", header, rows)
+        report_file.seek(0)
+        return FileResponse(report_file, as_attachment=True, filename="sales_report.xlsx", content_type=XLSX_CONTENT_TYPE)
 
 # API view to retrieve customer information
 class CustomerInfoView(APIView):
@@ -85,18 +165,88 @@ class CustomerInfoView(APIView):
             customer = Customer.objects.get(pk=pk) # Retrieve customer 
         except Customer.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND) # Return 404 if customer not found
-        serializer = CustomerSerializer(customer) # Serialize the customer data
+        serializer = CustomerSerializer(customer, context={'request': request}) # Serialize the customer data, honouring ?fields=
         return Response(serializer.data)
 
+from rest_framework.generics import ListAPIView
+from rest_framework.exceptions import ValidationError
+from .models import Product
+from .pagination import KeysetPagination
+
+class SparseListAPIView(ListAPIView):
+    # Keyset-paginated list whose queryset only loads the columns and relations the ?fields= selection needs
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+    pagination_class = KeysetPagination
+
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        return {field.strip() for field in fields.split(',')} if fields else None
+
+    def get_queryset(self):
+        queryset = self.queryset.all()
+        requested = self.requested_fields()
+        if requested is not None:
+            model = queryset.model
+            columns = [field.name for field in model._meta.concrete_fields if field.name in requested]
+            queryset = queryset.only('id', *columns) # id is always loaded for the cursor
+        return queryset
+
+# API view listing customers, optionally filtered by country
+class CustomerListView(SparseListAPIView):
+    queryset = Customer.objects.all()
+    serializer_class = CustomerReadSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.query_params.get('country'):
+            queryset = queryset.filter(country=self.request.query_params['country'])
+        return queryset
+
+# API view listing products with their tags loaded in one extra query per page, categories are rendered as ids
+class ProductListView(SparseListAPIView):
+    queryset = Product.objects.all()
+    serializer_class = ProductReadSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        requested = self.requested_fields()
+        if requested is None or 'tags' in requested:
+            queryset = queryset.prefetch_related('tags')
+        if self.request.query_params.get('category'):
+            try:
+                category_id = int(self.request.query_params['category'])
+            except ValueError:
+                raise ValidationError({"error": "category must be an integer."})
+            queryset = queryset.filter(category_id=category_id)
+        return queryset
+
+# API view listing the customers with the highest lifetime value
+class TopCustomersView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    # Handles GET requests, served from the denormalized total_spent index
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 1000)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
+        customers = Customer.objects.order_by('-total_spent', 'id')[:limit]
+        return Response(CustomerReadSerializer(customers, many=True, fields=CustomerLifetimeValueSerializer.Meta.fields).data)
+
     
-from django.http import JsonResponse
 from django.shortcuts import render
 from datetime import datetime
-from .models import OrderItem, Customer  
+from .models import OrderItem, Customer, CustomerRecommendation
 from ecommerce.services.sales_analytics import SalesAnalytics  
 from datetime import timedelta
 from .services.sales_analytics import SalesAnalytics
 from .services.recommendation_engine import RecommendationEngine
+from .services.analytics_cache import analytics_cache
+from .services.sketches import HLL_RELATIVE_ERROR
 
 def sales_analytics_view(request):
     # Default to the last 30 days if no date range is provided
@@ -107,27 +257,282 @@ def sales_analytics_view(request):
     start_date = datetime.strptime(start_date, '%Y-%m-%d')
     end_date = datetime.strptime(end_date, '%Y-%m-%d')
 
+    # limit caps the top sellers per country, approx=true answers top sellers and churn from sketches (with error_bounds)
+    approx = request.GET.get('approx', '').lower() == 'true'
+    try:
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        return FastJsonResponse({"error": "limit must be an integer."}, status=400)
+
     # Perform sales analytics for the date range by calling the SalesAnalytics class
     analytics = SalesAnalytics(start_date, end_date)
-    revenue_by_category = analytics.calculate_revenue_by_category()
-    top_selling_products = analytics.top_selling_products_by_country()
-    churn_rate = analytics.calculate_customer_churn_rate()
-    # Return the analytics data in JSON format
-    data = {
-        'revenue_by_category': list(revenue_by_category), 'top_selling_products': list(top_selling_products),'customer_churn_rate': churn_rate,
-    }
-    return JsonResponse(data)
+
+    # Return the analytics data in JSON format, reusing the cached result while the data version is unchanged
+    data = analytics_cache.get_or_compute(f'sales-analytics:{limit}:{approx}', start_date, end_date, lambda: analytics.summary(limit, approx))
+    return FastJsonResponse(data)
+
+# API view for revenue and units bucketed by day, week or month, optionally split by category or country
+class SalesTimeSeriesView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        interval = request.query_params.get('interval', 'day')
+        split_by = request.query_params.get('split_by') or None
+        try:
+            start_date = datetime.strptime(request.query_params.get('start_date', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')), '%Y-%m-%d')
+            end_date = datetime.strptime(request.query_params.get('end_date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+        except ValueError:
+            return Response({"error": "Dates must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date > end_date:
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+
+        analytics = SalesAnalytics(start_date, end_date)
+        try:
+            data = analytics_cache.get_or_compute(f'timeseries:{interval}:{split_by}', start_date, end_date, lambda: analytics.revenue_time_series(interval, split_by))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data)
+
+# API view for churn as of a date, overall and by registration cohort and country
+class CustomerChurnView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        try:
+            as_of = datetime.strptime(request.query_params.get('as_of', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+            inactivity_days = int(request.query_params.get('inactivity_days', 180))
+        except ValueError:
+            return Response({"error": "as_of must be YYYY-MM-DD and inactivity_days an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if inactivity_days <= 0:
+            return Response({"error": "inactivity_days must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        analytics = SalesAnalytics(as_of - timedelta(days=inactivity_days), as_of)
+        if request.query_params.get('approx', '').lower() == 'true':
+            # Overall churn only, from the active customer sketches
+            data = analytics_cache.get_or_compute(f'churn-approx:{inactivity_days}', as_of, as_of, lambda: {
+                'as_of': as_of.isoformat(),
+                'inactivity_days': inactivity_days,
+                'churn_rate': analytics.calculate_customer_churn_rate(as_of, inactivity_days, approx=True),
+                'error_bounds': {'active_customers_relative_standard_error': HLL_RELATIVE_ERROR},
+            })
+            return Response(data)
+        data = analytics_cache.get_or_compute(f'churn:{inactivity_days}', as_of, as_of, lambda: analytics.churn_breakdown(as_of, inactivity_days))
+        return Response(data)
+
+# API view for orders, order totals and tax per customer country in a date range
+class SalesTaxView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        try:
+            start_date = datetime.strptime(request.query_params.get('start_date', (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')), '%Y-%m-%d')
+            end_date = datetime.strptime(request.query_params.get('end_date', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+        except ValueError:
+            return Response({"error": "Dates must be in YYYY-MM-DD format."}, status=status.HTTP_400_BAD_REQUEST)
+        if start_date > end_date:
+            return Response({"error": "start_date must not be after end_date."}, status=status.HTTP_400_BAD_REQUEST)
+
+        analytics = SalesAnalytics(start_date, end_date)
+        data = analytics_cache.get_or_compute('tax', start_date, end_date, lambda: list(analytics.tax_by_country()))
+        return Response(data)
+
+# API view exposing the analytics cache hit/miss counters for sizing
+class AnalyticsCacheStatsView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    def get(self, request):
+        return Response(analytics_cache.stats())
 
 # API view for product recommendation based on customer data    
 class ProductRecommendationView(APIView):
-    # Handles GET requests to fetch product recommendations for a customer
+    # Handles GET requests to fetch product recommendations for a customer.
+    # Recommendations precomputed by generate_recommendations are served directly, source=live forces the engine.
+    renderer_classes = FAST_RENDERER_CLASSES
+
     def get(self, request, customer_id):
         try:
             customer = Customer.objects.get(id=customer_id) # Retrieve the customer
-            recommendation_engine = RecommendationEngine(customer) #Call the Recommendation engine with customer
-            recommended_products = recommendation_engine.suggest_from_similar_customers() # Get recommended products
-            serializer = ProductSerializer(recommended_products, many=True) # Serialize the recommended products
+            recommended_products = []
+            if request.query_params.get('source') != 'live':
+                precomputed = CustomerRecommendation.objects.filter(customer=customer).select_related('product').prefetch_related('product__tags').order_by('rank')
+                recommended_products = [recommendation.product for recommendation in precomputed]
+            if not recommended_products:
+                recommendation_engine = RecommendationEngine(customer) #Call the Recommendation engine with customer
+                recommended_products = recommendation_engine.suggest_from_similar_customers() # Get recommended products
+            serializer = ProductReadSerializer(recommended_products, many=True) # Serialize the recommended products
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Customer.DoesNotExist:
             return Response({"error": "Customer not found."}, status=status.HTTP_404_NOT_FOUND) # Return 404 if customer not found
 
+from django.urls import reverse
+from .models import ReportJob
+from .serializers import ReportJobRequestSerializer, ReportJobSerializer
+from .services.report_jobs import submit_report_job, report_dir
+
+REPORT_CONTENT_TYPES = {'xlsx': XLSX_CONTENT_TYPE, 'csv': 'text/csv', 'json': 'application/json'}
+
+# API view to queue a background report job
+class ReportJobCreateView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    # Handles POST requests to create a report job, identical in-flight requests share one job
+    def post(self, request):
+        serializer = ReportJobRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        kind, parameters = serializer.job_parameters()
+        job, created = submit_report_job(kind, parameters, user=request.user)
+        data = ReportJobSerializer(job).data
+        data['deduplicated'] = not created
+        data['status_url'] = reverse('report-job-detail', kwargs={'pk': job.pk})
+        data['download_url'] = reverse('report-job-download', kwargs={'pk': job.pk})
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+# API view to poll the status of a report job. Jobs are shared between users: identical requests from different
+# users are deduplicated onto one job and reports hold no per-user data, so any authenticated user may read a job.
+class ReportJobDetailView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            job = ReportJob.objects.get(pk=pk)
+        except ReportJob.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(ReportJobSerializer(job).data)
+
+# API view to download the file of a finished report job, shared like the job itself
+class ReportJobDownloadView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            job = ReportJob.objects.get(pk=pk)
+        except ReportJob.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if job.status != 'SUCCEEDED':
+            return Response({"error": f"Report is {job.status.lower()}.", "status": job.status}, status=status.HTTP_409_CONFLICT)
+        extension = job.result_file.rsplit('.', 1)[-1]
+        return FileResponse(open(report_dir() / job.result_file, 'rb'), as_attachment=True, filename=f"sales_report.{extension}", content_type=REPORT_CONTENT_TYPES[extension])
+
+from .serializers import BulkOrderIngestSerializer
+from .services.order_ingestion import ingest_orders
+
+# API view to ingest a batch of orders with set-based stock updates
+class BulkOrderIngestView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    # Handles POST requests with {"orders": [...]}, returns per-order and per-line results
+    def post(self, request):
+        serializer = BulkOrderIngestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = ingest_orders(serializer.validated_data['orders'])
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({'created': created, 'rejected': len(results) - created, 'orders': results}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+from . import instrumentation
+
+# API view exposing rolling per-route and per-service latency percentiles
+class InstrumentationStatsView(APIView):
+    permission_classes= [IsAuthenticated]
+
+    def get(self, request):
+        return Response(instrumentation.stats())
+
+from django.conf import settings
+from .services.columnar_store import DIMENSIONS, MEASURES
+from .services.columnar_engine import columnar_engine
+
+# API view answering ad-hoc group-by/filter/sum questions over order lines from the in-process columnar engine.
+# group_by and measures take comma separated names, any dimension name filters on comma separated values.
+class AnalyticsQueryView(APIView):
+    permission_classes= [IsAuthenticated]
+    renderer_classes = FAST_RENDERER_CLASSES
+
+    def get(self, request):
+        if not settings.COLUMNAR_ENGINE_ENABLED:
+            return Response({"error": "The columnar analytics engine is disabled."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        params = request.query_params
+        group_by = [name for name in params.get('group_by', '').split(',') if name]
+        measures = [name for name in params.get('measures', ','.join(MEASURES)).split(',') if name]
+        unknown = [name for name in group_by if name not in DIMENSIONS] + [name for name in measures if name not in MEASURES]
+        if unknown:
+            return Response({"error": f"Unknown dimensions or measures: {', '.join(unknown)}."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            filters = {name: [int(value) if name == 'product' else value for value in params[name].split(',')] for name in DIMENSIONS if name in params}
+            start_date = datetime.strptime(params['start_date'], '%Y-%m-%d').date() if 'start_date' in params else None
+            end_date = datetime.strptime(params['end_date'], '%Y-%m-%d').date() if 'end_date' in params else None
+            limit = int(params['limit']) if 'limit' in params else None
+        except ValueError:
+            return Response({"error": "Dates must be YYYY-MM-DD, product and limit integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and limit < 1:
+            return Response({"error": "limit must be at least 1."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(columnar_engine.query(group_by, measures, filters, start_date, end_date, limit))
+
+
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .renderers import FastJSONRenderer
+from .services.sales_analytics import in_worker_thread
+
+# Async variants of the sales data, sales analytics and recommendation endpoints for ASGI deployments.
+# A request waiting on the database no longer holds a server thread. Point lookups use the async ORM, which runs
+# every query on one shared thread, aggregations run through in_worker_thread so they proceed in parallel.
+# Responses match the synchronous views.
+
+async def _authenticate(request):
+    # JWT authentication for plain async views, the user or None like DRF's IsAuthenticated check
+    try:
+        result = await in_worker_thread(lambda: JWTAuthentication().authenticate(request))
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+def _json(data, status=200):
+    # Rendered like the FAST_RENDERER_CLASSES responses of the synchronous API views
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
+
+async def async_sales_data_view(request):
+    if await _authenticate(request) is None:
+        return _json({"detail": "Authentication credentials were not provided."}, status=401)
+    if not request.GET.get('start_date') or not request.GET.get('end_date'):
+        return _json({"error": "Please provide a start and end date."}, status=400)
+    try:
+        start_date = datetime.strptime(request.GET['start_date'], '%Y-%m-%d')
+        end_date = datetime.strptime(request.GET['end_date'], '%Y-%m-%d')
+    except ValueError:
+        return _json({"error": "Dates must be in YYYY-MM-DD format."}, status=400)
+    sales_analytics = SalesAnalytics(start_date, end_date)
+    data = await analytics_cache.aget_or_compute('sales', start_date, end_date, lambda: in_worker_thread(lambda: list(sales_analytics.calculate_revenue_by_category())))
+    return _json(data)
+
+async def async_sales_analytics_view(request):
+    start_date = request.GET.get('start_date', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'))
+    end_date = request.GET.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+    try:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d')
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+    except ValueError:
+        return FastJsonResponse({"error": "Dates must be in YYYY-MM-DD format and limit an integer."}, status=400)
+    approx = request.GET.get('approx', '').lower() == 'true'
+    analytics = SalesAnalytics(start_date, end_date)
+    # Same cache entry as sales_analytics_view, revenue, top sellers and churn run concurrently on a miss
+    data = await analytics_cache.aget_or_compute(f'sales-analytics:{limit}:{approx}', start_date, end_date, lambda: analytics.asummary(limit, approx))
+    return FastJsonResponse(data)
+
+async def async_product_recommendation_view(request, customer_id):
+    try:
+        customer = await Customer.objects.aget(id=customer_id)
+    except Customer.DoesNotExist:
+        return _json({"error": "Customer not found."}, status=404)
+    recommended_products = []
+    if request.GET.get('source') != 'live':
+        precomputed = CustomerRecommendation.objects.filter(customer=customer).select_related('product').prefetch_related('product__tags').order_by('rank')
+        recommended_products = [recommendation.product async for recommendation in precomputed]
+    if not recommended_products:
+        recommended_products = await in_worker_thread(RecommendationEngine(customer).suggest_from_similar_customers)
+    return _json(ProductReadSerializer(recommended_products, many=True).data)
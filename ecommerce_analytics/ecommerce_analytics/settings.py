@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecommerce.instrumentation.RequestInstrumentationMiddleware',
+    'ecommerce.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,9 +91,102 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),    
         'HOST': os.getenv('DB_HOST'),           
         'PORT': os.getenv('DB_PORT'),                 
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')), # seconds a thread keeps its connection open between requests
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True', # check a reused connection before its first query
     }
 }
 
+# DB_POOL_SIZE > 0 serves connections from a bounded per-process pool instead of one persistent connection per thread,
+# so many WSGI threads or async worker threads share DB_POOL_SIZE connections. Threads hand their connection back at
+# the end of each request, waiting up to DB_POOL_TIMEOUT seconds for one when all are in use.
+if int(os.getenv('DB_POOL_SIZE', '0')) > 0:
+    DATABASES['default'].update({
+        'ENGINE': 'ecommerce.db_backends.mysql_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE')),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+            'MAX_LIFETIME': int(os.getenv('DB_POOL_MAX_LIFETIME', '3600')), # below MySQL's wait_timeout
+        },
+    })
+
+# DB_ENGINE=sqlite runs against the bundled SQLite database (or DB_NAME) without a MySQL server,
+# used for local benchmarking
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.getenv('DB_NAME') or BASE_DIR / 'db.sqlite3',
+    }
+
+# Read replica for the heavy analytics and report queries, enabled by DB_REPLICA_HOST (MySQL) or, with
+# DB_ENGINE=sqlite, by DB_REPLICA_NAME pointing at a second SQLite file. Reads fall back to the primary while the
+# replica is unreachable or more than REPLICA_MAX_LAG seconds behind, checked every REPLICA_CHECK_INTERVAL seconds,
+# and for REPLICA_PIN_SECONDS after a client's own write so inventory updates are read back from the primary.
+if os.getenv('DB_REPLICA_HOST') and os.getenv('DB_ENGINE') != 'sqlite':
+    DATABASES['replica'] = dict(DATABASES['default'], HOST=os.getenv('DB_REPLICA_HOST'), PORT=os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']))
+elif os.getenv('DB_REPLICA_NAME') and os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES['replica'] = dict(DATABASES['default'], NAME=os.getenv('DB_REPLICA_NAME'))
+if 'replica' in DATABASES:
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['ecommerce.routers.AnalyticsReplicaRouter']
+ANALYTICS_REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', '30'))
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', '10'))
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+
+# Caches
+# The analytics cache holds computed results for the sales analytics endpoints. It works with
+# the local-memory backend (per process) or the file backend (shared between workers on a host).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': os.getenv('ANALYTICS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('ANALYTICS_CACHE_LOCATION', 'analytics'),
+        'TIMEOUT': int(os.getenv('ANALYTICS_CACHE_TIMEOUT', '300')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('ANALYTICS_CACHE_MAX_ENTRIES', '256')),
+        },
+    },
+}
+
+ANALYTICS_CACHE_ALIAS = 'analytics'
+
+# Request instrumentation: samples kept per route, slowest queries kept per request and the
+# threshold above which a request is logged with its slowest queries
+INSTRUMENTATION_WINDOW = int(os.getenv('INSTRUMENTATION_WINDOW', '1000'))
+INSTRUMENTATION_SLOW_QUERIES = 5
+INSTRUMENTATION_SLOW_REQUEST_MS = int(os.getenv('INSTRUMENTATION_SLOW_REQUEST_MS', '1000'))
+
+# Background report jobs are computed by a local thread pool and written to REPORT_JOBS_DIR. Jobs still in flight
+# after REPORT_JOBS_TIMEOUT seconds are marked failed, so a crashed worker does not block identical requests.
+REPORT_JOBS_DIR = Path(os.getenv('REPORT_JOBS_DIR', BASE_DIR / 'reports'))
+REPORT_JOBS_WORKERS = int(os.getenv('REPORT_JOBS_WORKERS', '2'))
+REPORT_JOBS_EAGER = os.getenv('REPORT_JOBS_EAGER') == 'True'
+REPORT_JOBS_TIMEOUT = int(os.getenv('REPORT_JOBS_TIMEOUT', '3600'))
+
+# In-process columnar engine behind /api/analytics/query/, fully reloaded once older than COLUMNAR_ENGINE_MAX_AGE seconds
+COLUMNAR_ENGINE_ENABLED = os.getenv('COLUMNAR_ENGINE_ENABLED', 'True') == 'True'
+COLUMNAR_ENGINE_MAX_AGE = int(os.getenv('COLUMNAR_ENGINE_MAX_AGE', '300'))
+# Directory of the memory-mapped snapshots written by build_analytics_snapshot, unset to always load from the database
+ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR')
+
+# Tax rate of countries without a TaxRate row, and how long each process reuses the rates it loaded
+DEFAULT_TAX_RATE = os.getenv('DEFAULT_TAX_RATE', '0.05')
+TAX_RATE_CACHE_TIMEOUT = int(os.getenv('TAX_RATE_CACHE_TIMEOUT', '300'))
+
+# Low-stock alerts: sinks (dotted paths of classes with send(alerts)) receive the alerts of products whose stock fell
+# below their threshold in batches, LOW_STOCK_ALERT_BATCH_SECONDS after the first or once LOW_STOCK_ALERT_BATCH_SIZE
+# are queued, and at most once per product every LOW_STOCK_ALERT_COOLDOWN seconds. EAGER sends them on commit.
+LOW_STOCK_ALERT_SINKS = [sink for sink in os.getenv('LOW_STOCK_ALERT_SINKS', 'ecommerce.services.low_stock.LoggingSink').split(',') if sink]
+LOW_STOCK_ALERT_WEBHOOK_URL = os.getenv('LOW_STOCK_ALERT_WEBHOOK_URL')
+LOW_STOCK_ALERT_BATCH_SECONDS = float(os.getenv('LOW_STOCK_ALERT_BATCH_SECONDS', '5'))
+LOW_STOCK_ALERT_BATCH_SIZE = int(os.getenv('LOW_STOCK_ALERT_BATCH_SIZE', '500'))
+LOW_STOCK_ALERT_COOLDOWN = int(os.getenv('LOW_STOCK_ALERT_COOLDOWN', '3600'))
+LOW_STOCK_ALERTS_EAGER = os.getenv('LOW_STOCK_ALERTS_EAGER') == 'True'
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {